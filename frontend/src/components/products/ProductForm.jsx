@@ -1,6 +1,6 @@
 import React, { useState, useEffect } from 'react';
 import { useNavigate, useParams, useLocation, Link } from 'react-router-dom';
-import { productService, storeService, supplierService } from '../../utils/api';
+import { batchService, productService } from '../../utils/api';
 import {
   Box,
   Typography,
@@ -84,22 +84,26 @@ const ProductForm = () => {
     const fetchData = async () => {
       try {
         setLoading(true);
-        const [storesResponse, suppliersResponse] = await Promise.all([
-          storeService.getAllStores(),
-          supplierService.getAllSuppliers()
-        ]);
+        // Load the stores, suppliers and the product being edited in one round trip
+        const requests = [
+          { id: 'stores', method: 'GET', path: '/api/stores/' },
+          { id: 'suppliers', method: 'GET', path: '/api/suppliers/' }
+        ];
+        if (isEditMode) {
+          requests.push({ id: 'product', method: 'GET', path: `/api/products/${id}/` });
+        }
+        const results = await batchService.fetchAll(requests);
 
         // Handle different API response formats
-        const storesList = storesResponse.data.stores || storesResponse.data || [];
-        const suppliersList = suppliersResponse.data.suppliers || suppliersResponse.data || [];
+        const storesList = results.stores.stores || results.stores || [];
+        const suppliersList = results.suppliers.suppliers || results.suppliers || [];
 
         setStores(storesList);
         setAllSuppliers(suppliersList);
         setFilteredSuppliers(suppliersList);
 
         if (isEditMode) {
-          const productResponse = await productService.getProduct(id);
-          const product = productResponse.data.product || productResponse.data;
+          const product = results.product.product || results.product;
 
           setFormData({
             name: product.name || '',
@@ -1,6 +1,6 @@
 import React, { useState, useEffect } from 'react';
 import { useNavigate, useParams, Link } from 'react-router-dom';
-import { storeService, userService } from '../../utils/api';
+import { batchService, storeService } from '../../utils/api';
 import {
   Box,
   Typography,
@@ -82,24 +82,27 @@ const StoreForm = () => {
     const fetchData = async () => {
       setLoading(true);
       try {
-        // Fetch managers and staff
-        const [managersResponse, staffResponse] = await Promise.all([
-          userService.getAllManagers(),
-          userService.getAllStaff()
-        ]);
+        // Fetch managers, staff and the store being edited in one round trip
+        const requests = [
+          { id: 'managers', method: 'GET', path: '/api/auth/managers/' },
+          { id: 'staff', method: 'GET', path: '/api/auth/staff/' }
+        ];
+        if (isEditMode) {
+          requests.push({ id: 'store', method: 'GET', path: `/api/stores/${id}/` });
+        }
+        const results = await batchService.fetchAll(requests);
 
-        if (managersResponse.data && managersResponse.data.users) {
-          setManagers(managersResponse.data.users);
+        if (results.managers && results.managers.users) {
+          setManagers(results.managers.users);
         }
 
-        if (staffResponse.data && staffResponse.data.users) {
-          setEmployees(staffResponse.data.users);
+        if (results.staff && results.staff.users) {
+          setEmployees(results.staff.users);
         }
 
-        // If in edit mode, fetch store data
+        // If in edit mode, use the store data
         if (isEditMode) {
-          const storeResponse = await storeService.getStore(id);
-          const store = storeResponse.data.store || storeResponse.data;
+          const store = results.store.store || results.store;
 
           setFormData({
             name: store.name || '',
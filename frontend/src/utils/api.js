@@ -125,5 +125,23 @@ export const dashboardService = {
   getLowStockProducts: () => api.get('/dashboard/low-stock/'),
 };
 
+// Batch service: runs several API requests in one round trip
+export const batchService = {
+  // Resolves to the response bodies keyed by request id; rejects like axios if any request failed
+  fetchAll: async (requests) => {
+    const response = await api.post('/batch/', { requests });
+    const results = {};
+    for (const result of response.data.responses) {
+      if (result.status >= 400) {
+        const error = new Error(`Request ${result.id} failed with status ${result.status}`);
+        error.response = { status: result.status, data: result.body };
+        throw error;
+      }
+      results[result.id] = result.body;
+    }
+    return results;
+  },
+};
+
 // Export all services
 export { api, authService, userService };
\ No newline at end of file
@@ -0,0 +1,92 @@
+"""
+Read/write splitting between the primary database and read replicas.
+
+The replicas are the database aliases listed in DATABASE_READ_REPLICAS.
+ReplicaRoutingMiddleware lets the reads of a GET, HEAD or OPTIONS request
+go to a random replica; everything else, including management commands,
+signals outside requests and every other method, uses the primary.
+
+A request switches to the primary as soon as it writes or enters a
+transaction, so it reads its own writes. After a write the user is pinned
+to the primary for DATABASE_REPLICA_STICKY_SECONDS, long enough for the
+replicas to catch up, so the next page load sees the change too.
+"""
+import contextvars
+import random
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, connections
+
+# Whether reads of the current request may go to a replica
+_use_replicas = contextvars.ContextVar('use_replicas', default=False)
+# Whether the current request has written to the primary
+_wrote = contextvars.ContextVar('wrote', default=False)
+
+READ_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+
+def read_replicas():
+    return list(getattr(settings, 'DATABASE_READ_REPLICAS', ()))
+
+
+def _sticky_seconds():
+    return getattr(settings, 'DATABASE_REPLICA_STICKY_SECONDS', 5)
+
+
+def _pin_key(user_id):
+    return f'db-primary-pin:{user_id}'
+
+
+class PrimaryReplicaRouter:
+    """Send reads to a replica when the current request allows it, and writes to the primary."""
+
+    def db_for_read(self, model, **hints):
+        replicas = read_replicas()
+        if not replicas or not _use_replicas.get() or _wrote.get():
+            return DEFAULT_DB_ALIAS
+        if connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            # Reads inside a transaction must see its writes
+            return DEFAULT_DB_ALIAS
+        return random.choice(replicas)
+
+    def db_for_write(self, model, **hints):
+        if _use_replicas.get():
+            _wrote.set(True)
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        pool = {DEFAULT_DB_ALIAS, *read_replicas()}
+        if obj1._state.db in pool and obj2._state.db in pool:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Replicas receive the schema from the primary
+        return db not in read_replicas()
+
+
+class ReplicaRoutingMiddleware:
+    """
+    Let the reads of safe requests go to the replicas, unless the user wrote
+    recently. Must come after the authentication middleware.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not read_replicas():
+            return self.get_response(request)
+
+        user_id = request.user.id if request.user.is_authenticated else None
+        pinned = user_id is not None and cache.get(_pin_key(user_id)) is not None
+        use_replicas = _use_replicas.set(request.method in READ_METHODS and not pinned)
+        wrote = _wrote.set(False)
+        try:
+            response = self.get_response(request)
+            if (_wrote.get() or request.method not in READ_METHODS) and user_id is not None:
+                cache.set(_pin_key(user_id), True, timeout=_sticky_seconds())
+            return response
+        finally:
+            _use_replicas.reset(use_replicas)
+            _wrote.reset(wrote)
@@ -0,0 +1,270 @@
+"""
+Per-request instrumentation: SQL queries, view and serialization time, response size.
+
+For a sample of requests (REQUEST_TIMING_SAMPLE_RATE), RequestTimingMiddleware
+records every SQL query run on any database while the request is handled,
+including the queries of worker threads that copy the request's context
+(batch sub-requests, shard scatter-gather). It reports the totals in a
+Server-Timing header, which browsers show in the network panel, and as one
+JSON log line on this module's logger.
+
+A query shape that runs REQUEST_TIMING_REPEATED_QUERY_THRESHOLD or more
+times in one request is logged as a warning with the view name; it usually
+means a loop that should use select_related, prefetch_related or one IN query.
+
+View time runs from the start of the view (process_view) until its response
+comes back here, so the middleware before the view, such as token
+authentication, is not part of it. Serialization time is the time from the
+view's last query (or its start, if it ran none) until it returned: building
+and encoding the response body from the data already fetched. It is measured
+here, so it covers every response whatever builds it.
+
+SQL timings reveal how the server works, so the Server-Timing header is only
+sent to admins and while DEBUG is on; the log line is written either way.
+"""
+import contextvars
+import json
+import logging
+import random
+import re
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+
+logger = logging.getLogger(__name__)
+
+# Recorder of the request being handled, if it is sampled
+_recorder = contextvars.ContextVar('request_recorder', default=None)
+# Query counter of the request being handled, kept for every request by the metrics
+_counter = contextvars.ContextVar('query_counter', default=None)
+
+_PARAMETER_LIST = re.compile(r'%s(?:, %s)+')
+_NUMBER = re.compile(r'\b\d+\b')
+
+# Longest SQL text written to the logs
+LOGGED_SQL_LENGTH = 300
+
+
+def _sample_rate():
+    return getattr(settings, 'REQUEST_TIMING_SAMPLE_RATE', 0.01)
+
+
+def _repeat_threshold():
+    return getattr(settings, 'REQUEST_TIMING_REPEATED_QUERY_THRESHOLD', 5)
+
+
+def query_shape(sql):
+    """Collapse parameter lists and inlined numbers, so repeats of one query compare equal."""
+    return _NUMBER.sub('N', _PARAMETER_LIST.sub('%s, ...', sql))
+
+
+class RequestRecorder:
+    """
+    Queries and view start time of one request. Queries are only appended,
+    so the worker threads of a request can share it without a lock.
+    """
+
+    def __init__(self):
+        self.queries = []  # (sql, seconds, alias, finished)
+        self.view_started = None
+
+    @property
+    def sql_seconds(self):
+        return sum(query[1] for query in self.queries)
+
+    def view_seconds(self, view_finished):
+        """Return the time from the view's start until it finished, or 0 if no view ran."""
+        if self.view_started is None:
+            return 0.0
+        return max(view_finished - self.view_started, 0.0)
+
+    def serialize_seconds(self, view_finished):
+        """Return the time from the view's last query, or its start, until it finished."""
+        if self.view_started is None:
+            return 0.0
+        data_ready = max([self.view_started] + [query[3] for query in self.queries])
+        return max(view_finished - data_ready, 0.0)
+
+    def slowest_query(self):
+        return max(self.queries, key=lambda query: query[1], default=None)
+
+    def repeated_queries(self, threshold):
+        """Return (shape, count, seconds) for each query shape run at least threshold times."""
+        counts = Counter()
+        seconds = Counter()
+        for sql, duration, *_ in self.queries:
+            shape = query_shape(sql)
+            counts[shape] += 1
+            seconds[shape] += duration
+        return [(shape, count, seconds[shape]) for shape, count in counts.most_common() if count >= threshold]
+
+
+class QueryCounter:
+    """Number and total time of the queries of one request, without keeping the queries."""
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+        # Only contended when worker threads of the same request finish queries at once
+        self._lock = threading.Lock()
+
+    def add(self, seconds):
+        with self._lock:
+            self.count += 1
+            self.seconds += seconds
+
+
+def _record_query(execute, sql, params, many, context):
+    recorder = _recorder.get()
+    counter = _counter.get()
+    if recorder is None and counter is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        finished = time.perf_counter()
+        if counter is not None:
+            counter.add(finished - started)
+        if recorder is not None:
+            recorder.queries.append((sql, finished - started, context['connection'].alias, finished))
+
+
+def _install(connection):
+    if _record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_record_query)
+
+
+def _install_all():
+    for alias in connections:
+        _install(connections[alias])
+
+
+def _on_connection_created(sender, connection, **kwargs):
+    # Connections opened by worker threads are recorded too
+    _install(connection)
+
+
+connection_created.connect(_on_connection_created)
+
+
+def _ms(seconds):
+    return round(seconds * 1000, 2)
+
+
+@contextmanager
+def recording():
+    """
+    Record the queries of the code inside, or join
+    the recording already in progress, and yield the recorder.
+    """
+    recorder = _recorder.get()
+    if recorder is not None:
+        yield recorder
+        return
+    _install_all()
+    recorder = RequestRecorder()
+    token = _recorder.set(recorder)
+    try:
+        yield recorder
+    finally:
+        _recorder.reset(token)
+
+
+@contextmanager
+def counting_queries():
+    """
+    Count the queries of the code inside and their total time, or join the
+    count already in progress, and yield the QueryCounter.
+    """
+    counter = _counter.get()
+    if counter is not None:
+        yield counter
+        return
+    _install_all()
+    counter = QueryCounter()
+    token = _counter.set(counter)
+    try:
+        yield counter
+    finally:
+        _counter.reset(token)
+
+
+class RequestTimingMiddleware:
+    """
+    Record the SQL queries, view time, serialization time and response size of
+    sampled requests, and report them in a log line and, for admins and while
+    DEBUG is on, a Server-Timing header.
+    Should come right after the authentication middleware, so the queries that
+    load the user are counted.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if random.random() >= _sample_rate():
+            return self.get_response(request)
+
+        with recording() as recorder:
+            response = self.get_response(request)
+        finished = time.perf_counter()
+        self._report(request, response, recorder, recorder.view_seconds(finished), recorder.serialize_seconds(finished))
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        recorder = _recorder.get()
+        if recorder is not None:
+            recorder.view_started = time.perf_counter()
+
+    def _report(self, request, response, recorder, view_seconds, serialize_seconds):
+        match = getattr(request, 'resolver_match', None)
+        view_name = match.view_name if match else None
+        size = None if response.streaming else len(response.content)
+        slowest = recorder.slowest_query()
+
+        user = getattr(request, 'user', None)
+        if settings.DEBUG or getattr(user, 'role', None) == 'admin':
+            metrics = [f'sql;dur={_ms(recorder.sql_seconds)};desc="{len(recorder.queries)} queries"']
+            if slowest is not None:
+                metrics.append(f'sql-slowest;dur={_ms(slowest[1])}')
+            metrics.append(f'view;dur={_ms(view_seconds)}')
+            metrics.append(f'serialize;dur={_ms(serialize_seconds)}')
+            if size is not None:
+                metrics.append(f'bytes;desc="{size}"')
+            if response.has_header('Server-Timing'):
+                metrics.insert(0, response['Server-Timing'])
+            response['Server-Timing'] = ', '.join(metrics)
+
+        fields = {
+            'event': 'request',
+            'method': request.method,
+            'path': request.path,
+            'view': view_name,
+            'status': response.status_code,
+            'queries': len(recorder.queries),
+            'sql_ms': _ms(recorder.sql_seconds),
+            'slowest_query_ms': _ms(slowest[1]) if slowest else None,
+            'slowest_query': slowest[0][:LOGGED_SQL_LENGTH] if slowest else None,
+            'view_ms': _ms(view_seconds),
+            'serialize_ms': _ms(serialize_seconds),
+            'bytes': size,
+        }
+        logger.info(json.dumps(fields), extra={'request_timing': fields})
+
+        threshold = _repeat_threshold()
+        if not threshold:
+            return
+        for shape, count, seconds in recorder.repeated_queries(threshold):
+            logger.warning(json.dumps({
+                'event': 'repeated_query',
+                'view': view_name,
+                'path': request.path,
+                'count': count,
+                'sql_ms': _ms(seconds),
+                'query': shape[:LOGGED_SQL_LENGTH],
+            }))
@@ -0,0 +1,343 @@
+"""
+Prometheus metrics of the API, served at /metrics.
+
+MetricsMiddleware counts every request by view, method and status, and
+records its latency, SQL queries and response cache outcome. It also copies
+the bearer token cache statistics of TokenAuthMiddleware (see users.tokens).
+
+Each process writes its values to a memory-mapped file of its own in
+METRICS_DIR, so a request only holds a short, uncontended lock while it adds
+its values. /metrics, served by whichever worker gets the scrape, sums the
+files of all workers. Without METRICS_DIR the values live in anonymous memory
+and /metrics reports the serving process only.
+
+Clear METRICS_DIR when the service starts, as Prometheus expects counters to
+start from zero.
+
+SQL queries are only counted and timed here, without keeping their text, so
+every request can be measured; REQUEST_TIMING_SAMPLE_RATE still limits the
+full recording of ims_project.instrumentation.
+
+/metrics is served to admins, and to METRICS_ALLOWED_NETWORKS when it is set.
+"""
+import glob
+import json
+import math
+import mmap
+import os
+import struct
+import threading
+import time
+from ipaddress import ip_address, ip_network
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseForbidden
+from users.tokens import token_cache
+from .instrumentation import counting_queries
+
+DEFAULT_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# name: (type, help)
+FAMILIES = {
+    'ims_http_requests_total': ('counter', 'Requests handled, by view, method and status.'),
+    'ims_http_request_duration_seconds': ('histogram', 'Time to produce a response, by view.'),
+    'ims_http_requests_in_progress': ('gauge', 'Requests being handled.'),
+    'ims_db_queries_total': ('counter', 'SQL queries run by requests, by view.'),
+    'ims_db_query_duration_seconds_total': ('counter', 'Time spent in SQL queries by requests, by view.'),
+    'ims_response_cache_requests_total': ('counter', 'Responses of cached views, by view and result (hit or miss).'),
+    'ims_auth_token_cache_hits_total': ('counter', 'Bearer token lookups answered by the token cache.'),
+    'ims_auth_token_cache_misses_total': ('counter', 'Bearer token lookups that missed the token cache.'),
+    'ims_auth_token_cache_entries': ('gauge', 'Tokens held in the token caches of the workers.'),
+    'ims_worker_processes': ('gauge', 'Worker processes that have handled requests and are still running.'),
+}
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+_HEADER = struct.Struct('q')
+_LENGTH = struct.Struct('i')
+_VALUE = struct.Struct('d')
+
+
+def metrics_dir():
+    return getattr(settings, 'METRICS_DIR', None)
+
+
+def _latency_buckets():
+    return getattr(settings, 'METRICS_LATENCY_BUCKETS', DEFAULT_LATENCY_BUCKETS)
+
+
+def _key(family, sample='', **labels):
+    return json.dumps([family, sample, sorted(labels.items())])
+
+
+def _entry_size(encoded_key):
+    # The key length and the key are padded so the value is 8-byte aligned
+    return (_LENGTH.size + len(encoded_key) + 7) // 8 * 8 + _VALUE.size
+
+
+def _entries(data):
+    """Yield (key, value position) for each complete entry in the bytes of a values file."""
+    used = min(_HEADER.unpack_from(data, 0)[0], len(data)) if len(data) >= _HEADER.size else 0
+    position = _HEADER.size
+    while position + _LENGTH.size <= used:
+        length = _LENGTH.unpack_from(data, position)[0]
+        encoded_key = bytes(data[position + _LENGTH.size:position + _LENGTH.size + length])
+        size = _entry_size(encoded_key)
+        if position + size > used:
+            break
+        yield encoded_key.decode('utf-8'), position + size - _VALUE.size
+        position += size
+
+
+def read_values(data):
+    """Yield (key, value) for each complete entry in the bytes of a values file."""
+    for key, position in _entries(data):
+        yield key, _VALUE.unpack_from(data, position)[0]
+
+
+class MmapValues:
+    """
+    Float values by key in a memory-mapped file, or anonymous memory without
+    a path. One process writes; any process may read the file meanwhile.
+
+    Layout: the number of bytes in use, then one entry per key: the key
+    length, the UTF-8 key padded so the value is 8-byte aligned, and the value
+    as a double. A new entry is written before the bytes in use are updated,
+    so readers never see half an entry.
+    """
+
+    INITIAL_SIZE = 64 * 1024
+
+    def __init__(self, path=None):
+        self.path = path
+        self._lock = threading.Lock()
+        self._file = None
+        if path is None:
+            self._mmap = mmap.mmap(-1, self.INITIAL_SIZE)
+        else:
+            self._file = open(path, 'a+b')
+            if os.fstat(self._file.fileno()).st_size < self.INITIAL_SIZE:
+                self._file.truncate(self.INITIAL_SIZE)
+            self._mmap = mmap.mmap(self._file.fileno(), 0)
+        self._used = _HEADER.unpack_from(self._mmap, 0)[0] or _HEADER.size
+        # A file left by an earlier process with the same pid is carried on
+        self._positions = dict(_entries(self._mmap))
+
+    def _grow(self, needed):
+        size = len(self._mmap)
+        while size < needed:
+            size *= 2
+        if self._file is None:
+            grown = mmap.mmap(-1, size)
+            grown[:len(self._mmap)] = self._mmap[:]
+        else:
+            self._mmap.close()
+            self._file.truncate(size)
+            grown = mmap.mmap(self._file.fileno(), 0)
+        self._mmap = grown
+
+    def _position(self, key):
+        position = self._positions.get(key)
+        if position is None:
+            encoded_key = key.encode('utf-8')
+            size = _entry_size(encoded_key)
+            if self._used + size > len(self._mmap):
+                self._grow(self._used + size)
+            _LENGTH.pack_into(self._mmap, self._used, len(encoded_key))
+            self._mmap[self._used + _LENGTH.size:self._used + _LENGTH.size + len(encoded_key)] = encoded_key
+            position = self._used + size - _VALUE.size
+            _VALUE.pack_into(self._mmap, position, 0.0)
+            self._used += size
+            _HEADER.pack_into(self._mmap, 0, self._used)
+            self._positions[key] = position
+        return position
+
+    def update(self, increments=None, values=None):
+        """Add the increments and set the values, both dicts of key -> float, in one go."""
+        with self._lock:
+            for key, amount in (increments or {}).items():
+                position = self._position(key)
+                _VALUE.pack_into(self._mmap, position, _VALUE.unpack_from(self._mmap, position)[0] + amount)
+            for key, value in (values or {}).items():
+                _VALUE.pack_into(self._mmap, self._position(key), value)
+
+    def snapshot(self):
+        with self._lock:
+            return dict(read_values(self._mmap[:self._used]))
+
+
+_store = None
+_store_pid = None
+_store_lock = threading.Lock()
+
+
+def values_store():
+    """Return the values of this process, opening a new file after a fork."""
+    global _store, _store_pid
+    pid = os.getpid()
+    if _store_pid != pid:
+        with _store_lock:
+            if _store_pid != pid:
+                directory = metrics_dir()
+                path = None
+                if directory:
+                    os.makedirs(directory, exist_ok=True)
+                    path = os.path.join(directory, f'metrics-{pid}.db')
+                _store = MmapValues(path)
+                _store_pid = pid
+    return _store
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def collect():
+    """Return the values of all workers, summed by key, and the number of live workers."""
+    directory = metrics_dir()
+    if not directory:
+        return values_store().snapshot(), 1
+
+    totals = {}
+    workers = 0
+    for path in glob.glob(os.path.join(directory, 'metrics-*.db')):
+        try:
+            pid = int(os.path.basename(path)[len('metrics-'):-len('.db')])
+            with open(path, 'rb') as file:
+                data = file.read()
+        except (ValueError, OSError):
+            continue
+        alive = _pid_alive(pid)
+        workers += alive
+        for key, value in read_values(data):
+            if FAMILIES.get(json.loads(key)[0], ('counter',))[0] == 'gauge' and not alive:
+                # Gauges of workers that have exited no longer apply
+                continue
+            totals[key] = totals.get(key, 0.0) + value
+    return totals, workers
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_value(value):
+    if math.isinf(value):
+        return '+Inf' if value > 0 else '-Inf'
+    return repr(int(value)) if value == int(value) else repr(value)
+
+
+def _sample_line(name, labels, value):
+    if labels:
+        label_text = ','.join(f'{label}="{_escape(label_value)}"' for label, label_value in labels)
+        return f'{name}{{{label_text}}} {_format_value(value)}'
+    return f'{name} {_format_value(value)}'
+
+
+def render(values, workers):
+    """Render summed values in the Prometheus text exposition format."""
+    samples = {}
+    for key, value in values.items():
+        family, sample, labels = json.loads(key)
+        if family in FAMILIES:
+            samples.setdefault(family, []).append((sample, [tuple(label) for label in labels], value))
+    samples['ims_worker_processes'] = [('', [], workers)]
+
+    lines = []
+    for family, (kind, help_text) in FAMILIES.items():
+        lines.append(f'# HELP {family} {help_text}')
+        lines.append(f'# TYPE {family} {kind}')
+        if kind != 'histogram':
+            for _, labels, value in sorted(samples.get(family, [])):
+                lines.append(_sample_line(family, labels, value))
+            continue
+
+        # Buckets are stored per bucket; the exposition format wants them cumulative
+        series = {}
+        for sample, labels, value in samples.get(family, []):
+            le = dict(labels).get('le')
+            base = tuple(label for label in labels if label[0] != 'le')
+            series.setdefault(base, {})[le if sample == '_bucket' else sample] = value
+        for labels, observed in sorted(series.items()):
+            cumulative = 0.0
+            for bound in [*map(str, _latency_buckets()), '+Inf']:
+                cumulative += observed.get(bound, 0.0)
+                lines.append(_sample_line(f'{family}_bucket', sorted([*labels, ('le', bound)]), cumulative))
+            lines.append(_sample_line(f'{family}_sum', list(labels), observed.get('_sum', 0.0)))
+            lines.append(_sample_line(f'{family}_count', list(labels), cumulative))
+    return '\n'.join(lines) + '\n'
+
+
+def _bucket_for(seconds):
+    for bound in _latency_buckets():
+        if seconds <= bound:
+            return str(bound)
+    return '+Inf'
+
+
+class MetricsMiddleware:
+    """
+    Record every request in the metrics of this process. Should come right
+    after the authentication middleware, so the queries that load the user
+    are counted.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        store = values_store()
+        store.update({_key('ims_http_requests_in_progress'): 1})
+        started = time.perf_counter()
+        response = None
+        try:
+            with counting_queries() as queries:
+                response = self.get_response(request)
+            return response
+        finally:
+            seconds = time.perf_counter() - started
+            match = getattr(request, 'resolver_match', None)
+            view = match.view_name if match else 'unmatched'
+            status = response.status_code if response is not None else 500
+            increments = {
+                _key('ims_http_requests_in_progress'): -1,
+                _key('ims_http_requests_total', view=view, method=request.method, status=str(status)): 1,
+                _key('ims_http_request_duration_seconds', '_bucket', view=view, le=_bucket_for(seconds)): 1,
+                _key('ims_http_request_duration_seconds', '_sum', view=view): seconds,
+                _key('ims_db_queries_total', view=view): queries.count,
+                _key('ims_db_query_duration_seconds_total', view=view): queries.seconds,
+            }
+            cache_result = response.get('X-Cache') if response is not None else None
+            if cache_result:
+                increments[_key('ims_response_cache_requests_total', view=view, result=cache_result.lower())] = 1
+            token_stats = token_cache.stats()
+            store.update(increments, {
+                _key('ims_auth_token_cache_hits_total'): token_stats['hits'],
+                _key('ims_auth_token_cache_misses_total'): token_stats['misses'],
+                _key('ims_auth_token_cache_entries'): token_stats['size'],
+            })
+
+
+def _scrape_allowed(request):
+    if request.user.is_authenticated and request.user.role == 'admin':
+        return True
+    try:
+        address = ip_address(request.META.get('REMOTE_ADDR', ''))
+    except ValueError:
+        return False
+    return any(address in ip_network(network) for network in getattr(settings, 'METRICS_ALLOWED_NETWORKS', ()))
+
+
+def metrics_view(request):
+    """
+    Serve the metrics of all workers in the Prometheus text format. Open to
+    admins and to addresses in METRICS_ALLOWED_NETWORKS, which is empty by default.
+    """
+    if not _scrape_allowed(request):
+        return HttpResponseForbidden('Metrics are not available from this address')
+    return HttpResponse(render(*collect()), content_type=CONTENT_TYPE)
@@ -10,6 +10,8 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+import os
+import tempfile
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -53,7 +55,10 @@ MIDDLEWARE = [
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'ims_project.metrics.MetricsMiddleware',
+    'ims_project.instrumentation.RequestTimingMiddleware',
     'users.middleware.TokenAuthMiddleware',  # Add token authentication middleware
+    'ims_project.db_router.ReplicaRoutingMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -81,13 +86,79 @@ WSGI_APPLICATION = 'ims_project.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
+# The tuned SQLite backend (ims_project/sqlite_backend) runs the pragmas below on every
+# new connection. Transactions begin with SQLITE_TRANSACTION_MODE, and the write
+# transactions of ims_project.transactions.write_atomic with SQLITE_WRITE_TRANSACTION_MODE.
+# WAL lets readers and a writer work at once; IMMEDIATE makes writers queue for
+# busy_timeout instead of failing with "database is locked", while DEFERRED keeps
+# readers from queueing behind them. Connections are reused for DB_CONN_MAX_AGE seconds.
+# See "SQLite Tuning" in the README for the benchmark behind these defaults.
+# Each value can be overridden through the environment variable of the same name.
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
+        'ENGINE': 'ims_project.sqlite_backend',
         'NAME': BASE_DIR / 'db.sqlite3',
+        'CONN_MAX_AGE': int(os.environ.get('DB_CONN_MAX_AGE', 600)),
+        'OPTIONS': {
+            'transaction_mode': os.environ.get('SQLITE_TRANSACTION_MODE', 'DEFERRED'),
+            'write_transaction_mode': os.environ.get('SQLITE_WRITE_TRANSACTION_MODE', 'IMMEDIATE'),
+            'pragmas': {
+                'journal_mode': os.environ.get('SQLITE_JOURNAL_MODE', 'WAL'),
+                'synchronous': os.environ.get('SQLITE_SYNCHRONOUS', 'NORMAL'),
+                # Negative sizes are in KiB: 64 MiB of page cache per connection
+                'cache_size': int(os.environ.get('SQLITE_CACHE_SIZE', -64000)),
+                'mmap_size': int(os.environ.get('SQLITE_MMAP_SIZE', 256 * 1024 * 1024)),
+                'busy_timeout': int(os.environ.get('SQLITE_BUSY_TIMEOUT_MS', 5000)),
+                'temp_store': os.environ.get('SQLITE_TEMP_STORE', 'MEMORY'),
+            },
+        },
     }
 }
 
+# Read replicas: reads of GET requests go to one of DATABASE_READ_REPLICAS (see
+# ims_project/db_router.py), except for users who wrote in the last
+# DATABASE_REPLICA_STICKY_SECONDS. For local testing, DATABASE_REPLICA_PATHS takes a
+# comma-separated list of SQLite files kept up to date with `copy_sqlite_replica`;
+# for other replicas add their aliases to DATABASES and DATABASE_READ_REPLICAS
+DATABASE_READ_REPLICAS = []
+for index, path in enumerate(filter(None, os.environ.get('DATABASE_REPLICA_PATHS', '').split(','))):
+    alias = f'replica_{index + 1}'
+    DATABASES[alias] = {
+        **DATABASES['default'],
+        'NAME': f'file:{path.strip()}?mode=ro',
+        'OPTIONS': {
+            'pragmas': {
+                name: value for name, value in DATABASES['default']['OPTIONS']['pragmas'].items()
+                if name != 'journal_mode'
+            },
+        },
+        'TEST': {'MIRROR': 'default'},
+    }
+    DATABASE_READ_REPLICAS.append(alias)
+
+# Product sharding (see products/sharding.py): with PRODUCT_SHARDS set, each product lives
+# in the shard of its store, PRODUCT_SHARD_MAP ({store_id: alias}) pins stores to shards
+# and other stores go to PRODUCT_SHARDS[store_id % len(PRODUCT_SHARDS)]. For local testing,
+# PRODUCT_SHARD_PATHS takes a comma-separated list of SQLite files; run `migrate --database`
+# for each shard, then `shard_products` to move existing products. Shards hold no stores or
+# suppliers, so they cannot enforce foreign keys to them
+PRODUCT_SHARDS = []
+PRODUCT_SHARD_MAP = {}
+for index, path in enumerate(filter(None, os.environ.get('PRODUCT_SHARD_PATHS', '').split(','))):
+    alias = f'shard_{index + 1}'
+    DATABASES[alias] = {
+        **DATABASES['default'],
+        'NAME': path.strip(),
+        'OPTIONS': {
+            **DATABASES['default']['OPTIONS'],
+            'pragmas': {**DATABASES['default']['OPTIONS']['pragmas'], 'foreign_keys': 'OFF'},
+        },
+    }
+    PRODUCT_SHARDS.append(alias)
+
+DATABASE_ROUTERS = ['products.sharding.ProductShardRouter', 'ims_project.db_router.PrimaryReplicaRouter']
+DATABASE_REPLICA_STICKY_SECONDS = int(os.environ.get('DATABASE_REPLICA_STICKY_SECONDS', 5))
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -139,6 +210,109 @@ AUTHENTICATION_BACKENDS = [
     'django.contrib.auth.backends.ModelBackend',  # Keep this as a fallback
 ]
 
+# Login tokens are stored in the database and expire after this many hours. Each worker
+# caches up to AUTH_TOKEN_CACHE_SIZE tokens for AUTH_TOKEN_CACHE_TTL seconds, which is
+# also how long a token revoked in one worker can still be accepted by the others
+AUTH_TOKEN_LIFETIME_HOURS = 168
+AUTH_TOKEN_CACHE_SIZE = 10000
+AUTH_TOKEN_CACHE_TTL = 60
+
+# 'database' authenticates bearer tokens against the token table above. 'signed' makes
+# login return a short-lived signed access token carrying the user's id, role and store
+# ids, plus the stored token as a refresh token for /api/auth/token/refresh/. Access
+# tokens are revoked through the Django cache, which must be shared between workers
+# (e.g. Redis or Memcached) for a logout to reach all of them
+AUTH_TOKEN_MODE = 'database'
+AUTH_ACCESS_TOKEN_LIFETIME_SECONDS = 300
+
+# Seconds to keep each user's accessible store ids in the Django cache (0 disables it).
+# Entries are dropped when store managers, store employees or user roles change; use a
+# cache shared by all workers so every worker sees those invalidations
+STORE_SCOPE_CACHE_TIMEOUT = 0
+
+# Cache used for login token revocations, store scopes and API responses. The local
+# memory cache is per process; with several workers configure a shared backend such as
+# Redis or Memcached so invalidations reach every worker
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+
+# Seconds to cache the product, low stock, store and supplier lists and the dashboard
+# (0 disables it). Writes invalidate cached responses through per-store and per-supplier
+# version counters kept in the RESPONSE_CACHE_ALIAS cache
+RESPONSE_CACHE_TIMEOUT = 0
+RESPONSE_CACHE_ALIAS = 'default'
+
+# Delta sync: the high watermark of a sync trails the clock by SYNC_SETTLE_SECONDS so rows
+# from transactions still committing are not skipped. Tombstones are kept this many days
+# (see `purge_deletion_log`); older cursors must restart with a full sync
+SYNC_SETTLE_SECONDS = 2
+SYNC_DELETION_LOG_RETENTION_DAYS = 30
+
+# Stock event stream (/api/events/stock/): 'local' delivers events to the clients of the
+# worker that made the write; 'socket' also relays them to the other workers on this host
+# through Unix sockets in STOCK_EVENTS_SOCKET_DIR. Clients that fall more than
+# STOCK_EVENTS_QUEUE_SIZE events behind are sent an overflow event
+STOCK_EVENTS_BROKER = 'local'
+STOCK_EVENTS_SOCKET_DIR = Path(tempfile.gettempdir()) / 'ims-stock-events'
+STOCK_EVENTS_QUEUE_SIZE = 1000
+STOCK_EVENTS_HEARTBEAT_SECONDS = 15
+
+# Bootstrap reference data (/api/bootstrap/) is cached per version for this many seconds;
+# store, supplier and user changes move it to a new version
+REFERENCE_DATA_CACHE_TIMEOUT = 3600
+
+# Batch endpoint (/api/batch/): most sub-requests per batch, and how many consecutive
+# reads run concurrently (1 runs every sub-request in turn)
+BATCH_MAX_REQUESTS = 20
+BATCH_MAX_WORKERS = 4
+
+# Request instrumentation (ims_project/instrumentation.py): this share of requests records its
+# SQL queries and timings and logs them as JSON; admins, and everyone while DEBUG is on, also
+# get them in a Server-Timing header. A query shape run REQUEST_TIMING_REPEATED_QUERY_THRESHOLD
+# times in one request is logged as a likely N+1 query (0 disables it). Set
+# REQUEST_LOG_LEVEL=INFO to log every sampled request
+REQUEST_TIMING_SAMPLE_RATE = float(os.environ.get('REQUEST_TIMING_SAMPLE_RATE', 0.01))
+REQUEST_TIMING_REPEATED_QUERY_THRESHOLD = 5
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'ims_project.instrumentation': {
+            'handlers': ['console'],
+            'level': os.environ.get('REQUEST_LOG_LEVEL', 'WARNING'),
+            'propagate': False,
+        },
+    },
+}
+
+# Prometheus metrics (/metrics, see ims_project/metrics.py). With several worker processes,
+# set METRICS_DIR to a directory shared by them and emptied when the service starts, so the
+# worker answering a scrape reports all of them. Scrapes are accepted from admins and, when
+# METRICS_ALLOWED_NETWORKS lists them (comma-separated), from the scraper's networks. None are
+# allowed by default: behind a reverse proxy every client appears to come from loopback
+METRICS_DIR = os.environ.get('METRICS_DIR') or None
+METRICS_ALLOWED_NETWORKS = [
+    network for network in os.environ.get('METRICS_ALLOWED_NETWORKS', '').split(',') if network
+]
+METRICS_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# Inventory dashboard: when True, managers and staff only see figures for their own stores
+DASHBOARD_ROLE_SCOPING = False
+
+# Number of rows written per transaction by the bulk product import
+PRODUCT_IMPORT_BATCH_SIZE = 500
+
+# Stock history checkpoints: `snapshot_stock --if-due` snapshots a store once its latest
+# snapshot is this old, or once this many movements were recorded after it
+STOCK_CHECKPOINT_INTERVAL_HOURS = 24
+STOCK_CHECKPOINT_MAX_MOVEMENTS = 10000
+
 # CORS settings to allow React frontend
 CORS_ALLOW_ALL_ORIGINS = True
 CORS_ALLOW_CREDENTIALS = True
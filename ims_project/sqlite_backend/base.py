@@ -0,0 +1,81 @@
+"""
+SQLite backend tuned for several concurrent workers.
+
+Two extra keys are read from the database OPTIONS:
+
+- pragmas: a dict of PRAGMA names and values run on every new connection,
+  e.g. {'journal_mode': 'WAL', 'synchronous': 'NORMAL', 'busy_timeout': 5000}.
+- transaction_mode: 'DEFERRED' (SQLite's default), 'IMMEDIATE' or
+  'EXCLUSIVE', used to begin atomic blocks.
+- write_transaction_mode: the same choices, used to begin the atomic blocks
+  of ims_project.transactions.write_atomic. IMMEDIATE takes the write lock
+  when the transaction starts, so a transaction that reads and then writes
+  waits for busy_timeout instead of failing with "database is locked" when
+  another writer got there first. Read-only blocks keep transaction_mode, so
+  they do not queue behind writers.
+"""
+from django.core.exceptions import ImproperlyConfigured
+from django.db.backends.sqlite3 import base
+
+TRANSACTION_MODES = ('DEFERRED', 'IMMEDIATE', 'EXCLUSIVE')
+
+
+def apply_pragmas(connection, pragmas):
+    """Run the given PRAGMA statements on a sqlite3 connection."""
+    cursor = connection.cursor()
+    try:
+        for name, value in pragmas.items():
+            cursor.execute(f'PRAGMA {name} = {value}')
+    finally:
+        cursor.close()
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    # Set by write_atomic while it opens its transaction
+    begins_write_transaction = False
+
+    def get_connection_params(self):
+        kwargs = super().get_connection_params()
+        kwargs.pop('pragmas', None)
+        kwargs.pop('transaction_mode', None)
+        kwargs.pop('write_transaction_mode', None)
+        return kwargs
+
+    def get_new_connection(self, conn_params):
+        connection = super().get_new_connection(conn_params)
+        pragmas = dict(self.settings_dict['OPTIONS'].get('pragmas') or {})
+        if self.is_in_memory_db():
+            # In-memory databases (e.g. while testing) have no journal to switch
+            pragmas.pop('journal_mode', None)
+            pragmas.pop('mmap_size', None)
+        apply_pragmas(connection, pragmas)
+        return connection
+
+    def _foreign_keys_disabled(self):
+        value = (self.settings_dict['OPTIONS'].get('pragmas') or {}).get('foreign_keys', 'ON')
+        return str(value).upper() in ('OFF', '0', 'FALSE', 'NO')
+
+    def enable_constraint_checking(self):
+        # Django turns foreign keys back on after migrations and fixtures;
+        # keep them off where the pragmas say so, e.g. on product shards
+        if self._foreign_keys_disabled():
+            return
+        super().enable_constraint_checking()
+
+    def _mode_option(self, name, default):
+        mode = (self.settings_dict['OPTIONS'].get(name) or default).upper()
+        if mode not in TRANSACTION_MODES:
+            raise ImproperlyConfigured(f'{name} must be one of {", ".join(TRANSACTION_MODES)}')
+        return mode
+
+    @property
+    def transaction_mode(self):
+        return self._mode_option('transaction_mode', 'DEFERRED')
+
+    @property
+    def write_transaction_mode(self):
+        return self._mode_option('write_transaction_mode', 'IMMEDIATE')
+
+    def _start_transaction_under_autocommit(self):
+        mode = self.write_transaction_mode if self.begins_write_transaction else self.transaction_mode
+        self.cursor().execute(f'BEGIN {mode}')
@@ -0,0 +1,27 @@
+"""
+atomic() for transactions that write.
+
+The tuned SQLite backend (ims_project/sqlite_backend) begins transactions in
+its transaction_mode, DEFERRED by default, so read-only atomic blocks never
+wait for the write lock. write_atomic() begins in write_transaction_mode
+instead, IMMEDIATE by default: the write lock is taken when the transaction
+starts, so a transaction that reads and then writes waits for busy_timeout
+rather than failing with "database is locked" when another writer commits in
+between. On other backends, and inside a transaction that is already open,
+it behaves like atomic().
+"""
+from contextlib import ExitStack, contextmanager
+from django.db import transaction
+
+
+@contextmanager
+def write_atomic(using=None, savepoint=True):
+    """Open an atomic block that begins as a write transaction."""
+    connection = transaction.get_connection(using)
+    with ExitStack() as stack:
+        connection.begins_write_transaction = True
+        try:
+            stack.enter_context(transaction.atomic(using=using, savepoint=savepoint))
+        finally:
+            connection.begins_write_transaction = False
+        yield
@@ -1,18 +1,21 @@
 from django.contrib import admin
-from .models import Product, Store, Supplier
+from .ledger import record_product_changes
+from .models import Product, StockMovement, Store, Supplier
+from .rollups import product_state
 
 @admin.register(Product)
 class ProductAdmin(admin.ModelAdmin):
     list_display = ('name', 'sku', 'price', 'quantity', 'threshold', 'is_low_stock', 'supplier', 'store')
-    list_filter = ('supplier', 'store', 'created_at')
+    list_filter = ('is_low_stock', 'supplier', 'store', 'created_at')
+    list_select_related = ('supplier', 'store')
     search_fields = ('name', 'sku', 'description')
-    readonly_fields = ('created_at', 'updated_at')
+    readonly_fields = ('is_low_stock', 'created_at', 'updated_at')
     fieldsets = (
         (None, {
             'fields': ('name', 'sku', 'description', 'price')
         }),
         ('Inventory', {
-            'fields': ('quantity', 'threshold')
+            'fields': ('quantity', 'threshold', 'is_low_stock')
         }),
         ('Relationships', {
             'fields': ('supplier', 'store')
@@ -23,6 +26,41 @@ class ProductAdmin(admin.ModelAdmin):
         }),
     )
 
+    def save_model(self, request, obj, form, change):
+        # Record the quantity change in the stock ledger alongside the save
+        old_state = None
+        if change:
+            old_state = product_state(Product.objects.get(pk=obj.pk))
+        super().save_model(request, obj, form, change)
+        record_product_changes([(obj.pk, old_state, product_state(obj))], request.user, 'admin')
+
+    def delete_model(self, request, obj):
+        record_product_changes([(obj.pk, product_state(obj), None)], request.user, 'admin')
+        super().delete_model(request, obj)
+
+    def delete_queryset(self, request, queryset):
+        changes = [(product.pk, product_state(product), None) for product in queryset]
+        record_product_changes(changes, request.user, 'admin')
+        super().delete_queryset(request, queryset)
+
+@admin.register(StockMovement)
+class StockMovementAdmin(admin.ModelAdmin):
+    # Ids rather than objects, since movements outlive deleted products and stores
+    list_display = ('timestamp', 'product_id', 'store_id', 'delta', 'reason', 'user')
+    list_filter = ('reason',)
+    search_fields = ('product__sku', 'product__name')
+    date_hierarchy = 'timestamp'
+
+    # The ledger is append-only and written by the application
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
 @admin.register(Store)
 class StoreAdmin(admin.ModelAdmin):
     list_display = ('name', 'address', 'phone', 'email')
@@ -0,0 +1,169 @@
+import contextvars
+import json
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+from django.conf import settings
+from django.core.exceptions import PermissionDenied
+from django.db import connections
+from django.http import Http404, HttpRequest, QueryDict
+from django.urls import Resolver404, resolve
+from users.scope import store_scope
+
+logger = logging.getLogger(__name__)
+
+# Response headers passed through to each sub-response
+FORWARDED_HEADERS = ('ETag', 'Last-Modified', 'X-Cache')
+
+
+class BatchFormatError(ValueError):
+    """Raised when a batch request body is malformed."""
+
+
+def _max_requests():
+    return getattr(settings, 'BATCH_MAX_REQUESTS', 20)
+
+
+def _max_workers():
+    return getattr(settings, 'BATCH_MAX_WORKERS', 4)
+
+
+def parse_batch(data):
+    """
+    Validate a batch body of the form {"requests": [{"method", "path", "body"}, ...]}.
+    Returns the list of sub-request specs. Raises BatchFormatError if it is malformed.
+    """
+    specs = data.get('requests') if isinstance(data, dict) else None
+    if not isinstance(specs, list) or not specs:
+        raise BatchFormatError('requests must be a non-empty list')
+    if len(specs) > _max_requests():
+        raise BatchFormatError(f'A batch can contain at most {_max_requests()} requests')
+
+    parsed = []
+    for index, spec in enumerate(specs):
+        if not isinstance(spec, dict) or not isinstance(spec.get('path'), str) or not spec['path'].startswith('/'):
+            raise BatchFormatError(f'Request {index} must have an absolute path')
+        method = str(spec.get('method', 'GET')).upper()
+        if method not in ('GET', 'POST', 'PUT', 'PATCH', 'DELETE'):
+            raise BatchFormatError(f'Request {index} has an unsupported method')
+        parsed.append({'id': spec.get('id', index), 'method': method, 'path': spec['path'], 'body': spec.get('body')})
+    return parsed
+
+
+def _sub_request(parent, spec):
+    """Build a request for one sub-request that shares the parent's user, session and store scope."""
+    url = urlsplit(spec['path'])
+    body = json.dumps(spec['body']).encode('utf-8') if spec['body'] is not None else b''
+
+    request = HttpRequest()
+    request.method = spec['method']
+    request.path = request.path_info = url.path
+    request.GET = QueryDict(url.query)
+    request.COOKIES = parent.COOKIES
+    request.META = {
+        **{
+            key: value for key, value in parent.META.items()
+            # The batch's own conditional headers do not apply to its sub-requests
+            if key.startswith(('HTTP_', 'SERVER_', 'REMOTE_')) and not key.startswith('HTTP_IF_')
+        },
+        'REQUEST_METHOD': request.method,
+        'PATH_INFO': url.path,
+        'QUERY_STRING': url.query,
+        'CONTENT_TYPE': 'application/json',
+        'CONTENT_LENGTH': str(len(body)),
+    }
+    # Sets content_type, content_params and encoding the way WSGIRequest does
+    request._set_content_type_params(request.META)
+    request._body = body
+    request.user = parent.user
+    if hasattr(parent, 'session'):
+        request.session = parent.session
+    request._store_scope = store_scope(parent)
+    return request
+
+
+def _error(spec, status, message):
+    return {'id': spec['id'], 'status': status, 'body': {'error': message}}
+
+
+def _dispatch(parent, spec, batch_view):
+    """Run one sub-request through the URL resolver and return its result entry."""
+    try:
+        match = resolve(urlsplit(spec['path']).path)
+    except Resolver404:
+        return _error(spec, 404, 'Not found')
+    if match.func is batch_view:
+        return _error(spec, 400, 'Batch requests cannot be nested')
+
+    request = _sub_request(parent, spec)
+    request.resolver_match = match
+    try:
+        response = match.func(request, *match.args, **match.kwargs)
+    except Http404:
+        return _error(spec, 404, 'Not found')
+    except PermissionDenied:
+        return _error(spec, 403, 'Access denied')
+    except Exception:
+        logger.exception('Batch sub-request %s %s failed', spec['method'], spec['path'])
+        return _error(spec, 500, 'Internal server error')
+
+    if response.streaming:
+        response.close()
+        return _error(spec, 400, 'Streaming endpoints cannot be batched')
+
+    content = response.content
+    if response.get('Content-Type', '').startswith('application/json') and content:
+        body = json.loads(content)
+    else:
+        body = content.decode(response.charset)
+    entry = {'id': spec['id'], 'status': response.status_code, 'body': body}
+    headers = {name: response[name] for name in FORWARDED_HEADERS if response.has_header(name)}
+    if headers:
+        entry['headers'] = headers
+    return entry
+
+
+def _dispatch_in_thread(parent, spec, batch_view):
+    try:
+        return _dispatch(parent, spec, batch_view)
+    finally:
+        # Worker threads open their own connections; do not leave them behind
+        connections.close_all()
+
+
+def run_batch(parent, specs, batch_view):
+    """
+    Run the sub-requests of a batch and return their results in order.
+
+    Sub-requests go straight to the resolved views, so authentication and
+    the store scope are resolved once for the whole batch; the role
+    decorators still check each one. Consecutive GET requests run
+    concurrently on up to BATCH_MAX_WORKERS threads; any other request runs
+    on its own, after the requests before it, so reads see earlier writes.
+    """
+    results = []
+    reads = []
+
+    def flush_reads():
+        if len(reads) > 1 and _max_workers() > 1:
+            # Resolve the shared scope before the threads race to do it
+            store_scope(parent).store_ids
+            with ThreadPoolExecutor(max_workers=min(_max_workers(), len(reads))) as executor:
+                # Each thread runs in a copy of the request's context, which carries its database routing
+                futures = [
+                    executor.submit(contextvars.copy_context().run, _dispatch_in_thread, parent, spec, batch_view)
+                    for spec in reads
+                ]
+                results.extend(future.result() for future in futures)
+        else:
+            results.extend(_dispatch(parent, spec, batch_view) for spec in reads)
+        reads.clear()
+
+    for spec in specs:
+        if spec['method'] == 'GET':
+            reads.append(spec)
+            continue
+        flush_reads()
+        results.append(_dispatch(parent, spec, batch_view))
+    flush_reads()
+    return results
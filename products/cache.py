@@ -0,0 +1,190 @@
+import hashlib
+import threading
+import time
+from functools import wraps
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.http import HttpResponse
+from users.scope import store_scope
+
+# Version namespace bumped by every write; responses that depend on all stores use it
+GLOBAL_VERSION = 'all'
+
+# How long a request waits for another one to fill the same cache entry
+SINGLE_FLIGHT_WAIT_SECONDS = 5
+SINGLE_FLIGHT_POLL_SECONDS = 0.05
+
+
+def _cache():
+    return caches[getattr(settings, 'RESPONSE_CACHE_ALIAS', 'default')]
+
+
+def _timeout():
+    return getattr(settings, 'RESPONSE_CACHE_TIMEOUT', 0)
+
+
+def _version_key(namespace):
+    return f'response-cache:version:{namespace}'
+
+
+class CacheStats:
+    """Per-endpoint hit, miss and coalesced counters of this process."""
+
+    def __init__(self):
+        self._counts = {}
+        self._lock = threading.Lock()
+
+    def increment(self, endpoint, outcome):
+        with self._lock:
+            counts = self._counts.setdefault(endpoint, {'hits': 0, 'misses': 0, 'coalesced': 0})
+            counts[outcome] += 1
+
+    def snapshot(self):
+        with self._lock:
+            return {endpoint: dict(counts) for endpoint, counts in self._counts.items()}
+
+    def reset(self):
+        with self._lock:
+            self._counts.clear()
+
+
+stats = CacheStats()
+
+
+def _bump(namespaces):
+    cache = _cache()
+    for namespace in namespaces:
+        try:
+            cache.incr(_version_key(namespace))
+        except ValueError:
+            # Missing counters start from the clock, so an evicted counter never reuses a version
+            cache.set(_version_key(namespace), time.time_ns(), timeout=None)
+
+
+def bump_versions(store_ids=(), supplier_ids=()):
+    """
+    Invalidate the cached responses and ETags that depend on the given stores
+    and suppliers, and every one that depends on all stores.
+
+    The versions are bumped now and again when the surrounding transaction
+    commits, so a response recomputed from uncommitted data in between is
+    never served afterwards. They are kept even while the response cache is
+    disabled, since conditional GETs use them too.
+    """
+    namespaces = [GLOBAL_VERSION]
+    namespaces += [f'store:{store_id}' for store_id in set(store_ids) if store_id is not None]
+    namespaces += [f'supplier:{supplier_id}' for supplier_id in set(supplier_ids) if supplier_id is not None]
+    _bump(namespaces)
+    transaction.on_commit(lambda: _bump(namespaces))
+
+
+def _versions(namespaces):
+    """Return the current version of each namespace, initialising missing ones."""
+    cache = _cache()
+    keys = [_version_key(namespace) for namespace in namespaces]
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            cache.add(key, time.time_ns(), timeout=None)
+            versions[key] = cache.get(key)
+    return [versions[key] for key in keys]
+
+
+def response_namespaces(request, per_store=True):
+    """
+    Return the version namespaces a response to the request depends on: one
+    per store in the user's scope, or the global one for admins and for
+    responses that are not per store.
+    """
+    store_ids = store_scope(request).store_ids
+    if store_ids is None or not per_store:
+        return [GLOBAL_VERSION]
+    namespaces = [f'store:{store_id}' for store_id in sorted(store_ids)]
+    # An explicit store_id parameter may reach outside the scope (see product_list)
+    if request.GET.get('store_id'):
+        namespaces.append(f'store:{request.GET["store_id"]}')
+    return namespaces
+
+
+def version_markers(namespaces):
+    """
+    Return values for a conditional_get validator: each namespace with its
+    current version. This costs one cache lookup instead of a query over the
+    data, and bump_versions() changes it on every write the response shows.
+    """
+    return list(zip(namespaces, _versions(namespaces)))
+
+
+def _response_key(request, endpoint, per_store):
+    """
+    Build the cache key from the endpoint, the query parameters, the user's
+    role and store scope, and the versions of the namespaces the response
+    depends on.
+    """
+    store_ids = store_scope(request).store_ids
+    scope_part = 'all' if store_ids is None else ','.join(str(store_id) for store_id in sorted(store_ids))
+    namespaces = response_namespaces(request, per_store)
+
+    params = sorted((key, value) for key in request.GET for value in request.GET.getlist(key))
+    parts = [endpoint, request.user.role, scope_part, repr(params), repr(_versions(namespaces))]
+    digest = hashlib.sha256('|'.join(parts).encode('utf-8')).hexdigest()
+    return f'response-cache:{endpoint}:{digest}'
+
+
+def _cached_http_response(entry, outcome):
+    content_type, content = entry
+    response = HttpResponse(content, content_type=content_type)
+    response['X-Cache'] = outcome
+    return response
+
+
+def cached_response(endpoint, per_store=True):
+    """
+    Cache successful GET responses of a view for RESPONSE_CACHE_TIMEOUT seconds.
+
+    Responses are keyed by endpoint, query parameters, role and store scope.
+    With per_store=True they are invalidated only by writes to the stores in
+    the user's scope, otherwise by any write. Writes invalidate them through bump_versions().
+    When many requests miss the same key at once, one of them computes the
+    response while the others wait for it (single flight).
+
+    Must be applied below the role decorators, since it reads the user.
+    """
+    def decorator(view_func):
+        @wraps(view_func)
+        def wrapper(request, *args, **kwargs):
+            if request.method != 'GET' or not _timeout():
+                return view_func(request, *args, **kwargs)
+
+            cache = _cache()
+            key = _response_key(request, endpoint, per_store)
+            entry = cache.get(key)
+            if entry is not None:
+                stats.increment(endpoint, 'hits')
+                return _cached_http_response(entry, 'HIT')
+
+            lock_key = f'{key}:lock'
+            acquired = cache.add(lock_key, True, timeout=SINGLE_FLIGHT_WAIT_SECONDS)
+            if not acquired:
+                # Another request is computing this response; wait for it to land
+                deadline = time.monotonic() + SINGLE_FLIGHT_WAIT_SECONDS
+                while time.monotonic() < deadline:
+                    time.sleep(SINGLE_FLIGHT_POLL_SECONDS)
+                    entry = cache.get(key)
+                    if entry is not None:
+                        stats.increment(endpoint, 'coalesced')
+                        return _cached_http_response(entry, 'HIT')
+
+            stats.increment(endpoint, 'misses')
+            try:
+                response = view_func(request, *args, **kwargs)
+                if response.status_code == 200 and not response.streaming:
+                    cache.set(key, (response['Content-Type'], response.content), timeout=_timeout())
+                    response['X-Cache'] = 'MISS'
+            finally:
+                if acquired:
+                    cache.delete(lock_key)
+            return response
+        return wrapper
+    return decorator
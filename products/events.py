@@ -0,0 +1,320 @@
+import asyncio
+import json
+import os
+import queue
+import socket
+import tempfile
+import threading
+import uuid
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from users.scope import ascope_version, scope_version
+
+# Events relayed between workers are split into datagrams of this many events
+SOCKET_BATCH_SIZE = 100
+SOCKET_BUFFER_SIZE = 1 << 20
+
+
+def _queue_size():
+    return getattr(settings, 'STOCK_EVENTS_QUEUE_SIZE', 1000)
+
+
+def heartbeat_seconds():
+    return getattr(settings, 'STOCK_EVENTS_HEARTBEAT_SECONDS', 15)
+
+
+class Subscription:
+    """
+    The queue of events waiting for one connected client.
+
+    Sync subscriptions use a thread-safe queue; async ones are bound to the
+    event loop that reads them and are fed through call_soon_threadsafe, so
+    publishers on any thread can offer events. A client that falls behind
+    by more than STOCK_EVENTS_QUEUE_SIZE events loses the newest ones, and
+    is told how many through the dropped counter.
+    """
+
+    def __init__(self, broker, store_ids, loop=None):
+        self.broker = broker
+        self.store_ids = store_ids
+        self.loop = loop
+        self.queue = asyncio.Queue(_queue_size()) if loop is not None else queue.Queue(_queue_size())
+        self.dropped = 0
+
+    def wants(self, event):
+        return self.store_ids is None or any(store_id in self.store_ids for store_id in event['store_ids'])
+
+    def offer(self, event):
+        if self.loop is None:
+            self._put(event)
+            return
+        try:
+            self.loop.call_soon_threadsafe(self._put, event)
+        except RuntimeError:
+            # The loop has closed; the client is gone
+            pass
+
+    def _put(self, event):
+        try:
+            self.queue.put_nowait(event)
+        except (queue.Full, asyncio.QueueFull):
+            self.dropped += 1
+
+    def get(self, timeout):
+        """Wait up to timeout seconds for the next event; returns None when none arrived."""
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    async def aget(self, timeout):
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    def close(self):
+        self.broker.unsubscribe(self)
+
+
+class LocalBroker:
+    """Delivers events to the subscriptions of this process."""
+
+    def __init__(self):
+        self._subscriptions = set()
+        self._lock = threading.Lock()
+
+    def subscribe(self, store_ids, loop=None):
+        subscription = Subscription(self, store_ids, loop)
+        with self._lock:
+            self._subscriptions.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscriptions.discard(subscription)
+
+    def subscriber_count(self):
+        with self._lock:
+            return len(self._subscriptions)
+
+    def dispatch(self, events):
+        with self._lock:
+            subscriptions = list(self._subscriptions)
+        for subscription in subscriptions:
+            for event in events:
+                if subscription.wants(event):
+                    subscription.offer(event)
+
+    def publish(self, events):
+        self.dispatch(events)
+
+
+class SocketBroker(LocalBroker):
+    """
+    Relays events between the worker processes of one host.
+
+    A worker with subscribers binds a Unix datagram socket in
+    STOCK_EVENTS_SOCKET_DIR and listens on it from a daemon thread.
+    Publishing delivers to local subscribers directly and sends the events
+    to every other socket in the directory; sockets left behind by workers
+    that exited are removed on the first failed send. Delivery is best
+    effort, like the in-process broker: a worker whose socket buffer is
+    full misses the events.
+    """
+
+    def __init__(self, directory=None):
+        super().__init__()
+        self.directory = directory or getattr(
+            settings, 'STOCK_EVENTS_SOCKET_DIR', os.path.join(tempfile.gettempdir(), 'ims-stock-events')
+        )
+        self.path = None
+        self._listener = None
+
+    def subscribe(self, store_ids, loop=None):
+        subscription = super().subscribe(store_ids, loop)
+        with self._lock:
+            if self._listener is None:
+                self._listen()
+        return subscription
+
+    def _listen(self):
+        os.makedirs(self.directory, exist_ok=True)
+        self.path = os.path.join(self.directory, f'{os.getpid()}-{uuid.uuid4().hex[:8]}.sock')
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, SOCKET_BUFFER_SIZE)
+        sock.bind(self.path)
+        self._listener = threading.Thread(target=self._receive, args=(sock,), name='stock-events', daemon=True)
+        self._listener.start()
+
+    def _receive(self, sock):
+        while True:
+            try:
+                datagram = sock.recv(SOCKET_BUFFER_SIZE)
+                self.dispatch(json.loads(datagram))
+            except (OSError, ValueError):
+                continue
+
+    def publish(self, events):
+        self.dispatch(events)
+        try:
+            names = [name for name in os.listdir(self.directory) if name.endswith('.sock')]
+        except FileNotFoundError:
+            return
+        peers = [os.path.join(self.directory, name) for name in names]
+        peers = [path for path in peers if path != self.path]
+        if not peers:
+            return
+
+        datagrams = [
+            json.dumps(events[start:start + SOCKET_BATCH_SIZE], separators=(',', ':')).encode()
+            for start in range(0, len(events), SOCKET_BATCH_SIZE)
+        ]
+        with socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM) as sock:
+            sock.setblocking(False)
+            for path in peers:
+                for datagram in datagrams:
+                    try:
+                        sock.sendto(datagram, path)
+                    except (ConnectionRefusedError, FileNotFoundError):
+                        try:
+                            os.unlink(path)
+                        except OSError:
+                            pass
+                        break
+                    except OSError:
+                        # The peer is not keeping up; skip it rather than block the write
+                        break
+
+
+BROKERS = {
+    'local': LocalBroker,
+    'socket': SocketBroker,
+}
+
+_broker = None
+_broker_lock = threading.Lock()
+
+
+def get_broker():
+    """Return this process's broker, chosen by STOCK_EVENTS_BROKER ('local' or 'socket')."""
+    global _broker
+    with _broker_lock:
+        if _broker is None:
+            _broker = BROKERS[getattr(settings, 'STOCK_EVENTS_BROKER', 'local')]()
+        return _broker
+
+
+def _is_low(state):
+    return state is not None and state[3] <= state[4]
+
+
+def events_for_change(product_id, old_state, new_state, timestamp):
+    """
+    Return the events implied by a (product_id, old_state, new_state) change.
+
+    A 'stock' event is sent when the quantity or store of a product changes,
+    including when it is created or deleted, and a 'low_stock' event when
+    it falls to or below its threshold ('low') or rises above it
+    ('restocked'). Each event lists the stores it concerns, so it reaches
+    the subscribers of both stores when a product moves between them.
+    """
+    events = []
+    if old_state is None and new_state is None:
+        return events
+    previous_quantity = old_state[3] if old_state is not None else 0
+    quantity = new_state[3] if new_state is not None else 0
+    store_id = new_state[0] if new_state is not None else old_state[0]
+    previous_store_id = old_state[0] if old_state is not None else store_id
+    store_ids = sorted({store_id, previous_store_id} - {None})
+
+    if quantity != previous_quantity or store_id != previous_store_id or old_state is None or new_state is None:
+        data = {
+            'product_id': product_id,
+            'store_id': store_id,
+            'previous_quantity': previous_quantity,
+            'quantity': quantity,
+            'delta': quantity - previous_quantity,
+            'timestamp': timestamp,
+        }
+        if store_id != previous_store_id:
+            data['previous_store_id'] = previous_store_id
+        if new_state is None:
+            data['deleted'] = True
+        events.append({'type': 'stock', 'store_ids': store_ids, 'data': data})
+
+    if new_state is not None and _is_low(old_state) != _is_low(new_state):
+        events.append({
+            'type': 'low_stock',
+            'store_ids': store_ids,
+            'data': {
+                'product_id': product_id,
+                'store_id': store_id,
+                'quantity': quantity,
+                'threshold': new_state[4],
+                'direction': 'low' if _is_low(new_state) else 'restocked',
+                'timestamp': timestamp,
+            },
+        })
+    return events
+
+
+def publish_product_changes(changes):
+    """
+    Publish the events for (product_id, old_state, new_state) changes once
+    the surrounding transaction commits, so subscribers never hear about
+    writes that were rolled back.
+    """
+    timestamp = timezone.now().isoformat()
+    events = []
+    for product_id, old_state, new_state in changes:
+        events.extend(events_for_change(product_id, old_state, new_state, timestamp))
+    if events:
+        transaction.on_commit(lambda: get_broker().publish(events))
+
+
+def format_event(event):
+    """Serialize an event in the text/event-stream format."""
+    return f"event: {event['type']}\ndata: {json.dumps(event['data'], separators=(',', ':'))}\n\n"
+
+
+def _overflow(subscription):
+    dropped, subscription.dropped = subscription.dropped, 0
+    return format_event({'type': 'overflow', 'data': {'dropped': dropped}})
+
+
+def event_stream(store_ids, user_id=None, version=None):
+    """
+    Yield the events for the given stores (None for all) to a WSGI client, with
+    heartbeats. With a user_id, the stream ends as soon as the user's scope
+    version moves on from version, so the client reconnects with its new scope.
+    """
+    subscription = get_broker().subscribe(store_ids)
+    try:
+        yield 'retry: 3000\n\n'
+        while True:
+            event = subscription.get(heartbeat_seconds())
+            if user_id is not None and scope_version(user_id) != version:
+                return
+            if subscription.dropped:
+                yield _overflow(subscription)
+            yield format_event(event) if event is not None else ': heartbeat\n\n'
+    finally:
+        subscription.close()
+
+
+async def async_event_stream(store_ids, user_id=None, version=None):
+    """The ASGI counterpart of event_stream(); a connection holds no thread while it waits."""
+    subscription = get_broker().subscribe(store_ids, loop=asyncio.get_running_loop())
+    try:
+        yield 'retry: 3000\n\n'
+        while True:
+            event = await subscription.aget(heartbeat_seconds())
+            if user_id is not None and await ascope_version(user_id) != version:
+                return
+            if subscription.dropped:
+                yield _overflow(subscription)
+            yield format_event(event) if event is not None else ': heartbeat\n\n'
+    finally:
+        subscription.close()
@@ -0,0 +1,242 @@
+import csv
+import io
+import json
+from decimal import Decimal, InvalidOperation
+from ims_project.transactions import write_atomic
+from .models import Product, Store, Supplier
+from .ledger import record_product_changes
+from .rollups import apply_changes
+from .sync import log_product_moves
+
+REQUIRED_IMPORT_FIELDS = ('name', 'sku', 'price', 'quantity', 'supplier_id', 'store_id')
+
+# Range of the quantity and threshold columns
+INTEGER_RANGE = (-2 ** 31, 2 ** 31 - 1)
+
+# Columns overwritten when an imported SKU already exists
+IMPORT_UPDATE_FIELDS = ('name', 'description', 'price', 'quantity', 'threshold', 'supplier', 'store', 'updated_at')
+
+
+class ImportFormatError(ValueError):
+    """Raised when an import payload cannot be parsed at all."""
+
+
+def parse_rows(stream, import_format):
+    """
+    Yield (row_number, row_dict) pairs from a text stream of CSV or NDJSON.
+    Rows that are not valid JSON objects are yielded as an error string instead of a dict.
+    CSV the csv module cannot read (e.g. a field over its size limit) raises ImportFormatError.
+    """
+    if import_format == 'csv':
+        reader = csv.DictReader(stream)
+        try:
+            if not reader.fieldnames:
+                raise ImportFormatError('CSV upload has no header row')
+            for row_number, row in enumerate(reader, start=1):
+                yield row_number, {key: value for key, value in row.items() if key is not None}
+        except csv.Error as e:
+            raise ImportFormatError(f'Invalid CSV at line {reader.line_num}: {e}')
+    elif import_format == 'ndjson':
+        row_number = 0
+        for line in stream:
+            if not line.strip():
+                continue
+            row_number += 1
+            try:
+                row = json.loads(line)
+            except json.JSONDecodeError:
+                yield row_number, 'Invalid JSON'
+                continue
+            yield row_number, row if isinstance(row, dict) else 'Each line must be a JSON object'
+    else:
+        raise ImportFormatError('format must be csv or ndjson')
+
+
+def open_upload(request):
+    """Return a text stream over the uploaded file, or over the request body."""
+    upload = request.FILES.get('file')
+    if upload is not None:
+        return io.TextIOWrapper(upload.file, encoding='utf-8', newline='')
+    return io.StringIO(request.body.decode('utf-8'), newline='')
+
+
+def _clean_row(row):
+    """
+    Validate and convert one import row.
+    Returns the cleaned dict, or raises ValueError with a message for the report.
+    """
+    for field in REQUIRED_IMPORT_FIELDS:
+        if row.get(field) in (None, ''):
+            raise ValueError(f'Field {field} is required')
+
+    try:
+        price = Decimal(str(row['price']))
+    except InvalidOperation:
+        raise ValueError('price must be a number')
+    if not price.is_finite():
+        raise ValueError('price must be a number')
+    # Check against the column, so bulk_create never fails halfway through an import
+    price_field = Product._meta.get_field('price')
+    if abs(price) >= 10 ** (price_field.max_digits - price_field.decimal_places):
+        raise ValueError(f'price must be less than {10 ** (price_field.max_digits - price_field.decimal_places)}')
+    if price != price.quantize(Decimal(1).scaleb(-price_field.decimal_places)):
+        raise ValueError(f'price must have at most {price_field.decimal_places} decimal places')
+
+    cleaned = {
+        'name': str(row['name']),
+        'sku': str(row['sku']),
+        'description': row.get('description') or '',
+        'price': price,
+    }
+    for field, default in (('quantity', None), ('threshold', 10), ('store_id', None), ('supplier_id', None)):
+        value = row.get(field)
+        if value in (None, ''):
+            value = default
+        try:
+            cleaned[field] = int(value)
+        except (TypeError, ValueError):
+            raise ValueError(f'{field} must be an integer')
+        if field in ('quantity', 'threshold') and not INTEGER_RANGE[0] <= cleaned[field] <= INTEGER_RANGE[1]:
+            raise ValueError(f'{field} is out of range')
+    return cleaned
+
+
+def _state(values):
+    """Return the rollup state tuple for cleaned import values or a values() row."""
+    return (values['store_id'], values['supplier_id'], Decimal(str(values['price'])),
+            int(values['quantity']), int(values['threshold']))
+
+
+def import_products(rows, user, batch_size=500, update_existing=True):
+    """
+    Create or update products from (row_number, row) pairs.
+
+    Stores, suppliers and supplier/store links are resolved up front with one
+    query each. Each batch is then written in one write transaction: a single
+    IN query checks its SKUs and one bulk_create(update_conflicts=True) writes
+    them, together with the matching rollup deltas. The check runs under the
+    write lock, so a SKU inserted meanwhile by another request cannot be
+    counted as created and applied to the rollups twice.
+
+    Returns a report dict with created/updated counts and per-row errors.
+    """
+    errors = []
+    cleaned_rows = []
+    seen_skus = set()
+    total_rows = 0
+
+    for row_number, row in rows:
+        total_rows += 1
+        if isinstance(row, str):
+            errors.append({'row': row_number, 'error': row})
+            continue
+        try:
+            cleaned = _clean_row(row)
+        except ValueError as e:
+            errors.append({'row': row_number, 'sku': row.get('sku'), 'error': str(e)})
+            continue
+        if cleaned['sku'] in seen_skus:
+            errors.append({'row': row_number, 'sku': cleaned['sku'], 'error': 'Duplicate SKU in upload'})
+            continue
+        seen_skus.add(cleaned['sku'])
+        cleaned_rows.append((row_number, cleaned))
+
+    # Resolve every referenced store, supplier and supplier/store link in three queries
+    store_ids = {cleaned['store_id'] for _, cleaned in cleaned_rows}
+    supplier_ids = {cleaned['supplier_id'] for _, cleaned in cleaned_rows}
+    store_managers = dict(Store.objects.filter(id__in=store_ids).values_list('id', 'manager_id'))
+    known_suppliers = set(Supplier.objects.filter(id__in=supplier_ids).values_list('id', flat=True))
+    served_pairs = set(
+        Supplier.stores.through.objects.filter(
+            supplier_id__in=supplier_ids, store_id__in=store_ids
+        ).values_list('supplier_id', 'store_id')
+    )
+
+    def check_store(store_id):
+        if store_id not in store_managers:
+            return 'Store not found'
+        if user.role == 'manager' and store_managers[store_id] != user.id:
+            return 'Access denied. You can only import products into stores that you manage.'
+        return None
+
+    valid_rows = []
+    for row_number, cleaned in cleaned_rows:
+        error = check_store(cleaned['store_id'])
+        if error is None and cleaned['supplier_id'] not in known_suppliers:
+            error = 'Supplier not found'
+        if error is None and (cleaned['supplier_id'], cleaned['store_id']) not in served_pairs:
+            error = 'The selected supplier does not serve the selected store'
+        if error:
+            errors.append({'row': row_number, 'sku': cleaned['sku'], 'error': error})
+        else:
+            valid_rows.append((row_number, cleaned))
+
+    created = updated = 0
+    for start in range(0, len(valid_rows), batch_size):
+        batch = valid_rows[start:start + batch_size]
+
+        with write_atomic():
+            # One IN query per batch finds the SKUs that already exist
+            existing = {
+                row['sku']: row
+                for row in Product.objects.filter(sku__in=[cleaned['sku'] for _, cleaned in batch]).values(
+                    'sku', 'store_id', 'supplier_id', 'price', 'quantity', 'threshold', 'store__manager_id'
+                )
+            }
+
+            products = []
+            changes = []
+            for row_number, cleaned in batch:
+                current = existing.get(cleaned['sku'])
+                if current is not None:
+                    if not update_existing:
+                        errors.append({'row': row_number, 'sku': cleaned['sku'], 'error': 'SKU already exists'})
+                        continue
+                    if user.role == 'manager' and current['store__manager_id'] != user.id:
+                        errors.append({
+                            'row': row_number,
+                            'sku': cleaned['sku'],
+                            'error': 'Access denied. You can only update products in stores that you manage.',
+                        })
+                        continue
+                products.append(Product(**cleaned))
+                changes.append((_state(current) if current is not None else None, _state(cleaned)))
+
+            if not products:
+                continue
+
+            Product.objects.bulk_create(
+                products,
+                update_conflicts=True,
+                unique_fields=['sku'],
+                update_fields=list(IMPORT_UPDATE_FIELDS),
+            )
+            apply_changes(changes)
+
+            # Backends that cannot return primary keys from an upsert need one lookup
+            if any(product.pk is None for product in products):
+                ids = dict(Product.objects.filter(sku__in=[product.sku for product in products]).values_list('sku', 'id'))
+                for product in products:
+                    product.pk = ids[product.sku]
+            record_product_changes(
+                [(product.pk, old_state, new_state) for product, (old_state, new_state) in zip(products, changes)],
+                user,
+                'import',
+            )
+            # bulk_create sends no signals; moved products leave a tombstone for sync clients
+            log_product_moves(
+                (product.pk, old_state[0], new_state[0])
+                for product, (old_state, new_state) in zip(products, changes)
+                if old_state is not None
+            )
+
+        batch_updated = sum(1 for old_state, _ in changes if old_state is not None)
+        updated += batch_updated
+        created += len(products) - batch_updated
+
+    return {
+        'total_rows': total_rows,
+        'created': created,
+        'updated': updated,
+        'errors': sorted(errors, key=lambda error: error['row']),
+    }
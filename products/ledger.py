@@ -0,0 +1,248 @@
+from datetime import datetime, time, timedelta
+from decimal import Decimal
+from django.conf import settings
+from django.db.models import Max, Sum
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from ims_project.transactions import write_atomic
+from .events import publish_product_changes
+from .models import Product, StockMovement, StockSnapshot, Store
+
+SNAPSHOT_BATCH_SIZE = 1000
+
+
+def movements_for_change(product_id, old_state, new_state):
+    """
+    Return the (product_id, store_id, delta) movements implied by a product change.
+
+    States are the (store_id, supplier_id, price, quantity, threshold) tuples
+    used by the rollups; old_state is None for new products and new_state is
+    None for deleted ones. Moving a product between stores is recorded as a
+    withdrawal from the old store and a receipt in the new one.
+    """
+    if old_state is None and new_state is None:
+        return []
+    if old_state is None:
+        return [(product_id, new_state[0], new_state[3])]
+    if new_state is None:
+        return [(product_id, old_state[0], -old_state[3])]
+    if old_state[0] != new_state[0]:
+        return [(product_id, old_state[0], -old_state[3]), (product_id, new_state[0], new_state[3])]
+    return [(product_id, new_state[0], new_state[3] - old_state[3])]
+
+
+def record_movements(movements, user, reason):
+    """
+    Append (product_id, store_id, delta) movements to the ledger.
+    Zero deltas are skipped. Returns the number of rows written.
+    """
+    now = timezone.now()
+    user_id = user.id if user is not None and user.is_authenticated else None
+    rows = [
+        StockMovement(product_id=product_id, store_id=store_id, delta=delta, reason=reason, timestamp=now, user_id=user_id)
+        for product_id, store_id, delta in movements
+        if delta
+    ]
+    StockMovement.objects.bulk_create(rows, batch_size=SNAPSHOT_BATCH_SIZE)
+    return len(rows)
+
+
+def record_product_changes(changes, user, reason):
+    """
+    Record the movements for (product_id, old_state, new_state) changes and
+    publish the matching stock events.
+    """
+    movements = []
+    for product_id, old_state, new_state in changes:
+        movements.extend(movements_for_change(product_id, old_state, new_state))
+    publish_product_changes(changes)
+    return record_movements(movements, user, reason)
+
+
+def take_snapshots(store_ids=None):
+    """
+    Write a snapshot row with the current quantity of every product, or of the
+    products in the given stores. Returns the number of snapshots written.
+    """
+    products = Product.objects.order_by('id')
+    if store_ids is not None:
+        products = products.filter(store_id__in=store_ids)
+
+    count = 0
+    with write_atomic():
+        now = timezone.now()
+        batch = []
+        for product_id, store_id, quantity in products.values_list('id', 'store_id', 'quantity').iterator(
+            chunk_size=SNAPSHOT_BATCH_SIZE
+        ):
+            batch.append(StockSnapshot(product_id=product_id, store_id=store_id, quantity=quantity, taken_at=now))
+            if len(batch) >= SNAPSHOT_BATCH_SIZE:
+                StockSnapshot.objects.bulk_create(batch)
+                count += len(batch)
+                batch = []
+        StockSnapshot.objects.bulk_create(batch)
+        count += len(batch)
+
+    return count
+
+
+def quantity_as_of(product_id, at):
+    """
+    Return the quantity of a product at the given time, or None if the
+    ledger has no history for it yet.
+
+    Starts from the latest snapshot taken at or before the time and replays
+    only the movements recorded after that snapshot.
+    """
+    snapshot = StockSnapshot.objects.filter(product_id=product_id, taken_at__lte=at).order_by('-taken_at').first()
+
+    movements = StockMovement.objects.filter(product_id=product_id, timestamp__lte=at)
+    if snapshot is not None:
+        movements = movements.filter(timestamp__gt=snapshot.taken_at)
+    replayed = movements.aggregate(total=Sum('delta'))['total']
+
+    if snapshot is None and replayed is None:
+        return None
+    return (snapshot.quantity if snapshot is not None else 0) + (replayed or 0)
+
+
+def parse_as_of(value):
+    """
+    Parse an ISO datetime, or a date meaning the end of that day.
+    Naive values are taken in the current time zone. Returns None if invalid.
+    """
+    if not value:
+        return None
+    try:
+        at = parse_datetime(value)
+        if at is None:
+            day = parse_date(value)
+            if day is None:
+                return None
+            at = datetime.combine(day, time.max)
+    except ValueError:
+        return None
+    if timezone.is_naive(at):
+        at = timezone.make_aware(at)
+    return at
+
+
+def checkpoint_times(at, store_ids=None):
+    """
+    Return {store_id: time of the latest snapshot taken at or before at}.
+    Stores that have never been snapshotted are absent.
+    """
+    snapshots = StockSnapshot.objects.filter(taken_at__lte=at)
+    if store_ids is not None:
+        snapshots = snapshots.filter(store_id__in=store_ids)
+    return dict(snapshots.order_by().values('store_id').annotate(latest=Max('taken_at')).values_list('store_id', 'latest'))
+
+
+def _store_quantities_as_of(store_id, at, checkpoint):
+    """
+    Return {product_id: quantity} for one store at the given time, starting
+    from the store's checkpoint (or from nothing) and replaying the later
+    movements. Products with no stock in the store are left out.
+    """
+    quantities = {}
+    if checkpoint is not None:
+        quantities.update(
+            StockSnapshot.objects.filter(store_id=store_id, taken_at=checkpoint).values_list('product_id', 'quantity')
+        )
+
+    movements = StockMovement.objects.filter(store_id=store_id, timestamp__lte=at)
+    if checkpoint is not None:
+        movements = movements.filter(timestamp__gt=checkpoint)
+    for product_id, delta in movements.order_by().values('product_id').annotate(total=Sum('delta')).values_list(
+        'product_id', 'total'
+    ):
+        quantities[product_id] = quantities.get(product_id, 0) + delta
+
+    return {product_id: quantity for product_id, quantity in quantities.items() if quantity}
+
+
+def inventory_as_of(at, store_ids):
+    """
+    Yield the stock on hand at the given time, one dict per store and product,
+    store by store so memory is bounded by the largest store.
+
+    Each store starts from its nearest checkpoint and replays only the
+    movements since, so the rows touched are bounded by the checkpoint
+    cadence. Values use the current product price, since prices are not
+    versioned; products deleted since then are reported without sku, name,
+    price or value.
+    """
+    checkpoints = checkpoint_times(at, store_ids)
+    store_names = dict(Store.objects.filter(id__in=store_ids).values_list('id', 'name'))
+
+    for store_id in sorted(store_ids):
+        quantities = _store_quantities_as_of(store_id, at, checkpoints.get(store_id))
+        product_ids = sorted(quantities)
+
+        for start in range(0, len(product_ids), SNAPSHOT_BATCH_SIZE):
+            chunk = product_ids[start:start + SNAPSHOT_BATCH_SIZE]
+            products = {
+                row['id']: row
+                for row in Product.objects.filter(id__in=chunk).values('id', 'sku', 'name', 'price')
+            }
+            for product_id in chunk:
+                product = products.get(product_id, {})
+                quantity = quantities[product_id]
+                price = product.get('price')
+                yield {
+                    'store_id': store_id,
+                    'store_name': store_names.get(store_id),
+                    'product_id': product_id,
+                    'sku': product.get('sku'),
+                    'name': product.get('name'),
+                    'quantity': quantity,
+                    'price': str(price) if price is not None else None,
+                    'value': str(price * quantity) if price is not None else None,
+                }
+
+
+def summarize_inventory(rows):
+    """Collapse inventory_as_of() rows into per-store product counts, units and value."""
+    stores = {}
+    for row in rows:
+        store = stores.setdefault(row['store_id'], {
+            'store_id': row['store_id'],
+            'store_name': row['store_name'],
+            'product_count': 0,
+            'total_quantity': 0,
+            'total_value': Decimal('0.00'),
+        })
+        store['product_count'] += 1
+        store['total_quantity'] += row['quantity']
+        if row['value'] is not None:
+            store['total_value'] += Decimal(row['value'])
+
+    for store in stores.values():
+        store['total_value'] = str(store['total_value'])
+    return list(stores.values())
+
+
+def stores_due_for_checkpoint(now=None):
+    """
+    Return the ids of stores whose latest checkpoint is older than
+    STOCK_CHECKPOINT_INTERVAL_HOURS, or which have recorded more than
+    STOCK_CHECKPOINT_MAX_MOVEMENTS movements since it.
+    """
+    now = now or timezone.now()
+    interval = timedelta(hours=getattr(settings, 'STOCK_CHECKPOINT_INTERVAL_HOURS', 24))
+    max_movements = getattr(settings, 'STOCK_CHECKPOINT_MAX_MOVEMENTS', 10000)
+
+    checkpoints = checkpoint_times(now)
+    due = set()
+    for store_id in Store.objects.values_list('id', flat=True):
+        checkpoint = checkpoints.get(store_id)
+        if checkpoint is None or now - checkpoint >= interval:
+            due.add(store_id)
+
+    # Busy stores get checkpointed early so replays stay short
+    fresh = {store_id: checkpoint for store_id, checkpoint in checkpoints.items() if store_id not in due}
+    for store_id, checkpoint in fresh.items():
+        if StockMovement.objects.filter(store_id=store_id, timestamp__gt=checkpoint).count() > max_movements:
+            due.add(store_id)
+
+    return sorted(due)
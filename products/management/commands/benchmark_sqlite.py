@@ -0,0 +1,162 @@
+import multiprocessing
+import os
+import random
+import sqlite3
+import tempfile
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from ims_project.sqlite_backend.base import apply_pragmas
+
+STORES = 20
+
+
+def _setup(path, rows):
+    connection = sqlite3.connect(path)
+    connection.executescript(
+        """
+        CREATE TABLE product (id INTEGER PRIMARY KEY, store_id INTEGER, quantity INTEGER, threshold INTEGER);
+        CREATE INDEX product_store ON product (store_id);
+        CREATE TABLE movement (id INTEGER PRIMARY KEY, product_id INTEGER, delta INTEGER, timestamp REAL);
+        """
+    )
+    connection.executemany(
+        'INSERT INTO product (id, store_id, quantity, threshold) VALUES (?, ?, ?, 10)',
+        [(product_id, product_id % STORES, 100) for product_id in range(1, rows + 1)],
+    )
+    connection.commit()
+    connection.close()
+
+
+def _connect(path, mode):
+    # isolation_level=None leaves transactions to the explicit BEGIN, as Django does
+    connection = sqlite3.connect(path, isolation_level=None)
+    apply_pragmas(connection, mode['pragmas'])
+    return connection
+
+
+def _read(connection, rows, transaction_mode):
+    # Two reads in one transaction, like a view in an atomic block
+    store_id = random.randrange(STORES)
+    connection.execute(f'BEGIN {transaction_mode}')
+    try:
+        connection.execute(
+            'SELECT COUNT(*), SUM(quantity), SUM(quantity <= threshold) FROM product WHERE store_id = ?', (store_id,)
+        ).fetchone()
+        connection.execute('SELECT * FROM product WHERE id = ?', (random.randint(1, rows),)).fetchone()
+        connection.execute('COMMIT')
+    except sqlite3.OperationalError:
+        connection.execute('ROLLBACK')
+        raise
+
+
+def _write(connection, rows, transaction_mode):
+    # Read-then-write, like a stock adjustment
+    product_id = random.randint(1, rows)
+    connection.execute(f'BEGIN {transaction_mode}')
+    try:
+        connection.execute('SELECT quantity FROM product WHERE id = ?', (product_id,)).fetchone()
+        connection.execute('UPDATE product SET quantity = quantity + 1 WHERE id = ?', (product_id,))
+        connection.execute(
+            'INSERT INTO movement (product_id, delta, timestamp) VALUES (?, 1, ?)', (product_id, time.time())
+        )
+        connection.execute('COMMIT')
+    except sqlite3.OperationalError:
+        connection.execute('ROLLBACK')
+        raise
+
+
+def _worker(args):
+    path, mode, rows, seconds, write_ratio, seed = args
+    random.seed(seed)
+    reads = writes = errors = 0
+    latencies = []
+    connection = _connect(path, mode) if mode['persistent'] else None
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        started = time.perf_counter()
+        is_write = random.random() < write_ratio
+        try:
+            current = connection or _connect(path, mode)
+            try:
+                if is_write:
+                    _write(current, rows, mode['write_transaction_mode'])
+                else:
+                    _read(current, rows, mode['transaction_mode'])
+            finally:
+                if connection is None:
+                    current.close()
+        except sqlite3.OperationalError:
+            errors += 1
+            continue
+        latencies.append(time.perf_counter() - started)
+        if is_write:
+            writes += 1
+        else:
+            reads += 1
+    if connection is not None:
+        connection.close()
+    return reads, writes, errors, latencies
+
+
+class Command(BaseCommand):
+    help = (
+        'Compare mixed read/write throughput of SQLite with its default settings (rollback journal, '
+        'deferred transactions, a connection per request) against the tuned DATABASES settings, '
+        'and against the tuned settings with every transaction IMMEDIATE or every transaction DEFERRED.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=4, help='Number of concurrent worker processes.')
+        parser.add_argument('--seconds', type=float, default=5, help='How long to run each configuration.')
+        parser.add_argument('--write-ratio', type=float, default=0.2, help='Share of operations that write.')
+        parser.add_argument('--rows', type=int, default=5000, help='Number of products in the scratch database.')
+
+    def handle(self, *args, **options):
+        tuned_options = settings.DATABASES['default'].get('OPTIONS', {})
+        tuned = {
+            'pragmas': tuned_options.get('pragmas') or {},
+            'transaction_mode': (tuned_options.get('transaction_mode') or 'DEFERRED').upper(),
+            'write_transaction_mode': (tuned_options.get('write_transaction_mode') or 'IMMEDIATE').upper(),
+            'persistent': bool(settings.DATABASES['default'].get('CONN_MAX_AGE')),
+        }
+        modes = {
+            'default': {
+                'pragmas': {'journal_mode': 'DELETE', 'synchronous': 'FULL', 'busy_timeout': 5000},
+                'transaction_mode': 'DEFERRED',
+                'write_transaction_mode': 'DEFERRED',
+                'persistent': False,
+            },
+            'tuned': tuned,
+            # The tuned settings with one transaction mode for reads and writes alike
+            'immediate': {**tuned, 'transaction_mode': 'IMMEDIATE', 'write_transaction_mode': 'IMMEDIATE'},
+            'deferred': {**tuned, 'transaction_mode': 'DEFERRED', 'write_transaction_mode': 'DEFERRED'},
+        }
+
+        self.stdout.write(
+            f"{options['workers']} workers, {options['seconds']}s per run, "
+            f"{options['write_ratio']:.0%} writes, {options['rows']} products"
+        )
+        self.stdout.write(f"{'mode':<10} {'ops/s':>9} {'reads/s':>9} {'writes/s':>9} {'errors':>7} {'p50 ms':>8} {'p99 ms':>8}")
+        for name, mode in modes.items():
+            with tempfile.TemporaryDirectory() as directory:
+                path = os.path.join(directory, 'benchmark.sqlite3')
+                _setup(path, options['rows'])
+                jobs = [
+                    (path, mode, options['rows'], options['seconds'], options['write_ratio'], seed)
+                    for seed in range(options['workers'])
+                ]
+                with multiprocessing.Pool(options['workers']) as pool:
+                    results = pool.map(_worker, jobs)
+
+            reads = sum(result[0] for result in results)
+            writes = sum(result[1] for result in results)
+            errors = sum(result[2] for result in results)
+            latencies = sorted(latency for result in results for latency in result[3])
+            p50 = latencies[len(latencies) // 2] * 1000 if latencies else 0
+            p99 = latencies[int(len(latencies) * 0.99)] * 1000 if latencies else 0
+            seconds = options['seconds']
+            self.stdout.write(
+                f'{name:<10} {(reads + writes) / seconds:>9.0f} {reads / seconds:>9.0f} {writes / seconds:>9.0f} '
+                f'{errors:>7} {p50:>8.2f} {p99:>8.2f}'
+            )
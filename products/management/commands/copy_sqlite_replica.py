@@ -0,0 +1,57 @@
+import sqlite3
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+
+def _sqlite_path(name):
+    """Return the file path of an SQLite database NAME, which may be a file: URI."""
+    name = str(name)
+    if name.startswith('file:'):
+        name = name[len('file:'):].split('?', 1)[0]
+    return name
+
+
+class Command(BaseCommand):
+    help = (
+        'Copy the primary SQLite database over the SQLite read replicas in DATABASE_READ_REPLICAS. '
+        'A stand-in for streaming replication when trying the replica router locally.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--interval',
+            type=float,
+            default=None,
+            help='Keep copying every this many seconds instead of copying once.',
+        )
+
+    def handle(self, *args, **options):
+        source = _sqlite_path(settings.DATABASES['default']['NAME'])
+        targets = [
+            _sqlite_path(settings.DATABASES[alias]['NAME'])
+            for alias in getattr(settings, 'DATABASE_READ_REPLICAS', ())
+            if 'sqlite' in settings.DATABASES[alias]['ENGINE']
+        ]
+        if not targets:
+            raise CommandError('No SQLite replicas configured; set DATABASE_REPLICA_PATHS')
+
+        while True:
+            started = time.monotonic()
+            primary = sqlite3.connect(source)
+            try:
+                for target in targets:
+                    replica = sqlite3.connect(target)
+                    try:
+                        # The backup API copies a consistent snapshot, page by page, in place
+                        primary.backup(replica)
+                    finally:
+                        replica.close()
+            finally:
+                primary.close()
+            self.stdout.write(self.style.SUCCESS(
+                f'Copied {source} to {len(targets)} replicas in {time.monotonic() - started:.2f}s'
+            ))
+            if options['interval'] is None:
+                break
+            time.sleep(options['interval'])
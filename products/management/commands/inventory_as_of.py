@@ -0,0 +1,47 @@
+import csv
+import json
+from django.core.management.base import BaseCommand, CommandError
+from products.ledger import inventory_as_of, parse_as_of, summarize_inventory
+from products.models import Store
+from products.sharding import sharding_enabled
+
+INVENTORY_COLUMNS = ('store_id', 'store_name', 'product_id', 'sku', 'name', 'quantity', 'price', 'value')
+
+
+class Command(BaseCommand):
+    help = 'Print the stock on hand per store and product at a past date or time.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('at', help='ISO date or datetime; a date means the end of that day.')
+        parser.add_argument(
+            '--store',
+            type=int,
+            action='append',
+            dest='store_ids',
+            help='Only report the given store id. Can be repeated.',
+        )
+        parser.add_argument(
+            '--format',
+            choices=('csv', 'json'),
+            default='csv',
+            help='csv prints one row per product, json prints per-store totals.',
+        )
+
+    def handle(self, *args, **options):
+        if sharding_enabled():
+            raise CommandError('Not available while products are sharded across databases')
+        at = parse_as_of(options['at'])
+        if at is None:
+            raise CommandError('at must be an ISO date or datetime')
+
+        store_ids = options['store_ids'] or list(Store.objects.values_list('id', flat=True))
+        rows = inventory_as_of(at, store_ids)
+
+        if options['format'] == 'json':
+            self.stdout.write(json.dumps({'at': at.isoformat(), 'stores': summarize_inventory(rows)}, indent=2))
+            return
+
+        writer = csv.DictWriter(self.stdout, fieldnames=INVENTORY_COLUMNS)
+        writer.writeheader()
+        for row in rows:
+            writer.writerow(row)
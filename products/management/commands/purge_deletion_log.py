@@ -0,0 +1,22 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from products.sync import purge_deletion_log
+
+
+class Command(BaseCommand):
+    help = 'Delete sync tombstones older than SYNC_DELETION_LOG_RETENTION_DAYS.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days',
+            type=int,
+            default=None,
+            help='Keep tombstones for this many days instead of SYNC_DELETION_LOG_RETENTION_DAYS.',
+        )
+
+    def handle(self, *args, **options):
+        days = options['days']
+        if days is None:
+            days = getattr(settings, 'SYNC_DELETION_LOG_RETENTION_DAYS', 30)
+        count = purge_deletion_log(days)
+        self.stdout.write(self.style.SUCCESS(f'Deleted {count} tombstones older than {days} days'))
@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand, CommandError
+from products.rollups import rebuild_rollups, verify_rollups
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the inventory rollup table from the product table, or verify it with --verify.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--verify',
+            action='store_true',
+            help='Only compare the rollups with the product table and report mismatches.',
+        )
+        parser.add_argument(
+            '--store',
+            type=int,
+            action='append',
+            dest='store_ids',
+            help='Rebuild only the given store id. Can be repeated.',
+        )
+
+    def handle(self, *args, **options):
+        if options['verify']:
+            mismatches = verify_rollups()
+            for store_id, supplier_id, stored, expected in mismatches:
+                self.stdout.write(
+                    f'store={store_id} supplier={supplier_id} stored={stored} expected={expected}'
+                )
+            if mismatches:
+                raise CommandError(f'{len(mismatches)} rollup rows are out of date')
+            self.stdout.write(self.style.SUCCESS('Inventory rollups are up to date'))
+            return
+
+        count = rebuild_rollups(options['store_ids'])
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt {count} inventory rollup rows'))
@@ -0,0 +1,55 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections
+from ims_project.transactions import write_atomic
+from products.models import Product, ProductRegistry
+from products.sharding import product_atomic, product_shards, shard_for_store, sharding_enabled
+
+BATCH_SIZE = 1000
+
+
+class Command(BaseCommand):
+    help = (
+        'Copy the products of the default database to the shards of their stores and register their '
+        'ids and SKUs. Run once after enabling PRODUCT_SHARDS and migrating each shard.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--delete',
+            action='store_true',
+            help='Delete the products from the default database once they are copied.',
+        )
+
+    def _copy(self, batch):
+        by_shard = {}
+        for product in batch:
+            by_shard.setdefault(shard_for_store(product.store_id), []).append(product)
+        with product_atomic(*by_shard):
+            ProductRegistry.objects.bulk_create(
+                [ProductRegistry(id=product.id, sku=product.sku, store_id=product.store_id) for product in batch],
+                ignore_conflicts=True,
+            )
+            # bulk_create sends no signals, so the rollups, which already count these products, stay as they are
+            for alias, products in by_shard.items():
+                Product.objects.using(alias).bulk_create(products, ignore_conflicts=True)
+
+    def handle(self, *args, **options):
+        if not sharding_enabled():
+            raise CommandError('Products are not sharded; set PRODUCT_SHARD_PATHS or PRODUCT_SHARDS first')
+
+        count = 0
+        batch = []
+        for product in Product.objects.using(DEFAULT_DB_ALIAS).order_by('id').iterator(chunk_size=BATCH_SIZE):
+            batch.append(product)
+            if len(batch) >= BATCH_SIZE:
+                self._copy(batch)
+                count += len(batch)
+                batch = []
+        self._copy(batch)
+        count += len(batch)
+
+        if options['delete']:
+            # A plain DELETE: the deletion signals would take the products out of the rollups and sync
+            with write_atomic(), connections[DEFAULT_DB_ALIAS].cursor() as cursor:
+                cursor.execute(f'DELETE FROM {Product._meta.db_table}')
+        self.stdout.write(self.style.SUCCESS(f'Copied {count} products to {len(product_shards())} shards'))
@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand, CommandError
+from products.ledger import stores_due_for_checkpoint, take_snapshots
+from products.sharding import sharding_enabled
+
+
+class Command(BaseCommand):
+    help = 'Write a stock snapshot for every product. Run periodically to bound stock history replays.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--store',
+            type=int,
+            action='append',
+            dest='store_ids',
+            help='Only snapshot products in the given store id. Can be repeated.',
+        )
+        parser.add_argument(
+            '--if-due',
+            action='store_true',
+            help=(
+                'Only snapshot stores whose checkpoint is older than STOCK_CHECKPOINT_INTERVAL_HOURS '
+                'or has more than STOCK_CHECKPOINT_MAX_MOVEMENTS movements after it.'
+            ),
+        )
+
+    def handle(self, *args, **options):
+        if sharding_enabled():
+            raise CommandError('Not available while products are sharded across databases')
+        store_ids = options['store_ids']
+        if options['if_due']:
+            due = stores_due_for_checkpoint()
+            store_ids = [store_id for store_id in due if store_ids is None or store_id in store_ids]
+            if not store_ids:
+                self.stdout.write(self.style.SUCCESS('No stores are due for a stock snapshot'))
+                return
+
+        count = take_snapshots(store_ids)
+        self.stdout.write(self.style.SUCCESS(f'Wrote {count} stock snapshots'))
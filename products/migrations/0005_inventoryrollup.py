@@ -0,0 +1,53 @@
+# Generated by Django 5.0.7 on 2026-10-17 04:26
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count, DecimalField, F, Q, Sum
+
+
+def populate_rollups(apps, schema_editor):
+    Product = apps.get_model('products', 'Product')
+    InventoryRollup = apps.get_model('products', 'InventoryRollup')
+
+    rows = Product.objects.order_by().values('store_id', 'supplier_id').annotate(
+        product_count=Count('id'),
+        low_stock_count=Count('id', filter=Q(quantity__lte=F('threshold'))),
+        total_value=Sum(F('price') * F('quantity'), output_field=DecimalField(max_digits=20, decimal_places=2)),
+    )
+    InventoryRollup.objects.bulk_create([
+        InventoryRollup(
+            store_id=row['store_id'],
+            supplier_id=row['supplier_id'],
+            product_count=row['product_count'],
+            low_stock_count=row['low_stock_count'],
+            total_value=row['total_value'] or 0,
+        )
+        for row in rows
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0004_product_updated_id_idx'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='InventoryRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('product_count', models.IntegerField(default=0)),
+                ('low_stock_count', models.IntegerField(default=0)),
+                ('total_value', models.DecimalField(decimal_places=2, default=0, max_digits=20)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('store', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='inventory_rollups', to='products.store')),
+                ('supplier', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='inventory_rollups', to='products.supplier')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='inventoryrollup',
+            constraint=models.UniqueConstraint(fields=('store', 'supplier'), name='unique_rollup_store_supplier'),
+        ),
+        migrations.RunPython(populate_rollups, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.0.7 on 2026-10-17 04:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0007_stock_ledger'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='stocksnapshot',
+            index=models.Index(fields=['store', 'taken_at'], name='snapshot_store_time_idx'),
+        ),
+    ]
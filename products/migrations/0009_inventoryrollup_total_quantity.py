@@ -0,0 +1,31 @@
+# Generated by Django 5.0.7 on 2026-10-17 04:33
+
+from django.db import migrations, models
+from django.db.models import Sum
+
+
+def populate_total_quantity(apps, schema_editor):
+    Product = apps.get_model('products', 'Product')
+    InventoryRollup = apps.get_model('products', 'InventoryRollup')
+
+    rows = Product.objects.order_by().values('store_id', 'supplier_id').annotate(total_quantity=Sum('quantity'))
+    for row in rows:
+        InventoryRollup.objects.filter(store_id=row['store_id'], supplier_id=row['supplier_id']).update(
+            total_quantity=row['total_quantity'] or 0
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0008_snapshot_store_time_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='inventoryrollup',
+            name='total_quantity',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.RunPython(populate_total_quantity, migrations.RunPython.noop),
+    ]
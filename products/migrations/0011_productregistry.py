@@ -0,0 +1,22 @@
+# Generated by Django 5.0.7 on 2026-10-17 04:57
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0010_sync_indexes_deletionlog'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductRegistry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('sku', models.CharField(max_length=50, unique=True)),
+                ('store', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='registered_products', to='products.store')),
+            ],
+        ),
+    ]
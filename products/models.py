@@ -14,6 +14,12 @@ class Store(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            # Supports the delta sync, which reads stores changed since a cursor
+            models.Index(fields=['updated_at', 'id'], name='store_updated_id_idx'),
+        ]
+
     def __str__(self):
         return self.name
 
@@ -30,6 +36,12 @@ class Supplier(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            # Supports the delta sync, which reads suppliers changed since a cursor
+            models.Index(fields=['updated_at', 'id'], name='supplier_updated_id_idx'),
+        ]
+
     def __str__(self):
         return self.name
 
@@ -45,13 +57,139 @@ class Product(models.Model):
     threshold = models.IntegerField(default=10, help_text="Minimum quantity before restock alert")
     supplier = models.ForeignKey(Supplier, on_delete=models.CASCADE, related_name='products')
     store = models.ForeignKey(Store, on_delete=models.CASCADE, related_name='products')
+    # Stored generated column, so it stays correct for bulk and F-expression updates too
+    is_low_stock = models.GeneratedField(
+        expression=models.ExpressionWrapper(
+            models.Q(quantity__lte=models.F('threshold')),
+            output_field=models.BooleanField(),
+        ),
+        output_field=models.BooleanField(),
+        db_persist=True,
+    )
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            # Supports keyset pagination of product_list ordered by (updated_at, id)
+            models.Index(fields=['updated_at', 'id'], name='product_updated_id_idx'),
+            # Low stock products are rare, so only they are indexed
+            models.Index(
+                fields=['store'],
+                condition=models.Q(is_low_stock=True),
+                name='product_low_stock_store_idx',
+            ),
+        ]
+
     def __str__(self):
         return f"{self.name} ({self.sku})"
 
-    @property
-    def is_low_stock(self):
-        """Check if the product is below the threshold quantity."""
-        return self.quantity <= self.threshold
+class InventoryRollup(models.Model):
+    """
+    Running inventory totals for one store/supplier pair.
+    Maintained incrementally as products change (see products/rollups.py), so
+    per-store and per-supplier figures are read without scanning products.
+    """
+    store = models.ForeignKey(Store, on_delete=models.CASCADE, related_name='inventory_rollups')
+    supplier = models.ForeignKey(Supplier, on_delete=models.CASCADE, related_name='inventory_rollups')
+    product_count = models.IntegerField(default=0)
+    low_stock_count = models.IntegerField(default=0)
+    total_quantity = models.BigIntegerField(default=0)
+    total_value = models.DecimalField(max_digits=20, decimal_places=2, default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['store', 'supplier'], name='unique_rollup_store_supplier'),
+        ]
+
+    def __str__(self):
+        return f"{self.store} / {self.supplier}"
+
+class StockMovement(models.Model):
+    """
+    Append-only ledger of quantity changes.
+    Rows reference products and stores without database constraints so that
+    history survives when a product or store is deleted.
+    """
+    REASON_CHOICES = (
+        ('create', 'Product created'),
+        ('update', 'Product updated'),
+        ('delete', 'Product deleted'),
+        ('adjustment', 'Stock adjustment'),
+        ('import', 'Bulk import'),
+        ('admin', 'Admin change'),
+    )
+
+    product = models.ForeignKey(Product, on_delete=models.DO_NOTHING, db_constraint=False, related_name='stock_movements')
+    store = models.ForeignKey(Store, on_delete=models.DO_NOTHING, db_constraint=False, related_name='stock_movements')
+    delta = models.IntegerField()
+    reason = models.CharField(max_length=20, choices=REASON_CHOICES)
+    timestamp = models.DateTimeField(default=timezone.now)
+    user = models.ForeignKey('users.CustomUser', on_delete=models.SET_NULL, null=True, blank=True, related_name='stock_movements')
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['product', 'timestamp'], name='movement_product_time_idx'),
+            models.Index(fields=['store', 'timestamp'], name='movement_store_time_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.product_id}: {self.delta:+d} ({self.reason})"
+
+class StockSnapshot(models.Model):
+    """
+    Quantity of a product at a point in time.
+    The quantity at any later time is the snapshot plus the movements after it.
+    """
+    product = models.ForeignKey(Product, on_delete=models.DO_NOTHING, db_constraint=False, related_name='stock_snapshots')
+    store = models.ForeignKey(Store, on_delete=models.DO_NOTHING, db_constraint=False, related_name='stock_snapshots')
+    quantity = models.IntegerField()
+    taken_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['product', 'taken_at'], name='snapshot_product_time_idx'),
+            models.Index(fields=['store', 'taken_at'], name='snapshot_store_time_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.product_id}: {self.quantity} at {self.taken_at.isoformat()}"
+
+class DeletionLog(models.Model):
+    """
+    Tombstones of deleted products, stores and suppliers, so that sync clients
+    can drop their local copies. Written by signals on every delete.
+    """
+    OBJECT_TYPE_CHOICES = (
+        ('product', 'Product'),
+        ('store', 'Store'),
+        ('supplier', 'Supplier'),
+    )
+
+    object_type = models.CharField(max_length=20, choices=OBJECT_TYPE_CHOICES)
+    object_id = models.BigIntegerField()
+    # Store of a deleted product, so product tombstones can be scoped like products
+    store_id = models.BigIntegerField(null=True, blank=True)
+    deleted_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['deleted_at', 'id'], name='deletion_time_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.object_type} {self.object_id} deleted"
+
+class ProductRegistry(models.Model):
+    """
+    Central index of products when they are sharded across databases by store
+    (see products.sharding): hands out product ids that are unique across the
+    shards, keeps SKUs globally unique and records which store, and so which
+    shard, holds each product. Unused while sharding is disabled.
+    """
+    sku = models.CharField(max_length=50, unique=True)
+    store = models.ForeignKey(Store, on_delete=models.CASCADE, related_name='registered_products')
+
+    def __str__(self):
+        return f"{self.sku} in store {self.store_id}"
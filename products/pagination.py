@@ -0,0 +1,107 @@
+import base64
+import json
+from datetime import datetime
+from django.db.models import Q
+
+# Orderings supported by keyset pagination, mapped to the columns of the key
+KEYSET_ORDERINGS = {
+    'id': ('id',),
+    'updated_at': ('updated_at', 'id'),
+}
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+
+class InvalidCursor(ValueError):
+    """Raised when a pagination cursor or page size cannot be decoded."""
+
+
+def encode_cursor(ordering, row):
+    """
+    Build an opaque cursor pointing just after the given row.
+    The row must contain every column of the ordering key.
+    """
+    values = []
+    for column in KEYSET_ORDERINGS[ordering]:
+        value = row[column]
+        if isinstance(value, datetime):
+            value = value.isoformat()
+        values.append(value)
+
+    payload = json.dumps({'o': ordering, 'v': values}, separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+
+def _decode_value(column, value):
+    """Convert one key value of a cursor back to the type of its column."""
+    if column == 'id':
+        if not isinstance(value, int) or isinstance(value, bool):
+            raise InvalidCursor('Invalid cursor')
+        return value
+    if not isinstance(value, str):
+        raise InvalidCursor('Invalid cursor')
+    value = datetime.fromisoformat(value)
+    if value.tzinfo is None:
+        raise InvalidCursor('Invalid cursor')
+    return value
+
+
+def decode_cursor(cursor, ordering):
+    """
+    Decode a cursor produced by encode_cursor for the given ordering.
+    Returns the list of key values the next page should start after.
+    """
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        values = payload['v']
+        if payload['o'] != ordering or not isinstance(values, list) or len(values) != len(KEYSET_ORDERINGS[ordering]):
+            raise InvalidCursor('Cursor does not match the requested ordering')
+        return [_decode_value(column, value) for column, value in zip(KEYSET_ORDERINGS[ordering], values)]
+    except InvalidCursor:
+        raise
+    except (ValueError, KeyError, TypeError):
+        raise InvalidCursor('Invalid cursor')
+
+
+def parse_page_size(value, default=DEFAULT_PAGE_SIZE):
+    """Parse the ?limit= query parameter, clamping it to MAX_PAGE_SIZE."""
+    if value in (None, ''):
+        return default
+    try:
+        limit = int(value)
+    except (TypeError, ValueError):
+        raise InvalidCursor('limit must be an integer')
+    if limit < 1:
+        raise InvalidCursor('limit must be positive')
+    return min(limit, MAX_PAGE_SIZE)
+
+
+def keyset_page(queryset, ordering, cursor=None, limit=DEFAULT_PAGE_SIZE):
+    """
+    Return one page of a values() queryset ordered by the keyset columns.
+
+    The queryset must select every column of the ordering key. Only limit + 1
+    rows are ever read, so the cost of a page does not depend on its position.
+    Returns a tuple of (rows, next_cursor); next_cursor is None on the last page.
+    """
+    columns = KEYSET_ORDERINGS[ordering]
+    queryset = queryset.order_by(*columns)
+
+    if cursor:
+        values = decode_cursor(cursor, ordering)
+        if ordering == 'id':
+            queryset = queryset.filter(id__gt=values[0])
+        else:
+            queryset = queryset.filter(
+                Q(updated_at__gt=values[0]) | Q(updated_at=values[0], id__gt=values[1])
+            )
+
+    rows = list(queryset[:limit + 1])
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(ordering, rows[-1])
+
+    return rows, next_cursor
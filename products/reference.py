@@ -0,0 +1,98 @@
+import time
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from users.models import CustomUser
+from .models import Store, Supplier
+
+VERSION_KEY = 'reference-data:version'
+
+
+def _data_key(version):
+    return f'reference-data:{version}'
+
+
+def _timeout():
+    return getattr(settings, 'REFERENCE_DATA_CACHE_TIMEOUT', 3600)
+
+
+def _bump():
+    try:
+        cache.incr(VERSION_KEY)
+    except ValueError:
+        # A missing counter starts from the clock, so an evicted one never reuses a version
+        cache.set(VERSION_KEY, time.time_ns(), timeout=None)
+
+
+def invalidate_reference_data():
+    """
+    Move the reference data to a new version, now and again when the
+    surrounding transaction commits, so data rebuilt from uncommitted rows
+    in between is never served under the final version.
+    """
+    _bump()
+    transaction.on_commit(_bump)
+
+
+def reference_version():
+    """Return the current reference data version as a string."""
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        cache.add(VERSION_KEY, time.time_ns(), timeout=None)
+        version = cache.get(VERSION_KEY)
+    return str(version)
+
+
+def _people(role):
+    return {
+        row.pop('id'): row
+        for row in CustomUser.objects.filter(role=role).order_by('id').values(
+            'id', 'username', 'email', 'first_name', 'last_name'
+        )
+    }
+
+
+def build_reference_data():
+    """
+    Read the stores, suppliers with the stores they serve, managers and staff,
+    each as a dict keyed by id. Runs four queries.
+    """
+    stores = {row.pop('id'): row for row in Store.objects.order_by('id').values('id', 'name', 'manager_id')}
+    suppliers = {row.pop('id'): {**row, 'store_ids': []} for row in Supplier.objects.order_by('id').values('id', 'name')}
+    for supplier_id, store_id in Supplier.stores.through.objects.order_by('store_id').values_list(
+        'supplier_id', 'store_id'
+    ):
+        suppliers[supplier_id]['store_ids'].append(store_id)
+    return {
+        'stores': stores,
+        'suppliers': suppliers,
+        'managers': _people('manager'),
+        'staff': _people('staff'),
+    }
+
+
+def reference_data():
+    """
+    Return (version, data) for the shared reference data, rebuilding it only
+    when the version has moved since it was last cached.
+    """
+    version = reference_version()
+    data = cache.get(_data_key(version))
+    if data is None:
+        data = build_reference_data()
+        cache.set(_data_key(version), data, timeout=_timeout())
+    return version, data
+
+
+def scoped_reference_data(data, store_ids):
+    """Restrict reference data to the given store ids, or return it unchanged for None (all stores)."""
+    if store_ids is None:
+        return data
+    return {
+        **data,
+        'stores': {store_id: row for store_id, row in data['stores'].items() if store_id in store_ids},
+        'suppliers': {
+            supplier_id: {**row, 'store_ids': [store_id for store_id in row['store_ids'] if store_id in store_ids]}
+            for supplier_id, row in data['suppliers'].items()
+        },
+    }
@@ -0,0 +1,165 @@
+from collections import defaultdict
+from decimal import Decimal
+from django.db.models import Count, DecimalField, F, Q, Sum
+from django.utils import timezone
+from ims_project.transactions import write_atomic
+from .cache import bump_versions
+from .models import InventoryRollup
+
+ZERO = Decimal('0.00')
+
+
+def product_state(product):
+    """
+    Return the part of a product that the rollups depend on as a tuple of
+    (store_id, supplier_id, price, quantity, threshold).
+
+    Values assigned straight from request data may still be strings, so they
+    are normalised here rather than trusting the instance attributes.
+    """
+    return (
+        product.store_id,
+        product.supplier_id,
+        Decimal(str(product.price)),
+        int(product.quantity),
+        int(product.threshold),
+    )
+
+
+def _contribution(state):
+    """Return the (product_count, low_stock_count, total_quantity, total_value) a product state adds."""
+    _, _, price, quantity, threshold = state
+    return 1, int(quantity <= threshold), quantity, price * quantity
+
+
+def apply_changes(changes):
+    """
+    Apply product changes to the rollups.
+
+    changes is an iterable of (old_state, new_state) pairs as returned by
+    product_state(); old_state is None for inserts and new_state is None for
+    deletes. Deltas are summed per store/supplier pair and written with one
+    F-expression UPDATE per affected pair. Cached responses about the stores
+    and suppliers involved are invalidated as well.
+    """
+    changes = list(changes)
+    deltas = defaultdict(lambda: [0, 0, 0, ZERO])
+
+    # Every product write passes through here, so cached responses about the
+    # touched stores and suppliers are invalidated even when no figure changes
+    states = [state for change in changes for state in change if state is not None]
+    bump_versions({state[0] for state in states}, {state[1] for state in states})
+
+    for old_state, new_state in changes:
+        if old_state == new_state:
+            continue
+        for state, sign in ((old_state, -1), (new_state, 1)):
+            if state is None:
+                continue
+            delta = deltas[(state[0], state[1])]
+            for index, amount in enumerate(_contribution(state)):
+                delta[index] += sign * amount
+
+    deltas = {pair: delta for pair, delta in deltas.items() if any(delta)}
+    if not deltas:
+        return
+
+    with write_atomic():
+        # Only pairs gaining products can be missing a row; creating rows for
+        # shrinking pairs could resurrect a store or supplier being deleted.
+        new_pairs = [pair for pair, delta in deltas.items() if delta[0] > 0]
+        if new_pairs:
+            InventoryRollup.objects.bulk_create(
+                [InventoryRollup(store_id=store_id, supplier_id=supplier_id) for store_id, supplier_id in new_pairs],
+                ignore_conflicts=True,
+            )
+
+        # update() skips auto_now, and updated_at is what conditional GETs compare
+        now = timezone.now()
+        for (store_id, supplier_id), (count, low, quantity, value) in deltas.items():
+            InventoryRollup.objects.filter(store_id=store_id, supplier_id=supplier_id).update(
+                product_count=F('product_count') + count,
+                low_stock_count=F('low_stock_count') + low,
+                total_quantity=F('total_quantity') + quantity,
+                total_value=F('total_value') + value,
+                updated_at=now,
+            )
+
+
+def compute_rollups(store_ids=None):
+    """
+    Compute rollup figures from the product table, or from every product
+    shard when products are sharded (see products.sharding).
+    Returns a dict of {(store_id, supplier_id): (product_count, low_stock_count, total_quantity, total_value)}.
+    """
+    from .sharding import scatter, shard_querysets
+
+    def aggregate(products):
+        return products.order_by().values('store_id', 'supplier_id').annotate(
+            product_count=Count('id'),
+            low_stock_count=Count('id', filter=Q(is_low_stock=True)),
+            total_quantity=Sum('quantity'),
+            total_value=Sum(F('price') * F('quantity'), output_field=DecimalField(max_digits=20, decimal_places=2)),
+        )
+
+    querysets = shard_querysets(store_ids, aggregate)
+    querysets_by_alias = {queryset.db: queryset for queryset in querysets}
+
+    # A store's products live in a single shard, so the groups never overlap
+    return {
+        (row['store_id'], row['supplier_id']): (
+            row['product_count'],
+            row['low_stock_count'],
+            row['total_quantity'] or 0,
+            Decimal(row['total_value'] or 0).quantize(Decimal('0.01')),
+        )
+        for rows in scatter(lambda alias: list(querysets_by_alias[alias]), list(querysets_by_alias))
+        for row in rows
+    }
+
+
+def rebuild_rollups(store_ids=None):
+    """
+    Recompute the rollups from scratch, for all stores or only the given ones.
+    Returns the number of rollup rows written.
+    """
+    expected = compute_rollups(store_ids)
+
+    with write_atomic():
+        existing = InventoryRollup.objects.all()
+        if store_ids is not None:
+            existing = existing.filter(store_id__in=store_ids)
+        existing.delete()
+
+        InventoryRollup.objects.bulk_create([
+            InventoryRollup(
+                store_id=store_id,
+                supplier_id=supplier_id,
+                product_count=count,
+                low_stock_count=low,
+                total_quantity=quantity,
+                total_value=value,
+            )
+            for (store_id, supplier_id), (count, low, quantity, value) in expected.items()
+        ])
+
+    return len(expected)
+
+
+def verify_rollups():
+    """
+    Compare the stored rollups with figures computed from the product table.
+    Returns a list of (store_id, supplier_id, stored, expected) mismatches.
+    """
+    expected = compute_rollups()
+    stored = {
+        (row.store_id, row.supplier_id): (row.product_count, row.low_stock_count, row.total_quantity, row.total_value)
+        for row in InventoryRollup.objects.all()
+    }
+
+    empty = (0, 0, 0, ZERO)
+    mismatches = []
+    for pair in sorted(set(expected) | set(stored)):
+        if stored.get(pair, empty) != expected.get(pair, empty):
+            mismatches.append((pair[0], pair[1], stored.get(pair), expected.get(pair)))
+    return mismatches
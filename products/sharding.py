@@ -0,0 +1,262 @@
+"""
+Optional sharding of products across several databases by store.
+
+With PRODUCT_SHARDS empty (the default) every product lives in the default
+database and the helpers below fall through to it. When PRODUCT_SHARDS
+lists database aliases, each product row lives in the shard of its store:
+PRODUCT_SHARD_MAP pins stores to shards, and any other store goes to
+PRODUCT_SHARDS[store_id % len(PRODUCT_SHARDS)]. Stores, suppliers, users,
+rollups and the stock ledger stay in the default database, together with
+the ProductRegistry, which hands out product ids and keeps SKUs unique
+across the shards.
+
+Product queries must name their shard with .using(); ProductShardRouter
+routes saves and deletes of loaded products by their store, and
+scatter()/gather_rows()/gather_page() run one query per shard for views
+that span stores.
+"""
+import contextvars
+import heapq
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack, contextmanager
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+from ims_project.transactions import write_atomic
+from .models import Product, ProductRegistry, Store, Supplier
+from .pagination import KEYSET_ORDERINGS, encode_cursor, keyset_page
+from .rollups import apply_changes
+
+# Models whose rows are split across the shards; stock ledger rows can join them later
+SHARDED_MODELS = {'product'}
+
+
+def product_shards():
+    return list(getattr(settings, 'PRODUCT_SHARDS', ()))
+
+
+def sharding_enabled():
+    return bool(product_shards())
+
+
+def shard_for_store(store_id):
+    """Return the database alias holding the products of a store."""
+    shards = product_shards()
+    if not shards:
+        return DEFAULT_DB_ALIAS
+    store_id = int(store_id)
+    return getattr(settings, 'PRODUCT_SHARD_MAP', {}).get(store_id) or shards[store_id % len(shards)]
+
+
+def shard_for_product(product_id):
+    """Return the alias holding a product, or None if no such product is registered."""
+    if not sharding_enabled():
+        return DEFAULT_DB_ALIAS
+    store_id = ProductRegistry.objects.filter(id=product_id).values_list('store_id', flat=True).first()
+    return shard_for_store(store_id) if store_id is not None else None
+
+
+def products_in(alias):
+    """Return the Product manager for a shard alias."""
+    return Product.objects if alias == DEFAULT_DB_ALIAS else Product.objects.using(alias)
+
+
+def shards_for_stores(store_ids):
+    """
+    Group store ids by shard. Returns {alias: store_ids}; store_ids None (all
+    stores) maps every shard to None.
+    """
+    if not sharding_enabled():
+        return {DEFAULT_DB_ALIAS: store_ids}
+    if store_ids is None:
+        return {alias: None for alias in product_shards()}
+    groups = {}
+    for store_id in store_ids:
+        groups.setdefault(shard_for_store(store_id), []).append(store_id)
+    return groups
+
+
+def shard_querysets(store_ids, queryset_for=lambda products: products.all()):
+    """
+    Return one product queryset per shard holding any of the given stores
+    (None for all stores), built by queryset_for(manager) and narrowed to the stores.
+    """
+    querysets = []
+    for alias, ids in shards_for_stores(store_ids).items():
+        queryset = queryset_for(products_in(alias))
+        if ids is not None:
+            queryset = queryset.filter(store_id__in=ids)
+        querysets.append(queryset)
+    return querysets
+
+
+def sku_taken(sku):
+    """Return True if any product, in any shard, uses the SKU."""
+    if sharding_enabled():
+        return ProductRegistry.objects.filter(sku=sku).exists()
+    return Product.objects.filter(sku=sku).exists()
+
+
+def register_product(sku, store_id):
+    """
+    Reserve a product id and SKU in the registry, or return None while sharding
+    is disabled and the product table assigns ids itself.
+    """
+    if not sharding_enabled():
+        return None
+    return ProductRegistry.objects.create(sku=sku, store_id=store_id).id
+
+
+def save_product(product, old_state):
+    """
+    Save a loaded product. When a store change moves it to another shard it is
+    inserted there and removed from the old shard, and the registry follows
+    its SKU and store.
+    """
+    if not sharding_enabled():
+        product.save()
+        return
+    source = product._state.db
+    target = shard_for_store(product.store_id)
+    if target == source:
+        product.save(using=target)
+    else:
+        # The insert counts the product into the rollups of its new store; the
+        # plain DELETE skips the deletion signals, so take it out of the old one here
+        product.save(using=target, force_insert=True)
+        with connections[source].cursor() as cursor:
+            cursor.execute(f'DELETE FROM {Product._meta.db_table} WHERE id = %s', [product.pk])
+        apply_changes([(old_state, None)])
+    ProductRegistry.objects.filter(id=product.pk).update(sku=product.sku, store_id=product.store_id)
+
+
+def delete_product(product):
+    """Delete a loaded product and release its id and SKU."""
+    product_id = product.pk
+    product.delete()
+    if sharding_enabled():
+        ProductRegistry.objects.filter(id=product_id).delete()
+
+
+@contextmanager
+def product_atomic(*aliases):
+    """
+    Open a transaction on the default database and on each given shard.
+    The shards commit first; SQLite and most setups cannot commit across
+    databases atomically, so a failure in between is repaired by
+    rebuild_inventory_rollups.
+    """
+    with ExitStack() as stack:
+        stack.enter_context(write_atomic())
+        for alias in sorted(set(aliases) - {DEFAULT_DB_ALIAS}):
+            stack.enter_context(write_atomic(using=alias))
+        yield
+
+
+def _run_on_shard(function, alias):
+    try:
+        return function(alias)
+    finally:
+        if alias != DEFAULT_DB_ALIAS:
+            # Worker threads open their own connections; do not leave them behind
+            connections[alias].close()
+
+
+def scatter(function, aliases=None):
+    """
+    Call function(alias) for each shard, concurrently when there are several,
+    and return the results in shard order.
+    """
+    aliases = list(aliases) if aliases is not None else (product_shards() or [DEFAULT_DB_ALIAS])
+    if len(aliases) == 1:
+        return [function(aliases[0])]
+    with ThreadPoolExecutor(max_workers=len(aliases)) as executor:
+        futures = [
+            executor.submit(contextvars.copy_context().run, _run_on_shard, function, alias)
+            for alias in aliases
+        ]
+        return [future.result() for future in futures]
+
+
+def _key(ordering):
+    columns = KEYSET_ORDERINGS[ordering]
+    return lambda row: tuple(row[column] for column in columns)
+
+
+def gather_rows(querysets, ordering='id'):
+    """Evaluate values() querysets from several shards and merge their rows in keyset order."""
+    columns = KEYSET_ORDERINGS[ordering]
+    querysets_by_alias = {queryset.db: queryset.order_by(*columns) for queryset in querysets}
+    results = scatter(lambda alias: list(querysets_by_alias[alias]), list(querysets_by_alias))
+    return list(heapq.merge(*results, key=_key(ordering)))
+
+
+def gather_page(querysets, ordering='id', cursor=None, limit=100):
+    """
+    Return one keyset page merged from values() querysets on several shards,
+    as (rows, next_cursor). Each shard reads at most limit + 1 rows after the cursor.
+    """
+    querysets_by_alias = {queryset.db: queryset for queryset in querysets}
+    pages = scatter(
+        lambda alias: keyset_page(querysets_by_alias[alias], ordering, cursor, limit), list(querysets_by_alias)
+    )
+    merged = list(heapq.merge(*[rows for rows, _ in pages], key=_key(ordering)))
+    rows = merged[:limit]
+    more = len(merged) > limit or any(next_cursor for _, next_cursor in pages)
+    return rows, encode_cursor(ordering, rows[-1]) if more and rows else None
+
+
+def add_related_names(rows, store_fields=('name',), supplier_fields=('name',)):
+    """
+    Fill in the store__<field> and supplier__<field> columns of product rows
+    read from a shard, which cannot join the stores and suppliers tables.
+    """
+    stores = {
+        row['id']: row for row in
+        Store.objects.filter(id__in={row['store_id'] for row in rows}).values('id', *store_fields)
+    } if store_fields else {}
+    suppliers = {
+        row['id']: row for row in
+        Supplier.objects.filter(id__in={row['supplier_id'] for row in rows}).values('id', *supplier_fields)
+    } if supplier_fields else {}
+    for row in rows:
+        for field in store_fields:
+            row[f'store__{field}'] = stores.get(row['store_id'], {}).get(field)
+        for field in supplier_fields:
+            row[f'supplier__{field}'] = suppliers.get(row['supplier_id'], {}).get(field)
+    return rows
+
+
+class ProductShardRouter:
+    """
+    Route sharded models to the shard of their store while sharding is
+    enabled. Queries without a product instance to go by must use .using();
+    everything else is left to the next router.
+    """
+
+    def _is_sharded(self, model):
+        return model._meta.app_label == 'products' and model._meta.model_name in SHARDED_MODELS
+
+    def _route(self, model, hints):
+        if not sharding_enabled() or not self._is_sharded(model):
+            return None
+        instance = hints.get('instance')
+        if instance is not None and getattr(instance, 'store_id', None) is not None:
+            return shard_for_store(instance.store_id)
+        return None
+
+    def db_for_read(self, model, **hints):
+        return self._route(model, hints)
+
+    def db_for_write(self, model, **hints):
+        return self._route(model, hints)
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Products on a shard refer to stores and suppliers in the default database
+        if sharding_enabled() and (self._is_sharded(type(obj1)) or self._is_sharded(type(obj2))):
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db in product_shards():
+            return app_label == 'products' and model_name in SHARDED_MODELS
+        return None
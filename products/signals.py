@@ -0,0 +1,208 @@
+from django.db.models import Q
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+from django.utils import timezone
+from users.models import CustomUser
+from users.scope import invalidate_store_scopes
+from .cache import bump_versions
+from .models import DeletionLog, InventoryRollup, Product, Store, Supplier
+from .reference import invalidate_reference_data
+from .rollups import apply_changes, product_state
+from .sync import log_product_moves
+
+
+@receiver(pre_save, sender=Product)
+def remember_product_state(sender, instance, raw=False, using=None, **kwargs):
+    """Remember the stored state of a product before it is overwritten."""
+    instance._rollup_state = None
+    if raw or instance.pk is None:
+        return
+    # Read from the database being written, which is a shard when products are sharded
+    stored = Product.objects.using(using).filter(pk=instance.pk).only(
+        'store_id', 'supplier_id', 'price', 'quantity', 'threshold'
+    ).first()
+    if stored is not None:
+        instance._rollup_state = product_state(stored)
+
+
+@receiver(post_save, sender=Product)
+def update_rollups_on_save(sender, instance, raw=False, **kwargs):
+    """Apply a created or updated product to the inventory rollups."""
+    if raw:
+        return
+    apply_changes([(getattr(instance, '_rollup_state', None), product_state(instance))])
+
+
+@receiver(post_save, sender=Product)
+def log_product_move(sender, instance, raw=False, **kwargs):
+    """A product moved to another store leaves a tombstone in its old store for sync clients."""
+    old_state = getattr(instance, '_rollup_state', None)
+    if raw or old_state is None:
+        return
+    log_product_moves([(instance.pk, old_state[0], instance.store_id)])
+
+
+@receiver(post_delete, sender=Product)
+def update_rollups_on_delete(sender, instance, **kwargs):
+    """Remove a deleted product from the inventory rollups."""
+    apply_changes([(product_state(instance), None)])
+
+
+@receiver(pre_save, sender=Store)
+def remember_store_manager(sender, instance, raw=False, **kwargs):
+    """Remember the stored manager of a store before it is overwritten."""
+    instance._stored_manager_id = None
+    if raw or instance.pk is None:
+        return
+    instance._stored_manager_id = Store.objects.filter(pk=instance.pk).values_list('manager_id', flat=True).first()
+
+
+@receiver(post_save, sender=Store)
+def invalidate_manager_scopes(sender, instance, **kwargs):
+    """A store changing managers changes the store scope of both managers."""
+    stored_manager_id = getattr(instance, '_stored_manager_id', None)
+    if stored_manager_id != instance.manager_id:
+        invalidate_store_scopes([stored_manager_id, instance.manager_id])
+
+
+@receiver(pre_delete, sender=Store)
+def invalidate_deleted_store_scopes(sender, instance, **kwargs):
+    """Everyone who could access a deleted store loses it from their scope."""
+    employee_ids = list(Store.employees.through.objects.filter(store_id=instance.pk).values_list('customuser_id', flat=True))
+    invalidate_store_scopes([instance.manager_id] + employee_ids)
+
+
+@receiver(m2m_changed, sender=Store.employees.through)
+def invalidate_employee_scopes(sender, instance, action, reverse, pk_set, **kwargs):
+    """Assigning or removing staff changes their store scope."""
+    if action not in ('post_add', 'post_remove', 'pre_clear'):
+        return
+    if reverse:
+        # Changed through user.assigned_stores
+        invalidate_store_scopes([instance.pk])
+    elif action == 'pre_clear':
+        invalidate_store_scopes(list(instance.employees.values_list('id', flat=True)))
+    else:
+        invalidate_store_scopes(pk_set)
+
+
+@receiver(post_save, sender=Store)
+@receiver(post_delete, sender=Store)
+def invalidate_store_responses(sender, instance, **kwargs):
+    """Invalidate cached responses about a created, changed or deleted store."""
+    bump_versions(store_ids=[instance.pk])
+
+
+@receiver(post_save, sender=Supplier)
+@receiver(pre_delete, sender=Supplier)
+def invalidate_supplier_responses(sender, instance, **kwargs):
+    """
+    Invalidate cached responses about a supplier, the stores it serves and the
+    stores holding its products, which may no longer be linked to it. The
+    rollups list those stores without reading the product shards.
+    """
+    linked = Supplier.stores.through.objects.filter(supplier_id=instance.pk).values_list('store_id', flat=True)
+    stocked = InventoryRollup.objects.filter(supplier_id=instance.pk, product_count__gt=0).values_list('store_id', flat=True)
+    bump_versions(store_ids=set(linked) | set(stocked), supplier_ids=[instance.pk])
+
+
+@receiver(m2m_changed, sender=Supplier.stores.through)
+def invalidate_supplier_store_responses(sender, instance, action, reverse, pk_set, **kwargs):
+    """Linking suppliers and stores changes the responses of both sides."""
+    if action not in ('post_add', 'post_remove', 'pre_clear'):
+        return
+    if action == 'pre_clear':
+        pk_set = set(getattr(instance, 'suppliers' if reverse else 'stores').values_list('id', flat=True))
+    if reverse:
+        # Changed through store.suppliers
+        bump_versions(store_ids=[instance.pk], supplier_ids=pk_set)
+    else:
+        bump_versions(store_ids=pk_set, supplier_ids=[instance.pk])
+
+
+@receiver(m2m_changed, sender=Store.employees.through)
+def invalidate_employee_responses(sender, instance, action, reverse, pk_set, **kwargs):
+    """Store details list their staff, so assigning or removing staff changes them."""
+    if action not in ('post_add', 'post_remove', 'pre_clear'):
+        return
+    if not reverse:
+        bump_versions(store_ids=[instance.pk])
+    elif action == 'pre_clear':
+        # Changed through user.assigned_stores
+        bump_versions(store_ids=list(instance.assigned_stores.values_list('id', flat=True)))
+    else:
+        bump_versions(store_ids=pk_set)
+
+
+@receiver(post_save, sender=CustomUser)
+@receiver(pre_delete, sender=CustomUser)
+def invalidate_user_responses(sender, instance, raw=False, update_fields=None, **kwargs):
+    """
+    Store responses show manager names, so user changes invalidate the
+    responses of the stores the user manages or works at; logins do not.
+    """
+    if raw or (update_fields is not None and set(update_fields) <= {'last_login'}):
+        return
+    store_ids = Store.objects.filter(Q(manager_id=instance.pk) | Q(employees=instance.pk)).values_list('id', flat=True)
+    bump_versions(store_ids=list(store_ids.distinct()))
+
+
+@receiver(post_delete, sender=Product)
+def log_product_deletion(sender, instance, **kwargs):
+    """Leave a tombstone for sync clients."""
+    DeletionLog.objects.create(object_type='product', object_id=instance.pk, store_id=instance.store_id)
+
+
+@receiver(post_delete, sender=Store)
+def log_store_deletion(sender, instance, **kwargs):
+    """Leave a tombstone for sync clients."""
+    DeletionLog.objects.create(object_type='store', object_id=instance.pk)
+
+
+@receiver(post_delete, sender=Supplier)
+def log_supplier_deletion(sender, instance, **kwargs):
+    """Leave a tombstone for sync clients."""
+    DeletionLog.objects.create(object_type='supplier', object_id=instance.pk)
+
+
+@receiver(m2m_changed, sender=Supplier.stores.through)
+def touch_linked_suppliers(sender, instance, action, reverse, pk_set, **kwargs):
+    """
+    Synced suppliers carry their store ids, so changing the links marks the
+    suppliers as updated.
+    """
+    if action not in ('post_add', 'post_remove', 'pre_clear'):
+        return
+    if not reverse:
+        supplier_ids = [instance.pk]
+    elif action == 'pre_clear':
+        supplier_ids = list(instance.suppliers.values_list('id', flat=True))
+    else:
+        supplier_ids = list(pk_set)
+    Supplier.objects.filter(id__in=supplier_ids).update(updated_at=timezone.now())
+
+
+@receiver(post_save, sender=Store)
+@receiver(post_delete, sender=Store)
+@receiver(post_save, sender=Supplier)
+@receiver(post_delete, sender=Supplier)
+@receiver(post_delete, sender=CustomUser)
+def invalidate_reference_data_on_change(sender, instance, **kwargs):
+    """Stores, suppliers, managers and staff make up the bootstrap reference data."""
+    invalidate_reference_data()
+
+
+@receiver(post_save, sender=CustomUser)
+def invalidate_reference_data_on_user_change(sender, instance, raw=False, update_fields=None, **kwargs):
+    """Role and name changes move users between the manager and staff lists; logins do not."""
+    if raw or (update_fields is not None and set(update_fields) <= {'last_login'}):
+        return
+    invalidate_reference_data()
+
+
+@receiver(m2m_changed, sender=Supplier.stores.through)
+@receiver(m2m_changed, sender=Store.employees.through)
+def invalidate_reference_data_on_link_change(sender, action, **kwargs):
+    """Supplier links are part of the reference data, and staff assignments change whose stores it lists."""
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        invalidate_reference_data()
@@ -0,0 +1,175 @@
+from collections import OrderedDict
+from contextlib import ExitStack
+from django.db import DEFAULT_DB_ALIAS
+from django.db.models import Case, F, IntegerField, Q, Value, When
+from django.utils import timezone
+from ims_project.transactions import write_atomic
+from .events import publish_product_changes
+from .models import Product, ProductRegistry
+from .ledger import record_movements
+from .rollups import apply_changes
+from .sharding import products_in, shard_for_store, sharding_enabled
+
+# Maximum number of When clauses in a single UPDATE statement
+ADJUSTMENT_CHUNK_SIZE = 400
+
+
+class StockAdjustmentError(ValueError):
+    """Raised when a stock adjustment request is invalid; carries per-entry errors."""
+
+    def __init__(self, errors):
+        super().__init__('Invalid stock adjustments')
+        self.errors = errors
+
+
+def _parse_entries(entries):
+    """
+    Validate adjustment entries of the form {'id' or 'sku': ..., 'delta': int}.
+    Returns (deltas_by_id, deltas_by_sku) with repeated products summed.
+    """
+    if not isinstance(entries, list) or not entries:
+        raise StockAdjustmentError([{'index': None, 'error': 'adjustments must be a non-empty list'}])
+
+    errors = []
+    by_id = OrderedDict()
+    by_sku = OrderedDict()
+
+    for index, entry in enumerate(entries):
+        if not isinstance(entry, dict):
+            errors.append({'index': index, 'error': 'Each adjustment must be an object'})
+            continue
+        delta = entry.get('delta')
+        if isinstance(delta, bool) or not isinstance(delta, int):
+            errors.append({'index': index, 'error': 'delta must be an integer'})
+            continue
+        if entry.get('id') is not None:
+            try:
+                product_id = int(entry['id'])
+            except (TypeError, ValueError):
+                errors.append({'index': index, 'error': 'id must be an integer'})
+                continue
+            by_id[product_id] = by_id.get(product_id, 0) + delta
+        elif entry.get('sku'):
+            sku = str(entry['sku'])
+            by_sku[sku] = by_sku.get(sku, 0) + delta
+        else:
+            errors.append({'index': index, 'error': 'Each adjustment needs an id or a sku'})
+
+    if errors:
+        raise StockAdjustmentError(errors)
+    return by_id, by_sku
+
+
+def adjust_stock(entries, user):
+    """
+    Apply quantity deltas to many products atomically.
+
+    The quantities are changed with F('quantity') + delta, grouped into
+    Case/When UPDATE statements of up to ADJUSTMENT_CHUNK_SIZE products, so
+    concurrent writers never lose each other's changes. Either every
+    adjustment is applied or none is.
+
+    Returns a list of dicts with the previous and new quantity of each product.
+    Raises StockAdjustmentError if an entry is invalid, unknown or out of the
+    user's stores.
+    """
+    by_id, by_sku = _parse_entries(entries)
+    # When products are sharded the registry knows every product's store, and so its shard
+    index = ProductRegistry.objects if sharding_enabled() else Product.objects
+
+    with write_atomic(), ExitStack() as shard_transactions:
+        # Resolve every referenced product in one query
+        rows = index.select_for_update().filter(
+            Q(id__in=list(by_id)) | Q(sku__in=list(by_sku))
+        ).values('id', 'sku', 'store_id', 'store__manager_id')
+
+        deltas = {}
+        shards = {}
+        for row in rows:
+            delta = by_id.pop(row['id'], 0) + by_sku.pop(row['sku'], 0)
+            if user.role == 'manager' and row['store__manager_id'] != user.id:
+                raise StockAdjustmentError([{
+                    'id': row['id'],
+                    'sku': row['sku'],
+                    'error': 'Access denied. You can only adjust stock in stores that you manage.',
+                }])
+            deltas[row['id']] = delta
+            shards.setdefault(shard_for_store(row['store_id']), []).append(row['id'])
+
+        missing = [{'id': product_id, 'error': 'Product not found'} for product_id in by_id]
+        missing += [{'sku': sku, 'error': 'Product not found'} for sku in by_sku]
+        if missing:
+            raise StockAdjustmentError(missing)
+
+        # The shards commit before the default database, where the rollups and ledger live
+        for alias in sorted(shards):
+            if alias != DEFAULT_DB_ALIAS:
+                shard_transactions.enter_context(write_atomic(using=alias))
+
+        now = timezone.now()
+        for alias, product_ids in shards.items():
+            changed = [product_id for product_id in product_ids if deltas[product_id]]
+            for start in range(0, len(changed), ADJUSTMENT_CHUNK_SIZE):
+                chunk = changed[start:start + ADJUSTMENT_CHUNK_SIZE]
+                products_in(alias).filter(id__in=chunk).update(
+                    quantity=F('quantity') + Case(
+                        *[When(id=product_id, then=Value(deltas[product_id])) for product_id in chunk],
+                        default=Value(0),
+                        output_field=IntegerField(),
+                    ),
+                    updated_at=now,
+                )
+
+        # Read the resulting quantities; the previous ones follow from the deltas
+        results = []
+        changes = []
+        product_rows = []
+        for alias, product_ids in shards.items():
+            product_rows += products_in(alias).filter(id__in=product_ids).values(
+                'id', 'sku', 'store_id', 'supplier_id', 'price', 'quantity', 'threshold'
+            )
+        for row in sorted(product_rows, key=lambda row: row['id']):
+            delta = deltas[row['id']]
+            previous = row['quantity'] - delta
+            results.append({
+                'id': row['id'],
+                'sku': row['sku'],
+                'store_id': row['store_id'],
+                'previous_quantity': previous,
+                'quantity': row['quantity'],
+                'threshold': row['threshold'],
+                'delta': delta,
+            })
+            state = (row['store_id'], row['supplier_id'], row['price'], row['quantity'], row['threshold'])
+            changes.append((row['id'], (state[0], state[1], state[2], previous, state[4]), state))
+
+        apply_changes([(old_state, new_state) for _, old_state, new_state in changes])
+        publish_product_changes(changes)
+        record_movements(
+            [(result['id'], result['store_id'], result['delta']) for result in results],
+            user,
+            'adjustment',
+        )
+
+    return results
+
+
+def threshold_crossings(results):
+    """
+    Return the adjusted products whose low stock status changed, with the
+    direction of the change: 'low' when they fell to or below their threshold
+    and 'restocked' when they rose above it.
+    """
+    crossings = []
+    for result in results:
+        was_low = result['previous_quantity'] <= result['threshold']
+        is_low = result['quantity'] <= result['threshold']
+        if was_low != is_low:
+            crossings.append({
+                'id': result['id'],
+                'sku': result['sku'],
+                'quantity': result['quantity'],
+                'threshold': result['threshold'],
+                'direction': 'low' if is_low else 'restocked',
+            })
+    return crossings
@@ -0,0 +1,236 @@
+import base64
+import hashlib
+import json
+from datetime import datetime, timedelta
+from decimal import Decimal
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+from .models import DeletionLog, Product, Store, Supplier
+from .pagination import InvalidCursor
+
+# Columns sent for each synced entity, in the order the entities are synced
+SYNC_FIELDS = {
+    'suppliers': ('id', 'name', 'contact_person', 'phone', 'email', 'address', 'updated_at'),
+    'stores': ('id', 'name', 'address', 'phone', 'email', 'manager_id', 'updated_at'),
+    'products': (
+        'id', 'name', 'sku', 'description', 'price', 'quantity', 'threshold', 'is_low_stock',
+        'store_id', 'supplier_id', 'updated_at',
+    ),
+}
+
+# Changed rows are synced first, then the tombstones
+SYNC_PHASES = ('suppliers', 'stores', 'products', 'deleted')
+
+
+class CursorExpired(InvalidCursor):
+    """Raised when a sync cursor is older than the retained deletion log."""
+
+
+def _encode(state):
+    payload = json.dumps(state, separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+
+def _is_time(value):
+    """Return True for an ISO datetime string with a time zone, as written by _encode."""
+    if not isinstance(value, str):
+        return False
+    try:
+        return datetime.fromisoformat(value).tzinfo is not None
+    except ValueError:
+        return False
+
+
+def _decode(cursor):
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        state = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except (ValueError, TypeError):
+        raise InvalidCursor('Invalid cursor')
+    if not isinstance(state, dict):
+        raise InvalidCursor('Invalid cursor')
+    phase = state.get('p', 0)
+    if not isinstance(phase, int) or isinstance(phase, bool) or phase not in range(len(SYNC_PHASES)):
+        raise InvalidCursor('Invalid cursor')
+    if any(state.get(field) is not None and not _is_time(state[field]) for field in ('s', 'u')):
+        raise InvalidCursor('Invalid cursor')
+    if state.get('h') is not None and not isinstance(state['h'], str):
+        raise InvalidCursor('Invalid cursor')
+    key = state.get('k')
+    if key is not None and not (
+        isinstance(key, list) and len(key) == 2 and _is_time(key[0])
+        and isinstance(key[1], int) and not isinstance(key[1], bool)
+    ):
+        raise InvalidCursor('Invalid cursor')
+    return state
+
+
+def _scope_hash(scope):
+    """Return a short hash of the stores the user can see, carried in cursors."""
+    store_ids = scope.store_ids
+    text = 'all' if store_ids is None else ','.join(str(store_id) for store_id in sorted(store_ids))
+    return hashlib.sha256(text.encode()).hexdigest()[:16]
+
+
+def _parse_time(value):
+    return datetime.fromisoformat(value) if value is not None else None
+
+
+def _serialize(row):
+    for key, value in row.items():
+        if isinstance(value, datetime):
+            row[key] = value.isoformat()
+        elif isinstance(value, Decimal):
+            row[key] = str(value)
+    return row
+
+
+def _changed_rows(name, scope):
+    """Return a values() queryset of one entity, restricted to the user's store scope."""
+    if name == 'suppliers':
+        queryset = Supplier.objects.all()
+    elif name == 'stores':
+        queryset = scope.filter(Store.objects.all(), field='id')
+    else:
+        queryset = scope.filter(Product.objects.all())
+    return queryset.values(*SYNC_FIELDS[name])
+
+
+def _tombstones(scope):
+    """
+    Return the deletion log, keeping only product tombstones from the user's
+    stores. Tombstones of products the user can still see, left when a product
+    moved between two of their stores, are skipped; the changed row is synced.
+    """
+    queryset = DeletionLog.objects.all()
+    if scope.store_ids is not None:
+        queryset = queryset.filter(~Q(object_type='product') | Q(store_id__in=scope.store_ids))
+    queryset = queryset.exclude(object_type='product', object_id__in=scope.filter(Product.objects.all()).values('id'))
+    return queryset.values('id', 'object_type', 'object_id', 'deleted_at')
+
+
+def log_product_moves(moves):
+    """
+    Leave a tombstone in the old store of each product moved to another store,
+    given (product_id, old_store_id, new_store_id) tuples, so sync clients that
+    cannot see the new store drop the product.
+    """
+    DeletionLog.objects.bulk_create([
+        DeletionLog(object_type='product', object_id=product_id, store_id=old_store_id)
+        for product_id, old_store_id, new_store_id in moves
+        if old_store_id != new_store_id
+    ])
+
+
+def _page(queryset, time_field, since, until, key, limit):
+    """Read up to limit + 1 rows changed in (since, until] after the (time, id) key."""
+    queryset = queryset.filter(**{f'{time_field}__lte': until})
+    if since is not None:
+        queryset = queryset.filter(**{f'{time_field}__gt': since})
+    if key is not None:
+        key_time = _parse_time(key[0])
+        queryset = queryset.filter(
+            Q(**{f'{time_field}__gt': key_time}) | Q(**{time_field: key_time, 'id__gt': key[1]})
+        )
+    return list(queryset.order_by(time_field, 'id')[:limit + 1])
+
+
+def sync_page(scope, cursor=None, limit=500):
+    """
+    Return one page of changes for a sync client.
+
+    Without a cursor every row is sent. A sync covers the rows changed after
+    the previous sync's high watermark and up to its own, which is fixed on
+    its first page, so paging happens over a consistent window no matter
+    what changes meanwhile. The watermark trails the clock by
+    SYNC_SETTLE_SECONDS so that transactions still committing are not
+    skipped. Rows are read through the (updated_at, id) indexes, so a sync
+    costs time proportional to the number of changes.
+
+    Cursors carry a hash of the user's store scope. Rows of a store the user
+    gains are older than the cursor, and rows of a store they lose leave no
+    tombstones, so a scope change needs a full sync.
+
+    Returns a dict with the changed rows per entity, the ids deleted per
+    entity, the cursor for the next request and whether more pages follow.
+    Raises CursorExpired when the deletion log no longer covers the cursor or
+    the user's stores changed since it was issued.
+    """
+    scope_hash = _scope_hash(scope)
+    state = _decode(cursor) if cursor else {'s': None, 'u': None, 'p': 0, 'k': None, 'h': scope_hash}
+    if state.get('h') != scope_hash:
+        raise CursorExpired('Your stores have changed; start a full sync without a cursor')
+    since = _parse_time(state.get('s'))
+    until = _parse_time(state.get('u'))
+
+    now = timezone.now()
+    if since is not None:
+        retention = timedelta(days=getattr(settings, 'SYNC_DELETION_LOG_RETENTION_DAYS', 30))
+        if since < now - retention:
+            raise CursorExpired('Cursor has expired; start a full sync without a cursor')
+    if until is None:
+        until = now - timedelta(seconds=getattr(settings, 'SYNC_SETTLE_SECONDS', 2))
+        if since is not None and until < since:
+            until = since
+
+    changes = {name: [] for name in SYNC_FIELDS}
+    deleted = {'products': [], 'stores': [], 'suppliers': []}
+    phase = state.get('p', 0)
+    key = state.get('k')
+    remaining = limit
+
+    while phase < len(SYNC_PHASES) and remaining > 0:
+        name = SYNC_PHASES[phase]
+        if name == 'deleted':
+            # A full sync has nothing to delete
+            rows = _page(_tombstones(scope), 'deleted_at', since, until, key, remaining) if since else []
+            time_field = 'deleted_at'
+        else:
+            rows = _page(_changed_rows(name, scope), 'updated_at', since, until, key, remaining)
+            time_field = 'updated_at'
+
+        more = len(rows) > remaining
+        rows = rows[:remaining]
+        remaining -= len(rows)
+
+        if name == 'deleted':
+            for row in rows:
+                deleted[f"{row['object_type']}s"].append(row['object_id'])
+        else:
+            changes[name].extend(_serialize(dict(row)) for row in rows)
+
+        if more:
+            key = [rows[-1][time_field].isoformat(), rows[-1]['id']]
+            break
+        phase += 1
+        key = None
+
+    # Synced suppliers carry the ids of the stores they serve
+    if changes['suppliers']:
+        store_ids = {}
+        for supplier_id, store_id in Supplier.stores.through.objects.filter(
+            supplier_id__in=[row['id'] for row in changes['suppliers']]
+        ).values_list('supplier_id', 'store_id'):
+            store_ids.setdefault(supplier_id, []).append(store_id)
+        for row in changes['suppliers']:
+            row['store_ids'] = sorted(store_ids.get(row['id'], []))
+
+    has_more = phase < len(SYNC_PHASES)
+    if has_more:
+        next_state = {'s': state.get('s'), 'u': until.isoformat(), 'p': phase, 'k': key, 'h': scope_hash}
+    else:
+        # The next sync starts where this one's window ended
+        next_state = {'s': until.isoformat(), 'u': None, 'p': 0, 'k': None, 'h': scope_hash}
+
+    return {
+        'changes': changes,
+        'deleted': deleted,
+        'cursor': _encode(next_state),
+        'has_more': has_more,
+    }
+
+
+def purge_deletion_log(days):
+    """Delete tombstones older than the given number of days. Returns the number deleted."""
+    return DeletionLog.objects.filter(deleted_at__lt=timezone.now() - timedelta(days=days)).delete()[0]
@@ -1,3 +1,1073 @@
-from django.test import TestCase
+import base64
+import itertools
+import json
+import time
+from io import StringIO
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.http import HttpResponse, JsonResponse
+from django.db import connection, connections, transaction
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import ResolverMatch, reverse
+from django.utils import timezone
+from django.utils.http import http_date
+from ims_project import db_router
+from ims_project.db_router import ReplicaRoutingMiddleware
+from ims_project.instrumentation import RequestTimingMiddleware
+from ims_project.transactions import write_atomic
+from users.models import CustomUser
+from users.scope import StoreScope
+from . import cache as response_cache, sync
+from .events import get_broker
+from .imports import import_products
+from .ledger import inventory_as_of, quantity_as_of, take_snapshots
+from .models import InventoryRollup, Product, ProductRegistry, StockMovement, StockSnapshot, Store, Supplier
+from .pagination import KEYSET_ORDERINGS
+from .rollups import compute_rollups
+from .sharding import shard_for_product, shard_for_store, shards_for_stores
+from .stock import adjust_stock
+
+
+class StoreViewQueryCountTests(TestCase):
+    """
+    The store views must run a fixed number of queries regardless of how many
+    stores, suppliers and employees there are. Two of the queries counted
+    below load the session and the logged-in user. The conditional GET
+    validators read version counters from the cache; for managers and staff
+    they resolve the store scope, which the view then reuses.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = CustomUser.objects.create_user('admin', 'admin@example.com', 'password', role='admin')
+        cls.manager = CustomUser.objects.create_user('manager', 'manager@example.com', 'password', role='manager')
+        cls.staff = CustomUser.objects.create_user('staff', 'staff@example.com', 'password', role='staff')
+
+        cls.stores = []
+        for i in range(5):
+            store = Store.objects.create(name=f'Store {i}', address=f'{i} Main St', manager=cls.manager)
+            store.employees.add(cls.staff)
+            cls.stores.append(store)
+
+        for i in range(3):
+            supplier = Supplier.objects.create(name=f'Supplier {i}', phone=f'555-000{i}')
+            supplier.stores.add(*cls.stores)
+            for store in cls.stores:
+                Product.objects.create(
+                    name=f'Product {i}-{store.id}',
+                    sku=f'SKU-{i}-{store.id}',
+                    price='1.50',
+                    quantity=i,
+                    supplier=supplier,
+                    store=store,
+                )
+
+    def test_store_list_query_count(self):
+        for user, scope_queries in ((self.admin, 0), (self.manager, 1), (self.staff, 1)):
+            with self.subTest(role=user.role):
+                self.client.force_login(user)
+                # session, user, store scope, stores with managers and product counts, suppliers
+                with self.assertNumQueries(4 + scope_queries):
+                    response = self.client.get(reverse('store_list'))
+
+                stores = response.json()['stores']
+                self.assertEqual(len(stores), 5)
+                self.assertEqual(stores[0]['productCount'], 3)
+                self.assertEqual(stores[0]['manager_id'], self.manager.id)
+                self.assertEqual(len(stores[0]['supplier_ids']), 3)
+
+    def test_store_list_query_count_does_not_grow_with_stores(self):
+        for i in range(10):
+            Store.objects.create(name=f'Extra {i}', address='Somewhere', manager=self.manager)
+
+        self.client.force_login(self.admin)
+        with self.assertNumQueries(4):
+            response = self.client.get(reverse('store_list'))
+        self.assertEqual(len(response.json()['stores']), 15)
+
+    def test_store_detail_query_count(self):
+        store = self.stores[0]
+        for user in (self.admin, self.manager, self.staff):
+            with self.subTest(role=user.role):
+                self.client.force_login(user)
+                # session, user, store with manager and product count, suppliers, employees
+                with self.assertNumQueries(5):
+                    response = self.client.get(reverse('store_detail', args=[store.id]))
+
+                data = response.json()['store']
+                self.assertEqual(data['productCount'], 3)
+                self.assertEqual(data['employee_ids'], [self.staff.id])
+                self.assertEqual(len(data['supplier_ids']), 3)
+
+    def test_store_detail_denies_unassigned_staff(self):
+        other_staff = CustomUser.objects.create_user('other', 'other@example.com', 'password', role='staff')
+        self.client.force_login(other_staff)
+        response = self.client.get(reverse('store_detail', args=[self.stores[0].id]))
+        self.assertEqual(response.status_code, 403)
+
+    def test_store_list_not_modified(self):
+        self.client.force_login(self.manager)
+        response = self.client.get(reverse('store_list'))
+        etag = response['ETag']
+
+        # session, user, store scope; the stores are not loaded at all
+        with self.assertNumQueries(3):
+            response = self.client.get(reverse('store_list'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        store = Store.objects.get(id=self.stores[0].id)
+        store.name = 'Renamed'
+        store.save()
+        response = self.client.get(reverse('store_list'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['stores'][0]['name'], 'Renamed')
+
+    def test_product_list_changes_after_a_rename(self):
+        self.client.force_login(self.staff)
+        etag = self.client.get(reverse('product_list'))['ETag']
+        product = Product.objects.filter(store=self.stores[0]).first()
+        product.name = 'Renamed'
+        product.save()
+        self.assertEqual(self.client.get(reverse('product_list'), HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_store_detail_changes_with_its_staff(self):
+        self.client.force_login(self.admin)
+        url = reverse('store_detail', args=[self.stores[0].id])
+        etag = self.client.get(url)['ETag']
+        with self.assertNumQueries(2):
+            self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        self.stores[0].employees.remove(self.staff)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('employee_ids', response.json()['store'])
+
+    def test_product_list_changes_after_a_delete(self):
+        self.client.force_login(self.manager)
+        response = self.client.get(reverse('product_list'))
+        self.assertNotIn('Last-Modified', response)
+        etag = response['ETag']
+
+        Product.objects.filter(store=self.stores[0]).first().delete()
+        response = self.client.get(
+            reverse('product_list'), HTTP_IF_NONE_MATCH=etag, HTTP_IF_MODIFIED_SINCE=http_date(time.time())
+        )
+        self.assertEqual(response.status_code, 200)
+
+
+class StockEventTests(TestCase):
+    """Stock writes publish events to the subscribers of the affected stores once they commit."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = CustomUser.objects.create_user('admin', 'admin@example.com', 'password', role='admin')
+        cls.store = Store.objects.create(name='Main', address='1 Main St')
+        cls.other_store = Store.objects.create(name='Other', address='2 Main St')
+        supplier = Supplier.objects.create(name='Acme', phone='555-0100')
+        cls.product = Product.objects.create(
+            name='Widget', sku='W-1', price='2.00', quantity=10, threshold=5, supplier=supplier, store=cls.store
+        )
+
+    def test_adjustment_publishes_stock_and_low_stock_events(self):
+        broker = get_broker()
+        subscription = broker.subscribe({self.store.id})
+        other_subscription = broker.subscribe({self.other_store.id})
+        try:
+            with self.captureOnCommitCallbacks(execute=True):
+                adjust_stock([{'id': self.product.id, 'delta': -6}], self.admin)
+            stock_event = subscription.get(timeout=0)
+            low_stock_event = subscription.get(timeout=0)
+            self.assertEqual(stock_event['type'], 'stock')
+            self.assertEqual(stock_event['data']['quantity'], 4)
+            self.assertEqual(stock_event['data']['delta'], -6)
+            self.assertEqual(low_stock_event['type'], 'low_stock')
+            self.assertEqual(low_stock_event['data']['direction'], 'low')
+            self.assertIsNone(other_subscription.get(timeout=0))
+        finally:
+            subscription.close()
+            other_subscription.close()
+
+    @override_settings(STOCK_EVENTS_HEARTBEAT_SECONDS=0)
+    def test_stream_ends_when_the_scope_changes(self):
+        staff = CustomUser.objects.create_user('staff', 'staff@example.com', 'password', role='staff')
+        self.store.employees.add(staff)
+        self.client.force_login(staff)
+        stream = iter(self.client.get(reverse('stock_events')).streaming_content)
+        self.assertEqual(next(stream), b'retry: 3000\n\n')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            adjust_stock([{'id': self.product.id, 'delta': 1}], self.admin)
+        self.assertTrue(next(stream).startswith(b'event: stock\n'))
+
+        # Events for a store the user lost are not delivered; the stream ends instead
+        self.store.employees.remove(staff)
+        with self.captureOnCommitCallbacks(execute=True):
+            adjust_stock([{'id': self.product.id, 'delta': 1}], self.admin)
+        self.assertEqual(list(itertools.islice(stream, 2)), [])
+        self.assertEqual(get_broker().subscriber_count(), 0)
+
+
+@override_settings(BATCH_MAX_WORKERS=1)
+class BatchRequestTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.manager = CustomUser.objects.create_user('manager', 'manager@example.com', 'password', role='manager')
+        cls.store = Store.objects.create(name='Main', address='1 Main St', manager=cls.manager)
+        cls.other_store = Store.objects.create(name='Other', address='2 Main St')
+
+    def test_batch_runs_sub_requests_in_order_with_their_own_checks(self):
+        self.client.force_login(self.manager)
+        response = self.client.post(reverse('batch_requests'), {'requests': [
+            {'id': 'stores', 'path': reverse('store_list')},
+            {'id': 'other', 'path': reverse('store_detail', args=[self.other_store.id])},
+            {'id': 'missing', 'path': '/api/missing/'},
+        ]}, content_type='application/json')
+
+        self.assertEqual(response.status_code, 200)
+        results = response.json()['responses']
+        self.assertEqual([result['id'] for result in results], ['stores', 'other', 'missing'])
+        self.assertEqual([result['status'] for result in results], [200, 403, 404])
+        self.assertEqual([store['id'] for store in results[0]['body']['stores']], [self.store.id])
+
+    def test_sub_requests_carry_their_content_type(self):
+        supplier = Supplier.objects.create(name='Acme', phone='555-0100')
+        supplier.stores.add(self.store)
+        self.client.force_login(self.manager)
+        row = {'name': 'New', 'sku': 'NEW', 'price': '1.00', 'quantity': 1, 'supplier_id': supplier.id, 'store_id': self.store.id}
+        # Without ?format= the import reads the JSON body as NDJSON, going by its Content-Type
+        response = self.client.post(reverse('batch_requests'), {'requests': [
+            {'method': 'POST', 'path': reverse('product_import'), 'body': row},
+        ]}, content_type='application/json')
+
+        result = response.json()['responses'][0]
+        self.assertEqual(result['status'], 200)
+        self.assertEqual(result['body']['created'], 1)
+        self.assertTrue(Product.objects.filter(sku='NEW', store=self.store).exists())
+
+
+class ReferenceBootstrapTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = CustomUser.objects.create_user('admin', 'admin@example.com', 'password', role='admin')
+        cls.store = Store.objects.create(name='Main', address='1 Main St')
+
+    def test_version_is_unchanged_until_reference_data_changes(self):
+        self.client.force_login(self.admin)
+        version = self.client.get(reverse('reference_bootstrap')).json()['version']
+
+        response = self.client.get(reverse('reference_bootstrap'), {'version': version})
+        self.assertEqual(response.json(), {'version': version, 'unchanged': True})
+
+        Supplier.objects.create(name='Acme', phone='555-0100').stores.add(self.store)
+        data = self.client.get(reverse('reference_bootstrap'), {'version': version}).json()
+        self.assertNotEqual(data['version'], version)
+        self.assertEqual(list(data['suppliers'].values())[0]['store_ids'], [self.store.id])
+
+
+@override_settings(PRODUCT_SHARDS=['shard_1', 'shard_2'], PRODUCT_SHARD_MAP={7: 'shard_1'})
+class ShardRoutingTests(TestCase):
+    def test_stores_map_to_shards(self):
+        self.assertEqual(shard_for_store(7), 'shard_1')
+        self.assertEqual(shard_for_store(3), 'shard_2')
+        self.assertEqual(shard_for_store(4), 'shard_1')
+        self.assertEqual(shards_for_stores([3, 4, 7]), {'shard_2': [3], 'shard_1': [4, 7]})
+        self.assertEqual(shards_for_stores(None), {'shard_1': None, 'shard_2': None})
+
+
+SHARDS = ['shard_test_1', 'shard_test_2']
+# Two product shards for ShardPlacementTests, set up like the PRODUCT_SHARD_PATHS aliases
+for alias in SHARDS:
+    connections.settings.setdefault(alias, {
+        **connections.settings['default'],
+        'NAME': f'{alias}.sqlite3',
+        'OPTIONS': {
+            **connections.settings['default']['OPTIONS'],
+            'pragmas': {**connections.settings['default']['OPTIONS']['pragmas'], 'foreign_keys': 'OFF'},
+        },
+    })
+
+
+class ShardPlacementTests(TransactionTestCase):
+    # Not a TestCase: product_list reads the shards from worker threads, which only see committed rows
+    databases = {'default', *SHARDS}
+
+    def setUp(self):
+        cache.clear()
+        self.admin = CustomUser.objects.create_user('admin', 'admin@example.com', 'password', role='admin')
+        self.north = Store.objects.create(name='North', address='1 North St')
+        self.south = Store.objects.create(name='South', address='1 South St')
+        self.supplier = Supplier.objects.create(name='Acme', phone='555-0100')
+        self.supplier.stores.add(self.north, self.south)
+        sharding = override_settings(
+            PRODUCT_SHARDS=SHARDS, PRODUCT_SHARD_MAP={self.north.id: SHARDS[0], self.south.id: SHARDS[1]}
+        )
+        sharding.enable()
+        self.addCleanup(sharding.disable)
+        self.client.force_login(self.admin)
+
+    def _create(self, sku, store):
+        return self.client.post(reverse('product_create'), {
+            'name': sku, 'sku': sku, 'price': '1.00', 'quantity': 5,
+            'supplier_id': self.supplier.id, 'store_id': store.id,
+        }, content_type='application/json')
+
+    def _skus(self, alias):
+        return list(Product.objects.using(alias).order_by('sku').values_list('sku', flat=True))
+
+    def test_products_are_written_to_the_shard_of_their_store(self):
+        north_id = self._create('N-1', self.north).json()['product']['id']
+        south_id = self._create('S-1', self.south).json()['product']['id']
+
+        self.assertEqual(self._skus(SHARDS[0]), ['N-1'])
+        self.assertEqual(self._skus(SHARDS[1]), ['S-1'])
+        self.assertFalse(Product.objects.using('default').exists())
+        # The registry in the default database hands out the ids and records each product's store
+        self.assertEqual(
+            dict(ProductRegistry.objects.values_list('id', 'store_id')),
+            {north_id: self.north.id, south_id: self.south.id},
+        )
+        self.assertEqual(shard_for_product(north_id), SHARDS[0])
+        self.assertEqual(shard_for_product(south_id), SHARDS[1])
+        self.assertIsNone(shard_for_product(south_id + 1))
+
+    def test_lookups_find_products_on_any_shard(self):
+        north_id = self._create('N-1', self.north).json()['product']['id']
+        south_id = self._create('S-1', self.south).json()['product']['id']
+
+        for product_id, sku in ((north_id, 'N-1'), (south_id, 'S-1')):
+            response = self.client.get(reverse('product_detail', args=[product_id]))
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.json()['product']['sku'], sku)
+        self.assertEqual(self.client.get(reverse('product_detail', args=[south_id + 1])).status_code, 404)
+
+        products = self.client.get(reverse('product_list')).json()['products']
+        self.assertEqual([product['id'] for product in products], [north_id, south_id])
+        self.assertEqual([product['store']['name'] for product in products], ['North', 'South'])
+
+        # SKUs stay unique across the shards
+        response = self._create('N-1', self.south)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self._skus(SHARDS[1]), ['S-1'])
+
+    def test_moving_a_product_moves_it_to_the_new_shard(self):
+        product_id = self._create('N-1', self.north).json()['product']['id']
+
+        response = self.client.patch(
+            reverse('product_update', args=[product_id]), {'store_id': self.south.id}, content_type='application/json'
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self._skus(SHARDS[0]), [])
+        self.assertEqual(self._skus(SHARDS[1]), ['N-1'])
+        self.assertEqual(ProductRegistry.objects.get(id=product_id).store_id, self.south.id)
+        self.assertEqual(shard_for_product(product_id), SHARDS[1])
+        self.assertEqual(self.client.get(reverse('product_detail', args=[product_id])).json()['product']['id'], product_id)
+
+class TransactionModeTests(TransactionTestCase):
+    def _begins(self, atomic):
+        with CaptureQueriesContext(connection) as queries:
+            with atomic():
+                Store.objects.exists()
+        return [query['sql'] for query in queries if query['sql'].startswith('BEGIN')]
+
+    def test_only_write_transactions_take_the_write_lock_up_front(self):
+        self.assertEqual(self._begins(write_atomic), ['BEGIN IMMEDIATE'])
+        self.assertEqual(self._begins(transaction.atomic), ['BEGIN DEFERRED'])
+
+    def test_write_atomic_inside_a_transaction_is_a_savepoint(self):
+        with CaptureQueriesContext(connection) as queries:
+            with transaction.atomic(), write_atomic():
+                Store.objects.exists()
+        self.assertEqual([query['sql'] for query in queries if query['sql'].startswith('BEGIN')], ['BEGIN DEFERRED'])
+
+    def test_imports_check_existing_skus_under_the_write_lock(self):
+        admin = CustomUser.objects.create_user('admin', 'admin@example.com', 'password', role='admin')
+        store = Store.objects.create(name='Main', address='1 Main St')
+        supplier = Supplier.objects.create(name='Acme', phone='555-0100')
+        supplier.stores.add(store)
+        row = {'name': 'New', 'sku': 'NEW', 'price': '1.00', 'quantity': 1, 'supplier_id': supplier.id, 'store_id': store.id}
+        with CaptureQueriesContext(connection) as queries:
+            import_products([(1, row)], admin)
+        statements = [query['sql'] for query in queries]
+        sku_check = next(index for index, sql in enumerate(statements) if '"sku" IN' in sql)
+        self.assertIn('BEGIN IMMEDIATE', statements[:sku_check])
+
+
+REPLICA = 'replica_test'
+# A second SQLite database for ReplicaRoutingTests. The test runner creates it
+# like the other aliases, and it holds its own rows, so every read shows where it went.
+connections.settings.setdefault(REPLICA, {**connections.settings['default'], 'NAME': 'replica.sqlite3'})
+
+
+@override_settings(DATABASE_READ_REPLICAS=[REPLICA])
+class ReplicaRoutingTests(TransactionTestCase):
+    # Not a TestCase: reads inside its per-test transaction always go to the primary
+    databases = {'default', REPLICA}
+
+    def setUp(self):
+        cache.clear()
+        self.user = CustomUser.objects.create_user('admin', 'admin@example.com', 'password', role='admin')
+        Store.objects.create(name='Primary', address='1 Main St')
+        # flush leaves the replica alone, as the router keeps migrations off it
+        Store.objects.using(REPLICA).all().delete()
+        Store.objects.using(REPLICA).bulk_create([Store(name='Replica', address='1 Main St')])
+
+    def _store_names(self):
+        return list(Store.objects.values_list('name', flat=True))
+
+    def _request(self, view, method='get'):
+        request = getattr(RequestFactory(), method)('/')
+        request.user = self.user
+        return ReplicaRoutingMiddleware(view)(request)
+
+    def test_reads_outside_requests_use_the_primary(self):
+        self.assertEqual(self._store_names(), ['Primary'])
+
+    def test_reads_stick_to_the_primary_after_a_write_in_the_same_context(self):
+        use_replicas = db_router._use_replicas.set(True)
+        wrote = db_router._wrote.set(False)
+        try:
+            self.assertEqual(self._store_names(), ['Replica'])
+            with transaction.atomic():
+                self.assertEqual(self._store_names(), ['Primary'])
+            self.assertEqual(self._store_names(), ['Replica'])
+            Supplier.objects.create(name='Acme', phone='555-0100')
+            self.assertEqual(self._store_names(), ['Primary'])
+        finally:
+            db_router._use_replicas.reset(use_replicas)
+            db_router._wrote.reset(wrote)
+
+    def test_a_request_reads_its_own_writes(self):
+        seen = []
+
+        def view(request):
+            seen.append(self._store_names())
+            Supplier.objects.create(name='Acme', phone='555-0100')
+            seen.append(self._store_names())
+            return HttpResponse()
+
+        self._request(view)
+        self.assertEqual(seen, [['Replica'], ['Primary']])
+
+    def test_writers_stay_on_the_primary_for_their_next_requests(self):
+        seen = []
+
+        def read(request):
+            seen.append(self._store_names())
+            return HttpResponse()
+
+        self._request(read)
+        self._request(read, method='post')
+        self._request(read)
+        self.assertEqual(seen, [['Replica'], ['Primary'], ['Primary']])
+
+        other = CustomUser.objects.create_user('other', 'other@example.com', 'password', role='admin')
+        request = RequestFactory().get('/')
+        request.user = other
+        ReplicaRoutingMiddleware(read)(request)
+        self.assertEqual(seen[-1], ['Replica'])
+
+        cache.clear()
+        self._request(read)
+        self.assertEqual(seen[-1], ['Replica'])
+
+
+@override_settings(REQUEST_TIMING_SAMPLE_RATE=1.0)
+class RequestTimingTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = CustomUser.objects.create_user('admin', 'admin@example.com', 'password', role='admin')
+        cls.store = Store.objects.create(name='Main', address='1 Main St')
+
+    def test_server_timing_reports_queries(self):
+        self.client.force_login(self.admin)
+        response = self.client.get(reverse('store_list'))
+        metrics = dict(metric.split(';', 1) for metric in response['Server-Timing'].split(', '))
+        self.assertRegex(metrics['sql'], r'^dur=[\d.]+;desc="\d+ queries"$')
+        self.assertEqual(metrics['bytes'], f'desc="{len(response.content)}"')
+        self.assertRegex(metrics['serialize'], r'^dur=[\d.]+$')
+
+    def test_server_timing_is_only_sent_to_admins(self):
+        staff = CustomUser.objects.create_user('staff', 'staff@example.com', 'password', role='staff')
+        self.client.force_login(staff)
+        with self.assertLogs('ims_project.instrumentation', 'INFO') as logs:
+            response = self.client.get(reverse('store_list'))
+        self.assertNotIn('Server-Timing', response)
+        self.assertEqual(json.loads(logs.records[0].getMessage())['view'], 'store_list')
+
+    @override_settings(REQUEST_TIMING_REPEATED_QUERY_THRESHOLD=3)
+    def test_repeated_query_shapes_are_logged(self):
+        def view_with_n_plus_one(request):
+            for store_id in range(3):
+                list(Store.objects.filter(id=store_id))
+            return JsonResponse({})
+
+        request = RequestFactory().get('/')
+        request.resolver_match = ResolverMatch(view_with_n_plus_one, (), {}, url_name='stores_n_plus_one')
+        with self.assertLogs('ims_project.instrumentation', 'WARNING') as logs:
+            RequestTimingMiddleware(view_with_n_plus_one)(request)
+        event = json.loads(logs.records[0].getMessage())
+        self.assertEqual((event['view'], event['count']), ('stores_n_plus_one', 3))
+
+    def test_view_time_leaves_out_the_middleware_before_the_view(self):
+        def view(request):
+            return JsonResponse({})
+
+        def slow_middleware(request):
+            # Stands in for the middleware between RequestTimingMiddleware and the view
+            time.sleep(0.2)
+            timing.process_view(request, view, (), {})
+            return view(request)
+
+        timing = RequestTimingMiddleware(slow_middleware)
+        request = RequestFactory().get('/')
+        with self.assertLogs('ims_project.instrumentation', 'INFO') as logs:
+            timing(request)
+        self.assertLess(json.loads(logs.records[0].getMessage())['view_ms'], 100)
+
+
+class MetricsTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = CustomUser.objects.create_user('admin', 'admin@example.com', 'password', role='admin')
+
+    def test_requests_are_counted_by_view(self):
+        self.client.force_login(self.admin)
+        self.client.get(reverse('store_list'))
+        body = self.client.get(reverse('metrics')).content.decode()
+        self.assertRegex(body, r'ims_http_requests_total\{method="GET",status="200",view="store_list"\} \d+')
+        self.assertRegex(body, r'ims_http_request_duration_seconds_count\{view="store_list"\} \d+')
+
+        self.assertRegex(body, r'ims_db_queries_total\{view="store_list"\} [1-9]')
+
+    @override_settings(METRICS_ALLOWED_NETWORKS=['10.0.0.0/8'])
+    def test_scrapes_from_other_networks_are_refused(self):
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 403)
+
+    def test_anonymous_scrapes_are_refused_by_default(self):
+        # Behind a reverse proxy every client is loopback, so loopback is not trusted by default
+        self.assertEqual(self.client.get(reverse('metrics'), REMOTE_ADDR='127.0.0.1').status_code, 403)
+
+    @override_settings(METRICS_ALLOWED_NETWORKS=['10.0.5.0/24'])
+    def test_allowed_networks_can_scrape(self):
+        self.assertEqual(self.client.get(reverse('metrics'), REMOTE_ADDR='10.0.5.7').status_code, 200)
+
+
+class ProductImportTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = CustomUser.objects.create_user('admin', 'admin@example.com', 'password', role='admin')
+        cls.store = Store.objects.create(name='Main', address='1 Main St')
+        cls.supplier = Supplier.objects.create(name='Acme', phone='555-0100')
+        cls.supplier.stores.add(cls.store)
+        Product.objects.create(
+            name='Existing', sku='OLD', price='1.00', quantity=1, supplier=cls.supplier, store=cls.store
+        )
+
+    def _import(self, rows, **params):
+        self.client.force_login(self.admin)
+        body = '\n'.join(json.dumps(row) for row in rows)
+        query = '&'.join(f'{key}={value}' for key, value in {'format': 'ndjson', **params}.items())
+        return self.client.post(f"{reverse('product_import')}?{query}", body, content_type='application/x-ndjson')
+
+    def _row(self, sku, price='2.50', **fields):
+        return {
+            'name': sku, 'sku': sku, 'price': price, 'quantity': 5,
+            'supplier_id': self.supplier.id, 'store_id': self.store.id, **fields,
+        }
+
+    def test_import_creates_and_updates_products(self):
+        response = self._import([self._row('NEW'), self._row('OLD', price='3.00')])
+        self.assertEqual((response.json()['created'], response.json()['updated']), (1, 1))
+        self.assertEqual(str(Product.objects.get(sku='OLD').price), '3.00')
+
+    def test_invalid_rows_are_reported_and_the_rest_imported(self):
+        response = self._import([
+            self._row('NAN', price='NaN'),
+            self._row('HUGE', price='1e20'),
+            self._row('CENTS', price='1.234'),
+            self._row('MANY', quantity=2 ** 40),
+            {'sku': 'PARTIAL'},
+            self._row('GOOD'),
+        ], batch_size=2)
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual([error['row'] for error in data['errors']], [1, 2, 3, 4, 5])
+        self.assertEqual(data['created'], 1)
+        self.assertTrue(Product.objects.filter(sku='GOOD').exists())
+
+    def test_existing_skus_are_reported_when_conflicts_are_errors(self):
+        response = self._import([self._row('OLD', price='3.00')], on_conflict='error')
+        self.assertEqual(response.json()['errors'], [{'row': 1, 'sku': 'OLD', 'error': 'SKU already exists'}])
+        self.assertEqual(str(Product.objects.get(sku='OLD').price), '1.00')
+
+    def test_unreadable_csv_is_rejected(self):
+        self.client.force_login(self.admin)
+        body = 'name,sku,price,quantity,supplier_id,store_id\n' + 'x' * 200000 + ',BIG,1.00,1,1,1\n'
+        response = self.client.post(f"{reverse('product_import')}?format=csv", body, content_type='text/csv')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('field larger than field limit', response.json()['error'])
+
+
+@override_settings(SYNC_SETTLE_SECONDS=0)
+class SyncTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = CustomUser.objects.create_user('admin', 'admin@example.com', 'password', role='admin')
+        cls.store = Store.objects.create(name='Main', address='1 Main St')
+        cls.supplier = Supplier.objects.create(name='Acme', phone='555-0100')
+        cls.products = [
+            Product.objects.create(
+                name=f'Product {i}', sku=f'SKU-{i}', price='1.00', quantity=i, supplier=cls.supplier, store=cls.store
+            )
+            for i in range(3)
+        ]
+
+    def _sync(self, cursor=None, user=None, **params):
+        self.client.force_login(user or self.admin)
+        if cursor is not None:
+            params['cursor'] = cursor
+        return self.client.get(reverse('sync_changes'), params)
+
+    def test_full_sync_then_delta_sync_with_tombstones(self):
+        pages = [self._sync(limit=2).json()]
+        while pages[-1]['has_more']:
+            pages.append(self._sync(pages[-1]['cursor'], limit=2).json())
+        self.assertGreater(len(pages), 2)
+        synced = [row['id'] for page in pages for row in page['changes']['products']]
+        self.assertEqual(synced, [product.id for product in self.products])
+
+        changed, removed = self.products[0], self.products[1]
+        changed.quantity = 10
+        changed.save()
+        removed_id = removed.id
+        removed.delete()
+
+        delta = self._sync(pages[-1]['cursor']).json()
+        self.assertEqual([row['id'] for row in delta['changes']['products']], [changed.id])
+        self.assertEqual(delta['deleted']['products'], [removed_id])
+        self.assertEqual(self._sync(delta['cursor']).json()['changes']['products'], [])
+
+    def _full_sync(self, user):
+        page = self._sync(user=user).json()
+        while page['has_more']:
+            page = self._sync(page['cursor'], user=user).json()
+        return page['cursor']
+
+    def test_moved_products_are_deleted_for_users_who_cannot_see_them(self):
+        manager = CustomUser.objects.create_user('manager', 'manager@example.com', 'password', role='manager')
+        Store.objects.filter(pk=self.store.pk).update(manager=manager)
+        other_store = Store.objects.create(name='Side', address='2 Side St')
+        cursors = {user: self._full_sync(user) for user in (manager, self.admin)}
+
+        moved = self.products[0]
+        moved.store = other_store
+        moved.save()
+
+        delta = self._sync(cursors[manager], user=manager).json()
+        self.assertEqual(delta['changes']['products'], [])
+        self.assertEqual(delta['deleted']['products'], [moved.id])
+        # Admins see both stores, so the product is updated rather than deleted
+        delta = self._sync(cursors[self.admin]).json()
+        self.assertEqual([row['id'] for row in delta['changes']['products']], [moved.id])
+        self.assertEqual(delta['deleted']['products'], [])
+
+    def test_changed_stores_ask_for_a_full_sync(self):
+        manager = CustomUser.objects.create_user('manager', 'manager@example.com', 'password', role='manager')
+        cursor = self._full_sync(manager)
+        Store.objects.filter(pk=self.store.pk).update(manager=manager)
+        response = self._sync(cursor, user=manager)
+        self.assertEqual(response.status_code, 410)
+        full = self._sync(user=manager).json()
+        self.assertEqual(len(full['changes']['products']), len(self.products))
+
+    def test_expired_cursor_asks_for_a_full_sync(self):
+        since = (timezone.now() - timedelta(days=365)).isoformat()
+        response = self._sync(sync._encode({'s': since, 'u': None, 'p': 0, 'k': None}))
+        self.assertEqual(response.status_code, 410)
+
+    def test_malformed_cursors_are_rejected(self):
+        for state in (
+            {'s': 123},
+            {'s': '2026-10-10T00:00:00'},
+            {'k': 5},
+            {'k': ['2026-10-10T00:00:00+00:00', 'abc']},
+            {'p': 1.0},
+            {'h': 5},
+            [],
+        ):
+            with self.subTest(state=state):
+                self.assertEqual(self._sync(sync._encode(state)).status_code, 400)
+        self.assertEqual(self._sync('not-a-cursor').status_code, 400)
+
+
+@override_settings(RESPONSE_CACHE_TIMEOUT=60)
+class ResponseCacheTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = CustomUser.objects.create_user('admin', 'admin@example.com', 'password', role='admin')
+        cls.manager = CustomUser.objects.create_user(
+            'manager', 'manager@example.com', 'password', role='manager', first_name='Ann'
+        )
+        cls.staff = CustomUser.objects.create_user('staff', 'staff@example.com', 'password', role='staff')
+        cls.store = Store.objects.create(name='Main', address='1 Main St', manager=cls.manager)
+        cls.store.employees.add(cls.staff)
+
+    def setUp(self):
+        cache.clear()
+        response_cache.stats.reset()
+
+    def _store_list(self, user):
+        self.client.force_login(user)
+        return self.client.get(reverse('store_list'))
+
+    def test_second_request_is_a_hit(self):
+        self.assertEqual(self._store_list(self.staff)['X-Cache'], 'MISS')
+        self.assertEqual(self._store_list(self.staff)['X-Cache'], 'HIT')
+
+    def test_writes_invalidate_cached_responses(self):
+        self._store_list(self.staff)
+        Store.objects.filter(pk=self.store.pk).first().save()
+        self.assertEqual(self._store_list(self.staff)['X-Cache'], 'MISS')
+
+    def test_renaming_a_manager_invalidates_their_stores(self):
+        for user in (self.manager, self.staff):
+            self._store_list(user)
+        self.manager.first_name = 'Beth'
+        self.manager.save()
+        for user in (self.manager, self.staff):
+            response = self._store_list(user)
+            self.assertEqual(response['X-Cache'], 'MISS')
+            self.assertEqual(response.json()['stores'][0]['manager']['name'], 'Beth')
+
+    def test_renaming_a_supplier_invalidates_the_stores_holding_its_products(self):
+        supplier = Supplier.objects.create(name='Acme', phone='555-0100')
+        supplier.stores.add(self.store)
+        Product.objects.create(
+            name='Widget', sku='W-1', price='1.00', quantity=5, supplier=supplier, store=self.store
+        )
+        # The store keeps the supplier's products after the supplier stops serving it
+        supplier.stores.remove(self.store)
+        self.client.force_login(self.staff)
+        self.client.get(reverse('product_list'))
+
+        supplier.name = 'Acme Ltd'
+        supplier.save()
+        response = self.client.get(reverse('product_list'))
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual(response.json()['products'][0]['supplier']['name'], 'Acme Ltd')
+
+    def test_concurrent_misses_compute_the_response_once(self):
+        calls = []
+
+        @response_cache.cached_response('slow')
+        def slow_view(request):
+            calls.append(request)
+            time.sleep(0.2)
+            return JsonResponse({'calls': len(calls)})
+
+        def fetch():
+            request = RequestFactory().get('/slow/')
+            request.user = self.admin
+            return slow_view(request)
+
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            responses = list(executor.map(lambda _: fetch(), range(2)))
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(sorted(response['X-Cache'] for response in responses), ['HIT', 'MISS'])
+        self.assertEqual(response_cache.stats.snapshot()['slow'], {'hits': 0, 'misses': 1, 'coalesced': 1})
+
+
+class ProductPaginationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = CustomUser.objects.create_user('admin', 'admin@example.com', 'password', role='admin')
+        cls.store = Store.objects.create(name='Main', address='1 Main St')
+        cls.supplier = Supplier.objects.create(name='Acme', phone='555-0100')
+        cls.products = [
+            Product.objects.create(
+                name=f'Product {i}', sku=f'SKU-{i}', price='1.00', quantity=i, supplier=cls.supplier, store=cls.store
+            )
+            for i in range(5)
+        ]
+
+    def _pages(self, **params):
+        self.client.force_login(self.admin)
+        pages = [self.client.get(reverse('product_list'), {'limit': 2, **params}).json()]
+        while pages[-1]['next_cursor']:
+            pages.append(
+                self.client.get(reverse('product_list'), {'limit': 2, 'cursor': pages[-1]['next_cursor'], **params}).json()
+            )
+        return pages
+
+    def test_pages_cover_every_product_once(self):
+        for ordering in KEYSET_ORDERINGS:
+            with self.subTest(ordering=ordering):
+                pages = self._pages(order=ordering)
+                self.assertEqual([len(page['products']) for page in pages], [2, 2, 1])
+                ids = [product['id'] for page in pages for product in page['products']]
+                self.assertCountEqual(ids, [product.id for product in self.products])
+
+    def test_malformed_cursors_are_rejected(self):
+        self.client.force_login(self.admin)
+        for ordering, values in (
+            ('id', ['abc']),
+            ('id', [True]),
+            ('updated_at', [5, 1]),
+            ('updated_at', ['2026-10-10T00:00:00', 1]),
+            ('updated_at', ['2026-10-10T00:00:00+00:00', 'abc']),
+        ):
+            with self.subTest(ordering=ordering, values=values):
+                cursor = base64.urlsafe_b64encode(json.dumps({'o': ordering, 'v': values}).encode()).decode()
+                response = self.client.get(reverse('product_list'), {'order': ordering, 'cursor': cursor})
+                self.assertEqual(response.status_code, 400)
+
+
+class StoreScopeTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = CustomUser.objects.create_user('admin', 'admin@example.com', 'password', role='admin')
+        cls.manager = CustomUser.objects.create_user('manager', 'manager@example.com', 'password', role='manager')
+        cls.other_manager = CustomUser.objects.create_user('other', 'other@example.com', 'password', role='manager')
+        cls.staff = CustomUser.objects.create_user('staff', 'staff@example.com', 'password', role='staff')
+        cls.store = Store.objects.create(name='Main', address='1 Main St', manager=cls.manager)
+        cls.other_store = Store.objects.create(name='Side', address='2 Side St', manager=cls.other_manager)
+        cls.store.employees.add(cls.staff)
+        supplier = Supplier.objects.create(name='Acme', phone='555-0100')
+        cls.product = Product.objects.create(
+            name='Widget', sku='W-1', price='1.00', quantity=5, supplier=supplier, store=cls.store
+        )
+        cls.other_product = Product.objects.create(
+            name='Gadget', sku='G-1', price='1.00', quantity=5, supplier=supplier, store=cls.other_store
+        )
+
+    def setUp(self):
+        cache.clear()
+
+    def _product_status(self, user, product):
+        self.client.force_login(user)
+        return self.client.get(reverse('product_detail', args=[product.id])).status_code
+
+    def test_admin_scope_runs_no_queries(self):
+        with self.assertNumQueries(0):
+            scope = StoreScope(self.admin)
+            self.assertIsNone(scope.store_ids)
+            self.assertTrue(scope.allows(self.other_store.id))
+            scope.filter(Product.objects.all())
+
+    def test_store_ids_are_resolved_once(self):
+        scope = StoreScope(self.manager)
+        with self.assertNumQueries(1):
+            self.assertEqual(scope.store_ids, {self.store.id})
+            self.assertTrue(scope.allows(self.store.id))
+            self.assertFalse(scope.allows(self.other_store.id))
+            self.assertFalse(scope.allows('abc'))
+
+    def test_filter_uses_a_subquery_until_the_ids_are_known(self):
+        scope = StoreScope(self.staff)
+        with self.assertNumQueries(1):
+            self.assertEqual(list(scope.filter(Product.objects.all())), [self.product])
+        with self.assertNumQueries(1):
+            scope.store_ids
+        with self.assertNumQueries(1):
+            # The known ids replace the subquery
+            self.assertNotIn('SELECT', str(scope.filter(Product.objects.all()).query).split('WHERE', 1)[1])
+            self.assertEqual(list(scope.filter(Product.objects.all())), [self.product])
+
+    def test_claims_are_used_without_a_query(self):
+        self.staff.store_ids = [self.store.id]
+        try:
+            with self.assertNumQueries(0):
+                self.assertEqual(StoreScope(self.staff).store_ids, {self.store.id})
+        finally:
+            del self.staff.store_ids
+
+    @override_settings(STORE_SCOPE_CACHE_TIMEOUT=60)
+    def test_cached_scope_is_shared_between_requests(self):
+        with self.assertNumQueries(1):
+            StoreScope(self.staff).store_ids
+        with self.assertNumQueries(0):
+            self.assertEqual(StoreScope(self.staff).store_ids, {self.store.id})
+
+    @override_settings(STORE_SCOPE_CACHE_TIMEOUT=60)
+    def test_removed_staff_lose_access(self):
+        self.assertEqual(self._product_status(self.staff, self.product), 200)
+        self.store.employees.remove(self.staff)
+        self.assertEqual(self._product_status(self.staff, self.product), 403)
+
+        self.store.employees.add(self.staff)
+        self.assertEqual(self._product_status(self.staff, self.product), 200)
+        self.store.employees.clear()
+        self.assertEqual(self._product_status(self.staff, self.product), 403)
+
+        self.staff.assigned_stores.add(self.store)
+        self.assertEqual(self._product_status(self.staff, self.product), 200)
+        self.staff.assigned_stores.remove(self.store)
+        self.assertEqual(self._product_status(self.staff, self.product), 403)
+
+    @override_settings(STORE_SCOPE_CACHE_TIMEOUT=60)
+    def test_changing_a_store_manager_moves_access(self):
+        self.assertEqual(self._product_status(self.manager, self.product), 200)
+        self.assertEqual(self._product_status(self.other_manager, self.product), 403)
+        self.store.manager = self.other_manager
+        self.store.save()
+        self.assertEqual(self._product_status(self.manager, self.product), 403)
+        self.assertEqual(self._product_status(self.other_manager, self.product), 200)
+
+    @override_settings(STORE_SCOPE_CACHE_TIMEOUT=60)
+    def test_changing_a_role_changes_the_scope(self):
+        self.other_store.manager = self.staff
+        self.other_store.save()
+        self.assertEqual(self._product_status(self.staff, self.product), 200)
+        self.assertEqual(self._product_status(self.staff, self.other_product), 403)
+        self.staff.role = 'manager'
+        self.staff.save()
+        # Managers reach the stores they manage, not the ones they are assigned to
+        self.assertEqual(self._product_status(self.staff, self.product), 403)
+        self.assertEqual(self._product_status(self.staff, self.other_product), 200)
+
+
+class InventoryRollupTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = CustomUser.objects.create_user('admin', 'admin@example.com', 'password', role='admin')
+        cls.stores = [Store.objects.create(name=f'Store {i}', address=f'{i} Main St') for i in range(2)]
+        cls.suppliers = [Supplier.objects.create(name=f'Supplier {i}', phone=f'555-000{i}') for i in range(2)]
+        for supplier in cls.suppliers:
+            supplier.stores.add(*cls.stores)
+
+    def _product(self, sku, store=0, supplier=0, price='2.50', quantity=20, threshold=10):
+        return Product.objects.create(
+            name=sku, sku=sku, price=price, quantity=quantity, threshold=threshold,
+            store=self.stores[store], supplier=self.suppliers[supplier],
+        )
+
+    def assertRollupsMatchProducts(self):
+        stored = {
+            (row.store_id, row.supplier_id): (row.product_count, row.low_stock_count, row.total_quantity, row.total_value)
+            for row in InventoryRollup.objects.exclude(product_count=0)
+        }
+        self.assertEqual(stored, compute_rollups())
+        output = StringIO()
+        call_command('rebuild_inventory_rollups', '--verify', stdout=output)
+        self.assertIn('up to date', output.getvalue())
+
+    def test_product_writes_keep_rollups_in_sync(self):
+        first = self._product('A')
+        second = self._product('B', quantity=5)
+        self._product('C', store=1, supplier=1, price='10.00', quantity=1)
+        self.assertRollupsMatchProducts()
+        rollup = InventoryRollup.objects.get(store=self.stores[0], supplier=self.suppliers[0])
+        self.assertEqual(
+            (rollup.product_count, rollup.low_stock_count, rollup.total_quantity, str(rollup.total_value)),
+            (2, 1, 25, '62.50'),
+        )
+
+        first.price = '3.00'
+        first.quantity = 2
+        first.save()
+        self.assertRollupsMatchProducts()
+
+        second.store = self.stores[1]
+        second.supplier = self.suppliers[1]
+        second.save()
+        self.assertRollupsMatchProducts()
+
+        first.delete()
+        self.assertRollupsMatchProducts()
+
+    def test_bulk_writes_keep_rollups_in_sync(self):
+        products = [self._product(f'P{i}', store=i % 2, supplier=i // 2 % 2) for i in range(6)]
+        adjust_stock(
+            [{'id': products[0].id, 'delta': -15}, {'sku': products[3].sku, 'delta': 7}, {'id': products[4].id, 'delta': -20}],
+            self.admin,
+        )
+        self.assertRollupsMatchProducts()
+
+        rows = [
+            (1, {'name': 'P1', 'sku': 'P1', 'price': '4.00', 'quantity': 3, 'store_id': self.stores[0].id,
+                 'supplier_id': self.suppliers[1].id}),
+            (2, {'name': 'NEW', 'sku': 'NEW', 'price': '1.00', 'quantity': 9, 'store_id': self.stores[1].id,
+                 'supplier_id': self.suppliers[0].id}),
+        ]
+        report = import_products(rows, self.admin)
+        self.assertEqual((report['created'], report['updated']), (1, 1))
+        self.assertRollupsMatchProducts()
+
+    def test_verify_reports_drift_and_rebuild_repairs_it(self):
+        self._product('A')
+        self._product('B', store=1)
+        InventoryRollup.objects.filter(store=self.stores[0]).update(total_quantity=999)
+
+        with self.assertRaises(CommandError):
+            call_command('rebuild_inventory_rollups', '--verify', stdout=StringIO())
+        call_command('rebuild_inventory_rollups', '--store', str(self.stores[0].id), stdout=StringIO())
+        self.assertRollupsMatchProducts()
+
+
+class StockLedgerTests(TestCase):
+    """
+    Quantities as of a time start from the latest snapshot at or before it and
+    replay the later movements. The snapshot below records a stocktake that
+    disagrees with the movements before it, so the results show which one was used.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = CustomUser.objects.create_user('admin', 'admin@example.com', 'password', role='admin')
+        cls.store = Store.objects.create(name='Main', address='1 Main St')
+        cls.other_store = Store.objects.create(name='Side', address='2 Side St')
+        supplier = Supplier.objects.create(name='Acme', phone='555-0100')
+        cls.product = Product.objects.create(
+            name='Widget', sku='W-1', price='2.00', quantity=8, supplier=supplier, store=cls.store
+        )
+        cls.other_product = Product.objects.create(
+            name='Gadget', sku='G-1', price='1.00', quantity=4, supplier=supplier, store=cls.other_store
+        )
+
+        cls.start = timezone.now() - timedelta(hours=10)
+        cls.snapshot_at = cls.start + timedelta(hours=2)
+        cls._move(cls.product, 10, hours=0)
+        cls._move(cls.product, -3, hours=1)
+        take_snapshots([cls.store.id])
+        StockSnapshot.objects.update(taken_at=cls.snapshot_at)
+        cls._move(cls.product, 5, hours=3)
+        cls._move(cls.product, -1, hours=4)
+        # The other store has never been snapshotted
+        cls._move(cls.other_product, 4, hours=1)
+
+    @classmethod
+    def _move(cls, product, delta, hours):
+        StockMovement.objects.create(
+            product=product, store=product.store, delta=delta, reason='adjustment', timestamp=cls.start + timedelta(hours=hours)
+        )
+
+    def _at(self, hours):
+        return self.start + timedelta(hours=hours)
+
+    def test_quantity_before_at_and_after_the_snapshot(self):
+        self.assertIsNone(quantity_as_of(self.product.id, self._at(-1)))
+        self.assertEqual(quantity_as_of(self.product.id, self._at(1.5)), 7)
+        self.assertEqual(quantity_as_of(self.product.id, self.snapshot_at), 8)
+        self.assertEqual(quantity_as_of(self.product.id, self._at(3.5)), 13)
+        self.assertEqual(quantity_as_of(self.product.id, self._at(5)), 12)
+        self.assertEqual(quantity_as_of(self.other_product.id, self._at(5)), 4)
+
+    def test_inventory_as_of_starts_from_each_store_checkpoint(self):
+        def quantities(hours):
+            rows = inventory_as_of(self._at(hours), [self.store.id, self.other_store.id])
+            return {(row['store_id'], row['product_id']): row['quantity'] for row in rows}
+
+        self.assertEqual(quantities(-1), {})
+        self.assertEqual(quantities(1.5), {(self.store.id, self.product.id): 7, (self.other_store.id, self.other_product.id): 4})
+        self.assertEqual(quantities(2)[(self.store.id, self.product.id)], 8)
+        self.assertEqual(quantities(5), {(self.store.id, self.product.id): 12, (self.other_store.id, self.other_product.id): 4})
+
+    def test_stock_as_of_endpoint(self):
+        self.client.force_login(self.admin)
+        response = self.client.get(reverse('stock_as_of'), {'at': self._at(5).isoformat(), 'store_id': self.store.id})
+        self.assertEqual(response.json()['stores'], [{
+            'store_id': self.store.id, 'store_name': 'Main', 'product_count': 1, 'total_quantity': 12, 'total_value': '24.00',
+        }])
 
-# Create your tests here.
@@ -6,6 +6,9 @@ urlpatterns = [
     path('products/', views.product_list, name='product_list'),
     path('products/<int:product_id>/', views.product_detail, name='product_detail'),
     path('products/create/', views.product_create, name='product_create'),
+    path('products/export/', views.product_export, name='product_export'),
+    path('products/import/', views.product_import, name='product_import'),
+    path('products/stock/adjust/', views.stock_adjust, name='stock_adjust'),
     path('products/<int:product_id>/update/', views.product_update, name='product_update'),
     path('products/<int:product_id>/delete/', views.product_delete, name='product_delete'),
     
@@ -26,4 +29,22 @@ urlpatterns = [
     # Dashboard URLs
     path('dashboard/', views.dashboard_overview, name='dashboard_overview'),
     path('dashboard/low-stock/', views.low_stock_products, name='low_stock_products'),
+
+    # Inventory history URLs
+    path('inventory/as-of/', views.stock_as_of, name='stock_as_of'),
+
+    # Offline sync URLs
+    path('sync/', views.sync_changes, name='sync_changes'),
+
+    # Stock event stream URLs
+    path('events/stock/', views.stock_events, name='stock_events'),
+
+    # Reference data URLs
+    path('bootstrap/', views.reference_bootstrap, name='reference_bootstrap'),
+
+    # Batch URLs
+    path('batch/', views.batch_requests, name='batch_requests'),
+
+    # Response cache URLs
+    path('cache/stats/', views.cache_stats, name='cache_stats'),
 ] 
\ No newline at end of file
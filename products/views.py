@@ -1,71 +1,272 @@
 from django.shortcuts import render
+import csv
+import itertools
 import json
+from decimal import Decimal
 from django.shortcuts import get_object_or_404
-from django.http import JsonResponse
+from django.http import Http404, JsonResponse, StreamingHttpResponse
 from django.views.decorators.csrf import csrf_exempt
-from django.db.models import Count, Sum
-from users.decorators import admin_required, manager_or_admin_required, staff_or_above_required, store_manager_or_admin_required
-from .models import Product, Store, Supplier
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.db.models import Prefetch, Q, Sum
+from django.db.models.functions import Coalesce
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import quote_etag
+from users.decorators import (
+    admin_required, conditional_get, manager_or_admin_required, staff_or_above_required,
+    store_manager_or_admin_required,
+)
+from users.models import CustomUser
+from users.scope import scope_version, store_scope
+from . import cache as response_cache
+from .batch import BatchFormatError, parse_batch, run_batch
+from .cache import cached_response
+from .events import async_event_stream, event_stream
+from .imports import ImportFormatError, import_products, open_upload, parse_rows
+from .ledger import inventory_as_of, parse_as_of, record_product_changes, summarize_inventory
+from .models import InventoryRollup, Product, ProductRegistry, Store, Supplier
+from .pagination import KEYSET_ORDERINGS, InvalidCursor, keyset_page, parse_page_size
+from .reference import reference_data, scoped_reference_data
+from .rollups import product_state
+from .sharding import (
+    add_related_names, delete_product, gather_page, gather_rows, product_atomic, products_in, register_product,
+    save_product, scatter, shard_for_product, shard_for_store, shard_querysets, sharding_enabled, sku_taken,
+)
+from .stock import StockAdjustmentError, adjust_stock, threshold_crossings
+from .sync import CursorExpired, sync_page
 
 # Create your views here.
 
-@staff_or_above_required
-def product_list(request):
+# Fields that can be requested from product_list via ?fields=, mapped to the
+# columns each one needs. Store and supplier names are joined in the same query.
+PRODUCT_LIST_FIELDS = {
+    'id': ('id',),
+    'name': ('name',),
+    'sku': ('sku',),
+    'price': ('price',),
+    'quantity': ('quantity',),
+    'threshold': ('threshold',),
+    'supplier': ('supplier_id', 'supplier__name'),
+    'store': ('store_id', 'store__name'),
+    'is_low_stock': ('is_low_stock',),
+    'updated_at': ('updated_at',),
+}
+
+# Returned by the endpoints that still read products from the default database only
+SHARDING_UNSUPPORTED = 'Not available while products are sharded across databases'
+
+DEFAULT_PRODUCT_LIST_FIELDS = ('id', 'name', 'sku', 'price', 'quantity', 'threshold', 'supplier', 'store', 'is_low_stock')
+
+def _visible_stores(request):
     """
-    Get a list of all products.
-    Accessible by all authenticated users.
-    Can filter by store_id using query parameter.
+    Return the stores the user can see based on their role: admins see all
+    stores, managers the stores they manage and staff the stores they are
+    assigned to. The scope is resolved once per request (see users.scope).
+    """
+    return store_scope(request).stores()
+
+def _scoped_products(request):
+    """
+    Return the products visible to the current user.
+    An explicit store_id query parameter narrows the result to that store.
     """
-    # Get query parameters
     store_id = request.GET.get('store_id')
 
     # Filter products by store if store_id is provided
     if store_id:
-        products = Product.objects.filter(store_id=store_id)
+        return Product.objects.filter(store_id=store_id)
+
+    # Admins see all products, everyone else only products from their stores
+    return store_scope(request).filter(Product.objects.all())
+
+def _sharded_product_rows(store_ids, columns, ordering, cursor=None, limit=None, **filters):
+    """
+    Read product rows with the given values() columns from the product shards
+    holding the given stores (None for all), merged in keyset order and
+    paginated when a limit is given. Store and supplier columns are looked up
+    in the default database, since the shards cannot join them.
+    Returns (rows, next_cursor).
+    """
+    local_columns = [column for column in columns if '__' not in column]
+    querysets = shard_querysets(store_ids, lambda products: products.filter(**filters).values(*local_columns))
+    if limit is None:
+        rows, next_cursor = gather_rows(querysets, ordering), None
     else:
-        # Filter based on user role
-        if request.user.role == 'admin':
-            # Admins see all products
-            products = Product.objects.all()
-        elif request.user.role == 'manager':
-            # Managers only see products from stores they manage
-            managed_stores = Store.objects.filter(manager=request.user)
-            products = Product.objects.filter(store__in=managed_stores)
+        rows, next_cursor = gather_page(querysets, ordering, cursor, limit)
+    add_related_names(
+        rows,
+        store_fields=[column.split('__', 1)[1] for column in columns if column.startswith('store__')],
+        supplier_fields=[column.split('__', 1)[1] for column in columns if column.startswith('supplier__')],
+    )
+    return rows, next_cursor
+
+def _get_product_or_404(product_id):
+    """Load a product from the database that holds it; a shard when products are sharded."""
+    alias = shard_for_product(product_id)
+    if alias is None:
+        raise Http404('No Product matches the given query.')
+    return get_object_or_404(products_in(alias), id=product_id)
+
+def _serialize_product_row(row, fields):
+    """Build the product_list representation of a values() row."""
+    data = {}
+    for field in fields:
+        if field == 'supplier':
+            data['supplier'] = {'id': row['supplier_id'], 'name': row['supplier__name']}
+        elif field == 'store':
+            data['store'] = {'id': row['store_id'], 'name': row['store__name']}
+        elif field == 'price':
+            data['price'] = str(row['price'])
+        elif field == 'updated_at':
+            data['updated_at'] = row['updated_at'].isoformat()
         else:
-            # Staff only see products from stores they are assigned to
-            assigned_stores = request.user.assigned_stores.all()
-            products = Product.objects.filter(store__in=assigned_stores)
+            data[field] = row[field]
+    return data
 
-    product_data = []
+def _product_list_markers(request):
+    return response_cache.version_markers(response_cache.response_namespaces(request))
 
-    for product in products:
-        product_data.append({
-            'id': product.id,
-            'name': product.name,
-            'sku': product.sku,
-            'price': str(product.price),
-            'quantity': product.quantity,
-            'threshold': product.threshold,
-            'supplier': {
-                'id': product.supplier.id,
-                'name': product.supplier.name
-            },
-            'store': {
-                'id': product.store.id,
-                'name': product.store.name
-            },
-            'is_low_stock': product.is_low_stock
-        })
+@staff_or_above_required
+@conditional_get(_product_list_markers)
+@cached_response('product_list')
+def product_list(request):
+    """
+    Get a list of all products.
+    Accessible by all authenticated users.
+    Can filter by store_id using query parameter.
+
+    Optional query parameters:
+    - fields: comma separated subset of PRODUCT_LIST_FIELDS to return
+    - limit / cursor: keyset pagination; the response then carries next_cursor
+    - order: 'id' (default) or 'updated_at' when paginating
+    """
+    fields = DEFAULT_PRODUCT_LIST_FIELDS
+    if request.GET.get('fields'):
+        fields = [field.strip() for field in request.GET['fields'].split(',') if field.strip()]
+        unknown = [field for field in fields if field not in PRODUCT_LIST_FIELDS]
+        if unknown:
+            return JsonResponse({'error': f'Unknown fields: {", ".join(unknown)}'}, status=400)
+
+    ordering = request.GET.get('order', 'id')
+    if ordering not in KEYSET_ORDERINGS:
+        return JsonResponse({'error': f'order must be one of: {", ".join(KEYSET_ORDERINGS)}'}, status=400)
+
+    # Select only the columns needed by the requested fields and the ordering key
+    columns = set(KEYSET_ORDERINGS[ordering])
+    for field in fields:
+        columns.update(PRODUCT_LIST_FIELDS[field])
+
+    paginate = 'limit' in request.GET or 'cursor' in request.GET
+    if sharding_enabled():
+        try:
+            store_ids = [int(request.GET['store_id'])] if request.GET.get('store_id') else store_scope(request).store_ids
+        except ValueError:
+            return JsonResponse({'error': 'store_id must be an integer'}, status=400)
+        try:
+            limit = parse_page_size(request.GET.get('limit')) if paginate else None
+            rows, next_cursor = _sharded_product_rows(store_ids, columns, ordering, request.GET.get('cursor'), limit)
+        except InvalidCursor as e:
+            return JsonResponse({'error': str(e)}, status=400)
+    elif paginate:
+        try:
+            limit = parse_page_size(request.GET.get('limit'))
+            rows, next_cursor = keyset_page(
+                _scoped_products(request).values(*columns), ordering, request.GET.get('cursor'), limit
+            )
+        except InvalidCursor as e:
+            return JsonResponse({'error': str(e)}, status=400)
+    else:
+        rows = _scoped_products(request).values(*columns).order_by(*KEYSET_ORDERINGS[ordering])
+
+    product_data = [_serialize_product_row(row, fields) for row in rows]
 
+    if paginate:
+        return JsonResponse({'products': product_data, 'next_cursor': next_cursor})
     return JsonResponse({'products': product_data})
 
+# Columns written by product_export, in CSV column order
+PRODUCT_EXPORT_COLUMNS = (
+    'id', 'sku', 'name', 'description', 'price', 'quantity', 'threshold', 'is_low_stock',
+    'store_id', 'store_name', 'supplier_id', 'supplier_name', 'updated_at',
+)
+
+PRODUCT_EXPORT_CHUNK_SIZE = 2000
+
+# Columns written by the CSV form of stock_as_of
+STOCK_AS_OF_COLUMNS = ('store_id', 'store_name', 'product_id', 'sku', 'name', 'quantity', 'price', 'value')
+
+class _Echo:
+    """File-like object whose write() returns the value, for streaming csv.writer output."""
+
+    def write(self, value):
+        return value
+
+def _export_row(product):
+    """Build the flat export representation of a product."""
+    return {
+        'id': product.id,
+        'sku': product.sku,
+        'name': product.name,
+        'description': product.description,
+        'price': str(product.price),
+        'quantity': product.quantity,
+        'threshold': product.threshold,
+        'is_low_stock': product.is_low_stock,
+        'store_id': product.store_id,
+        'store_name': product.store.name,
+        'supplier_id': product.supplier_id,
+        'supplier_name': product.supplier.name,
+        'updated_at': product.updated_at.isoformat(),
+    }
+
 @staff_or_above_required
+def product_export(request):
+    """
+    Stream the products visible to the current user as NDJSON (default) or CSV.
+    Accessible by all authenticated users, with the same scoping as product_list.
+    Rows are read in chunks and written as they are read, so memory use does not
+    depend on the size of the catalog.
+    """
+    if sharding_enabled():
+        return JsonResponse({'error': SHARDING_UNSUPPORTED}, status=501)
+
+    export_format = request.GET.get('format', 'ndjson')
+    if export_format not in ('ndjson', 'csv'):
+        return JsonResponse({'error': 'format must be ndjson or csv'}, status=400)
+
+    products = _scoped_products(request).select_related('store', 'supplier').only(
+        *[column for column in PRODUCT_EXPORT_COLUMNS if not column.endswith('_name')],
+        'store__name', 'supplier__name',
+    ).order_by('id')
+    rows = (_export_row(product) for product in products.iterator(chunk_size=PRODUCT_EXPORT_CHUNK_SIZE))
+
+    if export_format == 'csv':
+        writer = csv.DictWriter(_Echo(), fieldnames=PRODUCT_EXPORT_COLUMNS)
+        content = itertools.chain([writer.writeheader()], (writer.writerow(row) for row in rows))
+        response = StreamingHttpResponse(content, content_type='text/csv')
+        response['Content-Disposition'] = 'attachment; filename="products.csv"'
+    else:
+        content = (json.dumps(row) + '\n' for row in rows)
+        response = StreamingHttpResponse(content, content_type='application/x-ndjson')
+
+    return response
+
+def _product_detail_markers(request, product_id):
+    # Writes to a product, its store or its supplier bump the version of the product's store
+    index = ProductRegistry.objects if sharding_enabled() else Product.objects
+    store_id = index.filter(id=product_id).values_list('store_id', flat=True).first()
+    if store_id is None:
+        return None
+    return response_cache.version_markers([f'store:{store_id}'])
+
+@staff_or_above_required
+@conditional_get(_product_detail_markers)
 def product_detail(request, product_id):
     """
     Get detailed information for a specific product.
     Accessible by all authenticated users, but managers can only view products in their stores.
     """
-    product = get_object_or_404(Product, id=product_id)
+    product = _get_product_or_404(product_id)
 
     # Check if user has access to this product based on their role
     if request.user.role == 'admin':
@@ -73,11 +274,11 @@ def product_detail(request, product_id):
         pass
     elif request.user.role == 'manager':
         # Managers can only access products from stores they manage
-        if not product.store.manager or product.store.manager.id != request.user.id:
+        if not store_scope(request).allows(product.store_id):
             return JsonResponse({'error': 'Access denied. You can only view products from stores that you manage.'}, status=403)
     else:
         # Staff can only access products from stores they are assigned to
-        if not request.user.assigned_stores.filter(id=product.store.id).exists():
+        if not store_scope(request).allows(product.store_id):
             return JsonResponse({'error': 'Access denied. You can only view products from stores that you are assigned to.'}, status=403)
 
     product_data = {
@@ -127,17 +328,13 @@ def product_create(request):
                 return JsonResponse({'error': f'Field {field} is required'}, status=400)
 
         # Check if the user is a manager and if they manage the store for this product
-        if request.user.role == 'manager':
-            store_id = data.get('store_id')
-            try:
-                store = Store.objects.get(id=store_id)
-                if not store.manager or store.manager.id != request.user.id:
-                    return JsonResponse({'error': 'Access denied. You can only add products to stores that you manage. Please contact an administrator if you need access to this store.'}, status=403)
-            except Store.DoesNotExist:
+        if request.user.role == 'manager' and not store_scope(request).allows(data.get('store_id')):
+            if not Store.objects.filter(id=data.get('store_id')).exists():
                 return JsonResponse({'error': 'Store not found'}, status=404)
+            return JsonResponse({'error': 'Access denied. You can only add products to stores that you manage. Please contact an administrator if you need access to this store.'}, status=403)
 
         # Check if SKU already exists
-        if Product.objects.filter(sku=data['sku']).exists():
+        if sku_taken(data['sku']):
             return JsonResponse({'error': 'SKU already exists'}, status=400)
 
         # Get supplier and store
@@ -148,17 +345,21 @@ def product_create(request):
         if not supplier.stores.filter(id=store.id).exists():
             return JsonResponse({'error': 'The selected supplier does not serve the selected store'}, status=400)
 
-        # Create product
-        product = Product.objects.create(
-            name=data['name'],
-            sku=data['sku'],
-            description=data.get('description', ''),
-            price=data['price'],
-            quantity=data['quantity'],
-            threshold=data.get('threshold', 10),
-            supplier=supplier,
-            store=store
-        )
+        # Create product; the inventory rollups and stock ledger are updated in the same transaction
+        alias = shard_for_store(store.id)
+        with product_atomic(alias):
+            product = products_in(alias).create(
+                id=register_product(data['sku'], store.id),
+                name=data['name'],
+                sku=data['sku'],
+                description=data.get('description', ''),
+                price=data['price'],
+                quantity=data['quantity'],
+                threshold=data.get('threshold', 10),
+                supplier=supplier,
+                store=store
+            )
+            record_product_changes([(product.id, None, product_state(product))], request.user, 'create')
 
         return JsonResponse({
             'message': 'Product created successfully',
@@ -176,6 +377,78 @@ def product_create(request):
     except Exception as e:
         return JsonResponse({'error': str(e)}, status=500)
 
+@csrf_exempt
+@manager_or_admin_required
+def product_import(request):
+    """
+    Create or update products in bulk from a CSV or NDJSON upload.
+    Accessible by managers (for their stores only) and admins.
+
+    The payload is either the request body or a multipart file named 'file'.
+    Query parameters:
+    - format: 'csv' or 'ndjson'; defaults from the Content-Type, else csv
+    - batch_size: rows written per transaction (default PRODUCT_IMPORT_BATCH_SIZE)
+    - on_conflict: 'update' (default) overwrites existing SKUs, 'error' reports them
+    """
+    if sharding_enabled():
+        return JsonResponse({'error': SHARDING_UNSUPPORTED}, status=501)
+
+    if request.method != 'POST':
+        return JsonResponse({'error': 'Only POST method is allowed'}, status=405)
+
+    import_format = request.GET.get('format')
+    if not import_format:
+        import_format = 'ndjson' if 'ndjson' in request.content_type or 'json' in request.content_type else 'csv'
+
+    on_conflict = request.GET.get('on_conflict', 'update')
+    if on_conflict not in ('update', 'error'):
+        return JsonResponse({'error': 'on_conflict must be update or error'}, status=400)
+
+    try:
+        batch_size = int(request.GET.get('batch_size', getattr(settings, 'PRODUCT_IMPORT_BATCH_SIZE', 500)))
+        if batch_size < 1:
+            raise ValueError
+    except ValueError:
+        return JsonResponse({'error': 'batch_size must be a positive integer'}, status=400)
+
+    try:
+        rows = parse_rows(open_upload(request), import_format)
+        report = import_products(rows, request.user, batch_size=batch_size, update_existing=on_conflict == 'update')
+    except (ImportFormatError, UnicodeDecodeError) as e:
+        return JsonResponse({'error': str(e)}, status=400)
+
+    return JsonResponse({'message': 'Import finished', **report})
+
+@csrf_exempt
+@manager_or_admin_required
+def stock_adjust(request):
+    """
+    Apply quantity deltas to many products at once.
+    Accessible by managers (for their stores only) and admins.
+
+    Expects {"adjustments": [{"id": 1, "delta": -3}, {"sku": "ABC", "delta": 10}]}.
+    Returns the new quantities and the products that crossed their threshold.
+    """
+    if request.method != 'POST':
+        return JsonResponse({'error': 'Only POST method is allowed'}, status=405)
+
+    try:
+        data = json.loads(request.body)
+        results = adjust_stock(data.get('adjustments') if isinstance(data, dict) else None, request.user)
+
+        return JsonResponse({
+            'message': 'Stock adjusted successfully',
+            'products': results,
+            'crossed_threshold': threshold_crossings(results)
+        })
+
+    except json.JSONDecodeError:
+        return JsonResponse({'error': 'Invalid JSON data'}, status=400)
+    except StockAdjustmentError as e:
+        return JsonResponse({'error': str(e), 'errors': e.errors}, status=400)
+    except Exception as e:
+        return JsonResponse({'error': str(e)}, status=500)
+
 @csrf_exempt
 @manager_or_admin_required
 def product_update(request, product_id):
@@ -186,11 +459,12 @@ def product_update(request, product_id):
     if request.method != 'PUT' and request.method != 'PATCH':
         return JsonResponse({'error': 'Only PUT/PATCH methods are allowed'}, status=405)
 
-    product = get_object_or_404(Product, id=product_id)
+    product = _get_product_or_404(product_id)
+    old_state = product_state(product)
 
     # Check if the user is a manager and if they manage the store this product belongs to
     if request.user.role == 'manager':
-        if not product.store.manager or product.store.manager.id != request.user.id:
+        if not store_scope(request).allows(product.store_id):
             return JsonResponse({'error': 'Access denied. You can only edit products from stores that you manage. Please contact an administrator if you need access to this product.'}, status=403)
 
     try:
@@ -202,7 +476,7 @@ def product_update(request, product_id):
 
         if 'sku' in data and data['sku'] != product.sku:
             # Check if the new SKU already exists
-            if Product.objects.filter(sku=data['sku']).exists():
+            if sku_taken(data['sku']):
                 return JsonResponse({'error': 'SKU already exists'}, status=400)
             product.sku = data['sku']
 
@@ -245,7 +519,13 @@ def product_update(request, product_id):
                 return JsonResponse({'error': 'The current supplier does not serve the selected store'}, status=400)
             product.store = new_store
 
-        product.save()
+        # Save the product; the inventory rollups and stock ledger are updated in the same transaction
+        with product_atomic(product._state.db, shard_for_store(product.store_id)):
+            save_product(product, old_state)
+            record_product_changes([(product.id, old_state, product_state(product))], request.user, 'update')
+
+        # is_low_stock is computed by the database
+        product.refresh_from_db(fields=['is_low_stock'])
 
         return JsonResponse({
             'message': 'Product updated successfully',
@@ -274,59 +554,89 @@ def product_delete(request, product_id):
     if request.method != 'DELETE':
         return JsonResponse({'error': 'Only DELETE method is allowed'}, status=405)
 
-    product = get_object_or_404(Product, id=product_id)
+    product = _get_product_or_404(product_id)
     product_name = product.name
-    product.delete()
+
+    # Record the stock leaving the ledger together with the deletion
+    with product_atomic(product._state.db):
+        record_product_changes([(product.id, product_state(product), None)], request.user, 'delete')
+        delete_product(product)
 
     return JsonResponse({
         'message': f'Product "{product_name}" deleted successfully'
     })
 
+def _low_stock_markers(request):
+    return response_cache.version_markers(response_cache.response_namespaces(request))
+
 @staff_or_above_required
+@conditional_get(_low_stock_markers)
+@cached_response('low_stock_products')
 def low_stock_products(request):
     """
     Get a list of products that are low in stock (below threshold).
     Accessible by all authenticated users.
     Managers only see products from their stores.
     """
-    # Filter based on user role
-    if request.user.role == 'admin':
-        # Admins see all products
-        products = Product.objects.all()
-    elif request.user.role == 'manager':
-        # Managers only see products from stores they manage
-        managed_stores = Store.objects.filter(manager=request.user)
-        products = Product.objects.filter(store__in=managed_stores)
+    columns = (
+        'id', 'name', 'sku', 'quantity', 'threshold',
+        'store_id', 'store__name', 'supplier_id', 'supplier__name', 'supplier__phone'
+    )
+    if sharding_enabled():
+        products, _ = _sharded_product_rows(store_scope(request).store_ids, columns, 'id', is_low_stock=True)
     else:
-        # Staff only see products from stores they are assigned to
-        assigned_stores = request.user.assigned_stores.all()
-        products = Product.objects.filter(store__in=assigned_stores)
+        # Admins see all products, managers and staff only products from their stores
+        products = store_scope(request).filter(Product.objects.all())
+
+        # Only low stock rows are read, through the partial index on is_low_stock
+        products = products.filter(is_low_stock=True).order_by('id').values(*columns)
 
     low_stock = []
 
     for product in products:
-        if product.is_low_stock:
-            low_stock.append({
-                'id': product.id,
-                'name': product.name,
-                'sku': product.sku,
-                'quantity': product.quantity,
-                'threshold': product.threshold,
-                'store': {
-                    'id': product.store.id,
-                    'name': product.store.name
-                },
-                'supplier': {
-                    'id': product.supplier.id,
-                    'name': product.supplier.name,
-                    'phone': product.supplier.phone
-                }
-            })
+        low_stock.append({
+            'id': product['id'],
+            'name': product['name'],
+            'sku': product['sku'],
+            'quantity': product['quantity'],
+            'threshold': product['threshold'],
+            'store': {
+                'id': product['store_id'],
+                'name': product['store__name']
+            },
+            'supplier': {
+                'id': product['supplier_id'],
+                'name': product['supplier__name'],
+                'phone': product['supplier__phone']
+            }
+        })
 
     return JsonResponse({'low_stock_products': low_stock})
 
 # Store views
+def _with_store_relations(stores, include_employees=False):
+    """
+    Load what the store views render alongside each store: the manager, the
+    suppliers (and optionally the employees) and the product count from the
+    inventory rollups, in a fixed number of queries.
+    """
+    prefetches = [Prefetch('suppliers', queryset=Supplier.objects.only('id', 'name').order_by('id'))]
+    if include_employees:
+        prefetches.append(Prefetch(
+            'employees',
+            queryset=CustomUser.objects.only('id', 'username', 'first_name', 'last_name').order_by('id')
+        ))
+
+    return stores.select_related('manager').prefetch_related(*prefetches).annotate(
+        product_count=Coalesce(Sum('inventory_rollups__product_count'), 0)
+    )
+
+def _store_list_markers(request):
+    return response_cache.version_markers(response_cache.response_namespaces(request))
+
 @staff_or_above_required
+@conditional_get(_store_list_markers)
+@cached_response('store_list')
 def store_list(request):
     """
     Get a list of all stores.
@@ -335,16 +645,9 @@ def store_list(request):
     Staff see only stores they are assigned to.
     Admins see all stores.
     """
-    # Filter stores based on user role
-    if request.user.role == 'admin':
-        # Admins see all stores
-        stores = Store.objects.all()
-    elif request.user.role == 'manager':
-        # Managers see only stores they manage
-        stores = Store.objects.filter(manager=request.user)
-    else:
-        # Staff see only stores they are assigned to
-        stores = request.user.assigned_stores.all()
+    # Filter stores based on user role; managers, suppliers and product counts
+    # are loaded in a fixed number of queries however many stores there are
+    stores = _with_store_relations(_visible_stores(request)).order_by('id')
 
     store_data = []
 
@@ -355,7 +658,7 @@ def store_list(request):
             'address': store.address,
             'phone': store.phone,
             'email': store.email,
-            'productCount': Product.objects.filter(store=store).count()  # Add product count
+            'productCount': store.product_count
         }
 
         # Add manager information if available
@@ -383,7 +686,11 @@ def store_list(request):
 
     return JsonResponse({'stores': store_data})
 
+def _store_detail_markers(request, store_id):
+    return response_cache.version_markers([f'store:{store_id}'])
+
 @staff_or_above_required
+@conditional_get(_store_detail_markers)
 def store_detail(request, store_id):
     """
     Get detailed information for a specific store.
@@ -392,19 +699,22 @@ def store_detail(request, store_id):
     Staff can only view stores they are assigned to.
     Admins can view all stores.
     """
-    store = get_object_or_404(Store, id=store_id)
+    store = get_object_or_404(
+        _with_store_relations(Store.objects.all(), include_employees=True),
+        id=store_id
+    )
 
     # Check if user has access to this store
     if request.user.role == 'admin':
         # Admins have access to all stores
         pass
     elif request.user.role == 'manager':
-        # Managers can only access stores they manage
-        if store.manager != request.user:
+        # Managers can only access stores they manage; the store row already says so
+        if store.manager_id != request.user.id:
             return JsonResponse({'error': 'Access denied. You can only view stores that you manage.'}, status=403)
     else:
-        # Staff can only access stores they are assigned to
-        if not request.user.assigned_stores.filter(id=store_id).exists():
+        # Staff can only access stores they are assigned to (employees are already prefetched)
+        if request.user.id not in {employee.id for employee in store.employees.all()}:
             return JsonResponse({'error': 'Access denied. You can only view stores that you are assigned to.'}, status=403)
 
     store_data = {
@@ -415,7 +725,7 @@ def store_detail(request, store_id):
         'email': store.email,
         'created_at': store.created_at.isoformat(),
         'updated_at': store.updated_at.isoformat(),
-        'productCount': Product.objects.filter(store=store).count()  # Add product count
+        'productCount': store.product_count
     }
 
     # Add manager information if available
@@ -596,7 +906,7 @@ def store_update(request, store_id):
             'address': store.address,
             'phone': store.phone,
             'email': store.email,
-            'productCount': Product.objects.filter(store=store).count()  # Add product count
+            'productCount': products_in(shard_for_store(store.id)).filter(store=store).count()  # Add product count
         }
 
         # Add manager information if available
@@ -644,7 +954,7 @@ def store_delete(request, store_id):
     store = get_object_or_404(Store, id=store_id)
 
     # Check if store has products
-    if Product.objects.filter(store=store).exists():
+    if products_in(shard_for_store(store.id)).filter(store=store).exists():
         return JsonResponse({
             'error': 'Cannot delete store because it has associated products'
         }, status=400)
@@ -657,13 +967,47 @@ def store_delete(request, store_id):
     })
 
 # Supplier views
+def _add_supplier_stores(supplier_data, stores):
+    """Add the stores a supplier serves to its representation, if there are any."""
+    if stores:
+        supplier_data['stores'] = []
+        supplier_data['store_ids'] = []
+        for store in stores:
+            supplier_data['stores'].append({
+                'id': store.id,
+                'name': store.name
+            })
+            supplier_data['store_ids'].append(store.id)
+
+def _with_supplier_relations(suppliers):
+    """
+    Load the stores and product count rendered with each supplier in a fixed
+    number of queries; product counts come from the inventory rollups.
+    """
+    return suppliers.prefetch_related(
+        Prefetch('stores', queryset=Store.objects.only('id', 'name').order_by('id'))
+    ).annotate(
+        product_count=Coalesce(Sum('inventory_rollups__product_count'), 0)
+    )
+
+def _supplier_product_count(supplier):
+    """Return the number of products from a supplier, read from the inventory rollups."""
+    return InventoryRollup.objects.filter(supplier=supplier).aggregate(
+        count=Coalesce(Sum('product_count'), 0)
+    )['count']
+
+def _supplier_list_markers(request):
+    return response_cache.version_markers([response_cache.GLOBAL_VERSION])
+
 @staff_or_above_required
+@conditional_get(_supplier_list_markers)
+@cached_response('supplier_list', per_store=False)
 def supplier_list(request):
     """
     Get a list of all suppliers.
     Accessible by all authenticated users.
     """
-    suppliers = Supplier.objects.all()
+    suppliers = _with_supplier_relations(Supplier.objects.all()).order_by('id')
     supplier_data = []
 
     for supplier in suppliers:
@@ -673,32 +1017,33 @@ def supplier_list(request):
             'contact_person': supplier.contact_person,
             'phone': supplier.phone,
             'email': supplier.email,
-            'productCount': Product.objects.filter(supplier=supplier).count()  # Add product count
+            'productCount': supplier.product_count
         }
 
         # Add basic store information
-        stores = supplier.stores.all()
-        if stores:
-            supplier_info['stores'] = []
-            supplier_info['store_ids'] = []
-            for store in stores:
-                supplier_info['stores'].append({
-                    'id': store.id,
-                    'name': store.name
-                })
-                supplier_info['store_ids'].append(store.id)
+        _add_supplier_stores(supplier_info, supplier.stores.all())
 
         supplier_data.append(supplier_info)
 
     return JsonResponse({'suppliers': supplier_data})
 
+def _supplier_detail_markers(request, supplier_id):
+    # The response names the supplier's stores, whose writes only bump their own and the global versions
+    return response_cache.version_markers([response_cache.GLOBAL_VERSION])
+
 @staff_or_above_required
+@conditional_get(_supplier_detail_markers)
 def supplier_detail(request, supplier_id):
     """
     Get detailed information for a specific supplier.
     Accessible by all authenticated users.
+
+    With ?products=1 the response also embeds a keyset-paginated page of the
+    supplier's products in the user's stores (limit, cursor, order and fields
+    work as in product_list) and product_stats with total units, total value
+    and low stock count over all of those products.
     """
-    supplier = get_object_or_404(Supplier, id=supplier_id)
+    supplier = get_object_or_404(_with_supplier_relations(Supplier.objects.all()), id=supplier_id)
 
     supplier_data = {
         'id': supplier.id,
@@ -709,20 +1054,56 @@ def supplier_detail(request, supplier_id):
         'address': supplier.address,
         'created_at': supplier.created_at.isoformat(),
         'updated_at': supplier.updated_at.isoformat(),
-        'productCount': Product.objects.filter(supplier=supplier).count()  # Add product count
+        'productCount': supplier.product_count
     }
 
     # Add stores information
-    stores = supplier.stores.all()
-    if stores:
-        supplier_data['stores'] = []
-        supplier_data['store_ids'] = []
-        for store in stores:
-            supplier_data['stores'].append({
-                'id': store.id,
-                'name': store.name
-            })
-            supplier_data['store_ids'].append(store.id)
+    _add_supplier_stores(supplier_data, supplier.stores.all())
+
+    if request.GET.get('products') not in (None, '', '0', 'false'):
+        fields = DEFAULT_PRODUCT_LIST_FIELDS
+        if request.GET.get('fields'):
+            fields = [field.strip() for field in request.GET['fields'].split(',') if field.strip()]
+            unknown = [field for field in fields if field not in PRODUCT_LIST_FIELDS]
+            if unknown:
+                return JsonResponse({'error': f'Unknown fields: {", ".join(unknown)}'}, status=400)
+
+        ordering = request.GET.get('order', 'id')
+        if ordering not in KEYSET_ORDERINGS:
+            return JsonResponse({'error': f'order must be one of: {", ".join(KEYSET_ORDERINGS)}'}, status=400)
+
+        columns = set(KEYSET_ORDERINGS[ordering])
+        for field in fields:
+            columns.update(PRODUCT_LIST_FIELDS[field])
+
+        scope = store_scope(request)
+        rollups = scope.filter(InventoryRollup.objects.filter(supplier=supplier))
+
+        try:
+            limit = parse_page_size(request.GET.get('limit'))
+            if sharding_enabled():
+                rows, next_cursor = _sharded_product_rows(
+                    scope.store_ids, columns, ordering, request.GET.get('cursor'), limit, supplier_id=supplier.id
+                )
+            else:
+                products = scope.filter(Product.objects.filter(supplier=supplier))
+                rows, next_cursor = keyset_page(products.values(*columns), ordering, request.GET.get('cursor'), limit)
+        except InvalidCursor as e:
+            return JsonResponse({'error': str(e)}, status=400)
+
+        # Aggregate stats over all of the supplier's products come from the rollups
+        stats = rollups.aggregate(
+            product_count=Coalesce(Sum('product_count'), 0),
+            total_units=Coalesce(Sum('total_quantity'), 0),
+            low_stock_count=Coalesce(Sum('low_stock_count'), 0),
+            total_value=Sum('total_value'),
+        )
+        total_value = stats['total_value']
+        stats['total_value'] = str(total_value.quantize(Decimal('0.01')) if total_value is not None else 0)
+
+        supplier_data['products'] = [_serialize_product_row(row, fields) for row in rows]
+        supplier_data['products_next_cursor'] = next_cursor
+        supplier_data['product_stats'] = stats
 
     return JsonResponse({'supplier': supplier_data})
 
@@ -752,14 +1133,11 @@ def supplier_create(request):
             address=data.get('address', '')
         )
 
-        # Add stores if provided
+        # Add stores if provided; unknown store ids are ignored
+        stores = []
         if 'store_ids' in data and isinstance(data['store_ids'], list):
-            for store_id in data['store_ids']:
-                try:
-                    store = Store.objects.get(id=store_id)
-                    supplier.stores.add(store)
-                except Store.DoesNotExist:
-                    pass
+            stores = list(Store.objects.filter(id__in=data['store_ids']).only('id', 'name').order_by('id'))
+            supplier.stores.add(*stores)
 
         # Prepare response
         supplier_response = {
@@ -770,16 +1148,7 @@ def supplier_create(request):
         }
 
         # Add stores information
-        stores = supplier.stores.all()
-        if stores:
-            supplier_response['stores'] = []
-            supplier_response['store_ids'] = []
-            for store in stores:
-                supplier_response['stores'].append({
-                    'id': store.id,
-                    'name': store.name
-                })
-                supplier_response['store_ids'].append(store.id)
+        _add_supplier_stores(supplier_response, stores)
 
         return JsonResponse({
             'message': 'Supplier created successfully',
@@ -822,18 +1191,12 @@ def supplier_update(request, supplier_id):
         if 'address' in data:
             supplier.address = data['address']
 
-        # Update stores if provided
+        # Replace stores if provided; unknown store ids are ignored
         if 'store_ids' in data and isinstance(data['store_ids'], list):
-            # Clear existing stores
-            supplier.stores.clear()
-
-            # Add new stores
-            for store_id in data['store_ids']:
-                try:
-                    store = Store.objects.get(id=store_id)
-                    supplier.stores.add(store)
-                except Store.DoesNotExist:
-                    pass
+            stores = list(Store.objects.filter(id__in=data['store_ids']).only('id', 'name').order_by('id'))
+            supplier.stores.set(stores)
+        else:
+            stores = list(supplier.stores.only('id', 'name').order_by('id'))
 
         supplier.save()
 
@@ -844,20 +1207,11 @@ def supplier_update(request, supplier_id):
             'contact_person': supplier.contact_person,
             'phone': supplier.phone,
             'email': supplier.email,
-            'productCount': Product.objects.filter(supplier=supplier).count()  # Add product count
+            'productCount': _supplier_product_count(supplier)
         }
 
         # Add stores information
-        stores = supplier.stores.all()
-        if stores:
-            supplier_response['stores'] = []
-            supplier_response['store_ids'] = []
-            for store in stores:
-                supplier_response['stores'].append({
-                    'id': store.id,
-                    'name': store.name
-                })
-                supplier_response['store_ids'].append(store.id)
+        _add_supplier_stores(supplier_response, stores)
 
         return JsonResponse({
             'message': 'Supplier updated successfully',
@@ -882,7 +1236,7 @@ def supplier_delete(request, supplier_id):
     supplier = get_object_or_404(Supplier, id=supplier_id)
 
     # Check if supplier has products
-    if Product.objects.filter(supplier=supplier).exists():
+    if any(scatter(lambda alias: products_in(alias).filter(supplier=supplier).exists())):
         return JsonResponse({
             'error': 'Cannot delete supplier because it has associated products'
         }, status=400)
@@ -895,51 +1249,227 @@ def supplier_delete(request, supplier_id):
     })
 
 @staff_or_above_required
+def sync_changes(request):
+    """
+    Get the products, stores and suppliers created, updated or deleted since a cursor.
+    Accessible by all authenticated users, scoped to the stores they can see.
+
+    Query parameters:
+    - cursor: the cursor returned by the previous response; omit it for a full sync
+    - limit: maximum number of rows and tombstones per page
+
+    Keep requesting with the returned cursor while has_more is true, then store
+    the cursor for the next sync. A 410 response means the cursor is older than
+    the retained deletion log, or the user's stores changed since it was
+    issued, and a full sync is needed.
+    """
+    if sharding_enabled():
+        return JsonResponse({'error': SHARDING_UNSUPPORTED}, status=501)
+
+    try:
+        limit = parse_page_size(request.GET.get('limit'), default=500)
+        page = sync_page(store_scope(request), request.GET.get('cursor'), limit)
+    except CursorExpired as e:
+        return JsonResponse({'error': str(e)}, status=410)
+    except InvalidCursor as e:
+        return JsonResponse({'error': str(e)}, status=400)
+
+    return JsonResponse(page)
+
+@staff_or_above_required
+def stock_events(request):
+    """
+    Stream stock changes and low stock crossings as server-sent events.
+    Accessible by all authenticated users, scoped to the stores they can see.
+
+    Sends a 'stock' event whenever the quantity or store of a product changes
+    and a 'low_stock' event when a product falls to or below its threshold
+    ('low') or rises above it ('restocked'). An 'overflow' event means the
+    client fell behind and missed events; refetch the affected lists.
+    Heartbeat comments keep idle connections open.
+
+    Served through ims_project/asgi.py a waiting client holds no thread;
+    under WSGI each connection occupies a worker thread.
+
+    The stream ends when the user's store scope changes (stores assigned or
+    removed, a role change, deactivation); EventSource clients reconnect and
+    continue with the new scope.
+    """
+    # Read the version first, so a change while the scope is resolved still ends the stream
+    version = scope_version(request.user.id)
+    store_ids = store_scope(request).store_ids
+    if isinstance(request, ASGIRequest):
+        stream = async_event_stream(store_ids, request.user.id, version)
+    else:
+        stream = event_stream(store_ids, request.user.id, version)
+    response = StreamingHttpResponse(stream, content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+@staff_or_above_required
+def stock_as_of(request):
+    """
+    Get the stock on hand per store at a past date or time.
+    Accessible by all authenticated users, scoped to the stores they can see.
+
+    Query parameters:
+    - at: ISO date or datetime (required); a date means the end of that day
+    - store_id: limit the report to one store
+    - format: 'json' (default) returns per-store totals, 'csv' streams one row per product
+    """
+    if sharding_enabled():
+        return JsonResponse({'error': SHARDING_UNSUPPORTED}, status=501)
+
+    at = parse_as_of(request.GET.get('at'))
+    if at is None:
+        return JsonResponse({'error': 'at must be an ISO date or datetime'}, status=400)
+
+    scope = store_scope(request)
+    store_ids = scope.store_ids
+    if store_ids is None:
+        store_ids = set(Store.objects.values_list('id', flat=True))
+    if request.GET.get('store_id'):
+        try:
+            store_id = int(request.GET['store_id'])
+        except ValueError:
+            return JsonResponse({'error': 'store_id must be an integer'}, status=400)
+        if not scope.allows(store_id):
+            return JsonResponse({'error': 'Access denied. You can only view stock for stores you have access to.'}, status=403)
+        store_ids = {store_id}
+
+    rows = inventory_as_of(at, store_ids)
+
+    if request.GET.get('format') == 'csv':
+        writer = csv.DictWriter(_Echo(), fieldnames=STOCK_AS_OF_COLUMNS)
+        content = itertools.chain([writer.writeheader()], (writer.writerow(row) for row in rows))
+        response = StreamingHttpResponse(content, content_type='text/csv')
+        response['Content-Disposition'] = f'attachment; filename="stock-{at.date().isoformat()}.csv"'
+        return response
+
+    return JsonResponse({'at': at.isoformat(), 'stores': summarize_inventory(rows)})
+
+def _dashboard_markers(request):
+    return response_cache.version_markers([response_cache.GLOBAL_VERSION])
+
+@staff_or_above_required
+@conditional_get(_dashboard_markers)
+@cached_response('dashboard_overview', per_store=False)
 def dashboard_overview(request):
     """
     Get an overview of the inventory system for the dashboard.
     Accessible by all authenticated users.
+    When DASHBOARD_ROLE_SCOPING is enabled, managers and staff only see figures
+    for their own stores. All figures are read from the inventory rollups in
+    three aggregate queries, so the cost grows with stores, not products.
     """
-    # Count total products, stores, and suppliers
-    total_products = Product.objects.count()
-    total_stores = Store.objects.count()
-    total_suppliers = Supplier.objects.count()
+    scoped = getattr(settings, 'DASHBOARD_ROLE_SCOPING', False) and request.user.role != 'admin'
+
+    rollups = InventoryRollup.objects.all()
+    stores = Store.objects.all()
+    suppliers = Supplier.objects.all()
+    supplier_rollup_filter = None
+
+    if scoped:
+        stores = _visible_stores(request)
+        rollups = store_scope(request).filter(rollups)
+        # Only suppliers serving one of the visible stores, counting only their products in those stores
+        suppliers = suppliers.filter(
+            id__in=Supplier.stores.through.objects.filter(store__in=stores).values('supplier_id')
+        )
+        supplier_rollup_filter = Q(inventory_rollups__store__in=stores)
 
-    # Get low stock products count
-    low_stock_count = 0
-    for product in Product.objects.all():
-        if product.is_low_stock:
-            low_stock_count += 1
+    # Product totals, low stock count and inventory value in a single query
+    totals = rollups.aggregate(
+        total_products=Coalesce(Sum('product_count'), 0),
+        low_stock_count=Coalesce(Sum('low_stock_count'), 0),
+        total_value=Sum('total_value'),
+    )
 
     # Get products per store
-    store_products = []
-    for store in Store.objects.all():
-        store_products.append({
-            'store_name': store.name,
-            'product_count': Product.objects.filter(store=store).count()
-        })
+    store_products = [
+        {'store_name': store['name'], 'product_count': store['product_count']}
+        for store in stores.order_by('id').values('id', 'name').annotate(
+            product_count=Coalesce(Sum('inventory_rollups__product_count'), 0)
+        )
+    ]
 
     # Get products per supplier
-    supplier_products = []
-    for supplier in Supplier.objects.all():
-        supplier_products.append({
-            'supplier_name': supplier.name,
-            'product_count': Product.objects.filter(supplier=supplier).count()
-        })
+    supplier_products = [
+        {'supplier_name': supplier['name'], 'product_count': supplier['product_count']}
+        for supplier in suppliers.order_by('id').values('id', 'name').annotate(
+            product_count=Coalesce(Sum('inventory_rollups__product_count', filter=supplier_rollup_filter), 0)
+        )
+    ]
 
-    # Calculate total inventory value
-    total_value = 0
-    for product in Product.objects.all():
-        total_value += product.price * product.quantity
+    # SQLite returns the sum without a fixed scale
+    total_value = totals['total_value']
+    total_value = total_value.quantize(Decimal('0.01')) if total_value is not None else 0
 
     return JsonResponse({
         'overview': {
-            'total_products': total_products,
-            'total_stores': total_stores,
-            'total_suppliers': total_suppliers,
-            'low_stock_count': low_stock_count,
+            'total_products': totals['total_products'],
+            'total_stores': len(store_products),
+            'total_suppliers': len(supplier_products),
+            'low_stock_count': totals['low_stock_count'],
             'total_inventory_value': str(total_value),
         },
         'store_products': store_products,
         'supplier_products': supplier_products
     })
+
+@staff_or_above_required
+def reference_bootstrap(request):
+    """
+    Get the stores, suppliers, managers and staff that form screens need, keyed by id.
+    Accessible by all authenticated users; stores are limited to the ones they can see.
+
+    The data is cached and rebuilt only after a store, supplier, user or
+    supplier/staff assignment changes. Pass the returned version back as
+    ?version= (or the ETag as If-None-Match) to get {"unchanged": true}
+    (or a 304) instead of the data when nothing changed.
+    """
+    version, data = reference_data()
+    etag = quote_etag(version)
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        if request.GET.get('version') == version:
+            response = JsonResponse({'version': version, 'unchanged': True})
+        else:
+            response = JsonResponse({'version': version, **scoped_reference_data(data, store_scope(request).store_ids)})
+    response['ETag'] = etag
+    patch_vary_headers(response, ('Authorization', 'Cookie'))
+    return response
+
+@csrf_exempt
+@staff_or_above_required
+def batch_requests(request):
+    """
+    Run several API requests in one round trip.
+    Accessible by all authenticated users; each sub-request is checked like
+    the endpoint it targets.
+
+    Expects {"requests": [{"id": "stores", "method": "GET", "path": "/api/stores/"}, ...]},
+    with an optional JSON "body" per request. Returns {"responses": [...]}
+    in request order, each with the id, status and body of the sub-request.
+    Consecutive reads run concurrently; writes run in order.
+    """
+    if request.method != 'POST':
+        return JsonResponse({'error': 'Only POST method is allowed'}, status=405)
+
+    try:
+        specs = parse_batch(json.loads(request.body))
+    except json.JSONDecodeError:
+        return JsonResponse({'error': 'Invalid JSON data'}, status=400)
+    except BatchFormatError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+
+    return JsonResponse({'responses': run_batch(request, specs, batch_requests)})
+
+@admin_required
+def cache_stats(request):
+    """
+    Get the response cache hit, miss and coalesced counts per endpoint.
+    Counts are kept per worker process. Accessible by admins only.
+    """
+    return JsonResponse({'response_cache': response_cache.stats.snapshot()})
@@ -0,0 +1,138 @@
+import secrets
+import time
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core import signing
+from django.core.cache import cache
+from .scope import scope_queryset
+
+ACCESS_TOKEN_SALT = 'users.access_token'
+
+
+def signed_tokens_enabled():
+    """Return True when login issues signed access tokens (AUTH_TOKEN_MODE = 'signed')."""
+    return getattr(settings, 'AUTH_TOKEN_MODE', 'database') == 'signed'
+
+
+def access_token_lifetime():
+    return getattr(settings, 'AUTH_ACCESS_TOKEN_LIFETIME_SECONDS', 300)
+
+
+class TokenUser:
+    """
+    A request user built from the claims of a signed access token.
+
+    id, username, role and store_ids come from the token, so the role
+    decorators and store scoping need no queries. Any other attribute loads
+    the full user from the database on first use, which keeps views that
+    read other fields or save the user working unchanged.
+    """
+    is_authenticated = True
+    is_anonymous = False
+    is_active = True
+
+    def __init__(self, claims):
+        object.__setattr__(self, 'id', claims['uid'])
+        object.__setattr__(self, 'username', claims['usr'])
+        object.__setattr__(self, 'role', claims['role'])
+        stores = claims.get('stores')
+        object.__setattr__(self, 'store_ids', frozenset(stores) if stores is not None else None)
+        object.__setattr__(self, '_user', None)
+
+    @property
+    def pk(self):
+        return self.id
+
+    def _load(self):
+        if self._user is None:
+            object.__setattr__(self, '_user', get_user_model().objects.get(pk=self.id))
+        return self._user
+
+    def __getattr__(self, name):
+        if name.startswith('__'):
+            raise AttributeError(name)
+        return getattr(self._load(), name)
+
+    def __setattr__(self, name, value):
+        setattr(self._load(), name, value)
+
+    def __str__(self):
+        return self.username
+
+
+def access_store_ids(user):
+    """Return the ids of the stores a user can access, or None for admins (all stores)."""
+    if user.role == 'admin':
+        return None
+    return sorted(row['id'] for row in scope_queryset(user))
+
+
+def issue_access_token(user):
+    """
+    Return a signed access token carrying the user's id, role and store ids.
+    The claims are fixed when the token is issued, so role or store changes
+    show up once the client refreshes it.
+    """
+    claims = {
+        'uid': user.id,
+        'usr': user.username,
+        'role': user.role,
+        'stores': access_store_ids(user),
+        'jti': secrets.token_hex(8),
+        'iat': time.time(),
+    }
+    return signing.dumps(claims, salt=ACCESS_TOKEN_SALT, compress=True)
+
+
+def _revoked_token_key(jti):
+    return f'auth:revoked-token:{jti}'
+
+
+def _revoked_user_key(user_id):
+    return f'auth:revoked-user:{user_id}'
+
+
+def _read_claims(token):
+    try:
+        return signing.loads(token, salt=ACCESS_TOKEN_SALT, max_age=access_token_lifetime())
+    except signing.BadSignature:
+        return None
+
+
+def verify_access_token(token):
+    """
+    Return a TokenUser for a valid, unexpired and unrevoked access token, or None.
+
+    Verification is an HMAC check plus one lookup in the revocation list,
+    which is kept in the Django cache; no database queries are made.
+    """
+    claims = _read_claims(token)
+    if claims is None:
+        return None
+
+    revoked = cache.get_many([_revoked_token_key(claims['jti']), _revoked_user_key(claims['uid'])])
+    if _revoked_token_key(claims['jti']) in revoked:
+        return None
+    revoked_at = revoked.get(_revoked_user_key(claims['uid']))
+    if revoked_at is not None and claims['iat'] <= revoked_at:
+        return None
+
+    return TokenUser(claims)
+
+
+def revoke_access_token(token):
+    """
+    Add an access token to the revocation list until it would have expired anyway.
+    Returns False if the token is invalid or already expired.
+    """
+    claims = _read_claims(token)
+    if claims is None:
+        return False
+    remaining = claims['iat'] + access_token_lifetime() - time.time()
+    cache.set(_revoked_token_key(claims['jti']), True, timeout=max(int(remaining) + 1, 1))
+    return True
+
+
+def revoke_user_access_tokens(user_id):
+    """Reject every access token issued to a user up to now, e.g. after a role change."""
+    cache.set(_revoked_user_key(user_id), time.time(), timeout=access_token_lifetime() + 1)
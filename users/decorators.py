@@ -1,5 +1,10 @@
+import hashlib
 from functools import wraps
+from django.db.models import Count, Max, Sum
 from django.http import JsonResponse
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import quote_etag
+from .scope import store_scope
 
 def role_required(allowed_roles):
     """
@@ -70,18 +75,73 @@ def store_manager_or_admin_required(view_func):
                     pass
 
             # If we have a store_id, check if the manager is assigned to this store
-            if store_id:
-                from products.models import Store
-                try:
-                    store = Store.objects.get(id=store_id)
-                    if store.manager and store.manager.id == request.user.id:
-                        return view_func(request, *args, **kwargs)
-                except Store.DoesNotExist:
-                    pass
+            if store_id and store_scope(request).allows(store_id):
+                return view_func(request, *args, **kwargs)
 
             return JsonResponse({'error': 'Access denied. You can only edit stores that you manage. Please contact an administrator if you need access to this store.'}, status=403)
 
         # Staff and other roles don't have access
         return JsonResponse({'error': 'Access denied'}, status=403)
 
-    return wrapper
\ No newline at end of file
+    return wrapper
+
+def conditional_get(validator):
+    """
+    Decorator answering conditional GET requests with 304 Not Modified before the view runs.
+
+    validator(request, *args, **kwargs) returns a list of values that change
+    whenever the response would, such as the response cache versions of the
+    stores the view reads (products.cache.version_markers) or the results of
+    change_markers, or None to skip the check (e.g. when the user cannot see
+    the resource and the view will refuse it). It runs on every GET, with or
+    without If-None-Match, since every response carries the ETag, so it should
+    be cheap. The ETag hashes the values with the user and the URL. No Last-Modified is sent: deleted rows,
+    removed links and scope changes do not move MAX(updated_at) forward, so
+    If-Modified-Since would answer 304 with stale data; counts and id sums in
+    the ETag do catch them.
+    Must be applied below the role decorators, since it reads the user.
+    """
+    def decorator(view_func):
+        @wraps(view_func)
+        def wrapper(request, *args, **kwargs):
+            if request.method not in ('GET', 'HEAD') or not request.user.is_authenticated:
+                return view_func(request, *args, **kwargs)
+
+            values = validator(request, *args, **kwargs)
+            if values is None:
+                return view_func(request, *args, **kwargs)
+
+            identity = [request.user.id, request.user.role, request.get_full_path()] + list(values)
+            etag = quote_etag(hashlib.sha256(repr(identity).encode('utf-8')).hexdigest()[:32])
+
+            response = get_conditional_response(request, etag=etag)
+            if response is None:
+                response = view_func(request, *args, **kwargs)
+                if response.status_code != 200:
+                    return response
+
+            response.headers.setdefault('ETag', etag)
+            # Responses differ per user, who is identified by either of these headers
+            patch_vary_headers(response, ('Authorization', 'Cookie'))
+            return response
+        return wrapper
+    return decorator
+
+def change_markers(queryset, *relations):
+    """
+    Return values for a conditional_get validator in one aggregate query: the
+    number, id sum and latest updated_at of the rows in the queryset, and the
+    same over each related path (e.g. 'store' or 'suppliers'). Id sums catch
+    rows swapped for others, which leave counts unchanged.
+    """
+    aggregates = {
+        'count': Count('id', distinct=True),
+        'ids': Sum('id', distinct=True),
+        'latest': Max('updated_at'),
+    }
+    for relation in relations:
+        aggregates[f'{relation}_count'] = Count(relation)
+        aggregates[f'{relation}_ids'] = Sum(f'{relation}__id')
+        aggregates[f'{relation}_latest'] = Max(f'{relation}__updated_at')
+    markers = queryset.order_by().aggregate(**aggregates)
+    return [markers[name] for name in aggregates]
@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+from users.tokens import purge_expired_tokens
+
+
+class Command(BaseCommand):
+    help = 'Delete expired login tokens. Run periodically to keep the token table small.'
+
+    def handle(self, *args, **options):
+        count = purge_expired_tokens()
+        self.stdout.write(self.style.SUCCESS(f'Deleted {count} expired tokens'))
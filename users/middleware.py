@@ -1,21 +1,19 @@
 import logging
-import json
-from django.http import JsonResponse
-from django.contrib.auth import get_user_model
-from django.contrib.auth.models import AnonymousUser
-from django.contrib.auth import login
+from .access_tokens import revoke_access_token, signed_tokens_enabled, verify_access_token
+from .tokens import authenticate_token, issue_token, revoke_token
 
 # Set up logging
 logger = logging.getLogger(__name__)
 
-# Global dictionary to store user tokens (in a real app, this would be in a database)
-# Format: {token: user_id}
-USER_TOKENS = {}
-
 class TokenAuthMiddleware:
     """
     Middleware to authenticate users via Bearer token in Authorization header.
     This is a simple implementation that works alongside Django's session authentication.
+
+    Tokens live in the database so every worker accepts them and they survive
+    restarts; an in-process cache (see users.tokens) makes most lookups free.
+    With AUTH_TOKEN_MODE = 'signed' the bearer token is a signed access token
+    instead, verified without any database access (see users.access_tokens).
     """
 
     def __init__(self, get_response):
@@ -31,34 +29,30 @@ class TokenAuthMiddleware:
         if auth_header.startswith('Bearer '):
             token = auth_header.split(' ')[1]
 
-            # Log the token for debugging
-            logger.debug(f"Received token: {token}")
-
-            # Check if token exists in our global dictionary
-            user_id = USER_TOKENS.get(token)
-            if user_id:
-                try:
-                    # Get the user from the database
-                    User = get_user_model()
-                    user = User.objects.get(id=user_id)
-
+            try:
+                if signed_tokens_enabled():
+                    user = verify_access_token(token)
+                else:
+                    user = authenticate_token(token)
+                if user is not None:
                     # Set the user on the request
                     request.user = user
 
                     # Log successful authentication
                     logger.debug(f"Authenticated user {user.username} via token")
-                except Exception as e:
-                    logger.error(f"Error authenticating token: {str(e)}")
+            except Exception as e:
+                logger.error(f"Error authenticating token: {str(e)}")
 
         return self.get_response(request)
 
 # Function to store a user's token
 def store_user_token(user_id, token):
-    USER_TOKENS[token] = user_id
+    issue_token(user_id, token)
     logger.debug(f"Stored token for user {user_id}")
 
 # Function to remove a user's token
 def remove_user_token(token):
-    if token in USER_TOKENS:
-        del USER_TOKENS[token]
+    if signed_tokens_enabled() and revoke_access_token(token):
+        logger.debug(f"Revoked access token")
+    elif revoke_token(token):
         logger.debug(f"Removed token")
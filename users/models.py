@@ -41,6 +41,7 @@ class CustomUser(AbstractBaseUser, PermissionsMixin):
     is_active = models.BooleanField(default=True)
     is_staff = models.BooleanField(default=False)  # ✅ FIX: make this a field, not a property!
     date_joined = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
 
     objects = CustomUserManager()
 
@@ -55,3 +56,16 @@ class CustomUser(AbstractBaseUser, PermissionsMixin):
 
     def has_module_perms(self, app_label):
         return self.is_superuser or self.role == 'admin'
+
+class AuthToken(models.Model):
+    """
+    A bearer token issued at login. Only a SHA-256 digest of the token is
+    stored, so the table cannot be used to impersonate users.
+    """
+    key = models.CharField(max_length=64, primary_key=True)
+    user = models.ForeignKey(CustomUser, on_delete=models.CASCADE, related_name='auth_tokens')
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField(db_index=True)
+
+    def __str__(self):
+        return f"Token for {self.user_id} (expires {self.expires_at:%Y-%m-%d %H:%M})"
@@ -0,0 +1,143 @@
+import time
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+
+def _scope_cache_timeout():
+    return getattr(settings, 'STORE_SCOPE_CACHE_TIMEOUT', 0)
+
+
+def _scope_cache_key(user_id):
+    return f'store-scope:{user_id}'
+
+
+def _scope_version_key(user_id):
+    return f'store-scope:version:{user_id}'
+
+
+def scope_version(user_id):
+    """
+    Return the version of a user's store scope, which changes whenever
+    invalidate_store_scopes() drops it. Open event streams compare it to
+    notice that their scope is out of date.
+    """
+    key = _scope_version_key(user_id)
+    # Missing versions start from the clock, so an evicted version never comes back
+    cache.add(key, time.time_ns(), timeout=None)
+    return cache.get(key)
+
+
+async def ascope_version(user_id):
+    """The async counterpart of scope_version()."""
+    key = _scope_version_key(user_id)
+    await cache.aadd(key, time.time_ns(), timeout=None)
+    return await cache.aget(key)
+
+
+def _bump_scope_versions(user_ids):
+    for user_id in user_ids:
+        try:
+            cache.incr(_scope_version_key(user_id))
+        except ValueError:
+            cache.set(_scope_version_key(user_id), time.time_ns(), timeout=None)
+
+
+def scope_queryset(user):
+    """
+    Return a values('id') queryset of the stores a non-admin user can access:
+    the stores they manage for managers, the stores they are assigned to for staff.
+    """
+    from products.models import Store
+
+    if user.role == 'manager':
+        return Store.objects.filter(manager_id=user.id).values('id')
+    return Store.objects.filter(employees=user.id).values('id')
+
+
+def invalidate_store_scopes(user_ids):
+    """
+    Drop the shared cache entries of users whose accessible stores changed,
+    bump their scope versions and revoke their signed access tokens, whose
+    claims carry the store ids. The versions are bumped again on commit, so a
+    stream reconnecting in between does not keep the old scope.
+    """
+    from .access_tokens import revoke_user_access_tokens, signed_tokens_enabled
+
+    user_ids = [user_id for user_id in user_ids if user_id is not None]
+    if user_ids and _scope_cache_timeout():
+        cache.delete_many([_scope_cache_key(user_id) for user_id in user_ids])
+    if user_ids:
+        _bump_scope_versions(user_ids)
+        transaction.on_commit(lambda: _bump_scope_versions(user_ids))
+    if signed_tokens_enabled():
+        for user_id in user_ids:
+            revoke_user_access_tokens(user_id)
+
+
+class StoreScope:
+    """
+    The stores a user can access, resolved at most once.
+
+    Admins can access every store and never cause a query. For everyone else
+    the store ids come from signed access token claims, the shared cache
+    (when STORE_SCOPE_CACHE_TIMEOUT is set) or a single query, in that order.
+    Filtering before the ids are known uses a subquery instead, so list views
+    do not pay for a separate scope query.
+    """
+
+    def __init__(self, user):
+        self.user = user
+        self.is_global = user.role == 'admin'
+        claims = getattr(user, 'store_ids', None)
+        self._ids = frozenset(claims) if claims is not None else None
+        self._cache_checked = False
+
+    def _known_ids(self):
+        if self._ids is None and not self._cache_checked and _scope_cache_timeout():
+            self._cache_checked = True
+            self._ids = cache.get(_scope_cache_key(self.user.id))
+        return self._ids
+
+    @property
+    def store_ids(self):
+        """Return the frozenset of accessible store ids, or None for admins."""
+        if self.is_global:
+            return None
+        if self._known_ids() is None:
+            self._ids = frozenset(row['id'] for row in scope_queryset(self.user))
+            if _scope_cache_timeout():
+                cache.set(_scope_cache_key(self.user.id), self._ids, timeout=_scope_cache_timeout())
+        return self._ids
+
+    def allows(self, store_id):
+        """Return True if the user can access the store with the given id."""
+        if self.is_global:
+            return True
+        try:
+            return int(store_id) in self.store_ids
+        except (TypeError, ValueError):
+            return False
+
+    def filter(self, queryset, field='store'):
+        """Restrict a queryset to the accessible stores through the given store field."""
+        if self.is_global:
+            return queryset
+        # With a shared cache the ids are worth resolving, since later requests reuse them
+        ids = self.store_ids if _scope_cache_timeout() else self._known_ids()
+        return queryset.filter(**{f'{field}__in': ids if ids is not None else scope_queryset(self.user)})
+
+    def stores(self):
+        """Return a queryset of the accessible stores."""
+        from products.models import Store
+
+        return self.filter(Store.objects.all(), field='id')
+
+
+def store_scope(request):
+    """Return the StoreScope of the request's user, computed once per request."""
+    scope = getattr(request, '_store_scope', None)
+    if scope is None or scope.user is not request.user:
+        scope = StoreScope(request.user)
+        request._store_scope = scope
+    return scope
@@ -0,0 +1,43 @@
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+from .access_tokens import revoke_user_access_tokens
+from .models import CustomUser
+from .scope import invalidate_store_scopes
+from .tokens import revoke_user_tokens, token_cache
+
+
+@receiver(pre_save, sender=CustomUser)
+def remember_user_role(sender, instance, raw=False, **kwargs):
+    """Remember the stored role so access tokens can be revoked when it changes."""
+    instance._stored_role = None
+    if raw or instance.pk is None:
+        return
+    instance._stored_role = CustomUser.objects.filter(pk=instance.pk).values_list('role', flat=True).first()
+
+
+@receiver(post_save, sender=CustomUser)
+def refresh_cached_tokens(sender, instance, raw=False, **kwargs):
+    """Drop cached snapshots of a changed user; deactivated users lose their tokens."""
+    if raw:
+        return
+    if not instance.is_active:
+        revoke_user_tokens(instance.pk)
+        revoke_user_access_tokens(instance.pk)
+        # Ends the user's open event streams
+        invalidate_store_scopes([instance.pk])
+    else:
+        token_cache.evict_user(instance.pk)
+        stored_role = getattr(instance, '_stored_role', None)
+        if stored_role is not None and stored_role != instance.role:
+            # Signed access tokens carry the role, so they must be refreshed
+            revoke_user_access_tokens(instance.pk)
+            # The role decides which stores are in the user's scope
+            invalidate_store_scopes([instance.pk])
+
+
+@receiver(post_delete, sender=CustomUser)
+def evict_deleted_user_tokens(sender, instance, **kwargs):
+    """Stop accepting cached tokens of a deleted user in this process."""
+    token_cache.evict_user(instance.pk)
+    revoke_user_access_tokens(instance.pk)
+    invalidate_store_scopes([instance.pk])
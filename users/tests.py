@@ -1,3 +1,155 @@
-from django.test import TestCase
+import json
+import time
+from datetime import timedelta
+from unittest import mock
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from products.models import Store
+from .models import AuthToken, CustomUser
+from .tokens import TokenCache, authenticate_token, issue_token, revoke_token, revoke_user_tokens, token_cache
+
+
+@override_settings(AUTH_TOKEN_MODE='signed', AUTH_ACCESS_TOKEN_LIFETIME_SECONDS=300)
+class SignedAccessTokenTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.staff = CustomUser.objects.create_user('staff', 'staff@example.com', 'password', role='staff')
+        cls.store = Store.objects.create(name='Main', address='1 Main St')
+        cls.store.employees.add(cls.staff)
+
+    def setUp(self):
+        cache.clear()
+
+    def _login(self):
+        response = self.client.post(
+            reverse('login'), json.dumps({'username': 'staff', 'password': 'password'}), content_type='application/json'
+        )
+        return response.json()
+
+    def _me(self, token):
+        # A fresh client, so only the bearer token authenticates the request
+        return self.client_class().get(reverse('current_user'), HTTP_AUTHORIZATION=f'Bearer {token}')
+
+    def test_login_issues_an_access_token_and_a_refresh_token(self):
+        data = self._login()
+        self.assertEqual(data['expires_in'], 300)
+        response = self._me(data['token'])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['user']['assigned_stores'], [{'id': self.store.id, 'name': 'Main'}])
+
+    def test_refresh_issues_a_new_access_token(self):
+        data = self._login()
+        response = self.client.post(
+            reverse('refresh_access_token'), json.dumps({'refresh_token': data['refresh_token']}),
+            content_type='application/json',
+        )
+        self.assertNotEqual(response.json()['token'], data['token'])
+        self.assertEqual(self._me(response.json()['token']).status_code, 200)
+
+    def test_logout_revokes_the_access_token(self):
+        token = self._login()['token']
+        self.client_class().post(reverse('logout'), HTTP_AUTHORIZATION=f'Bearer {token}')
+        self.assertEqual(self._me(token).status_code, 401)
+
+    def test_expired_access_tokens_are_rejected(self):
+        token = self._login()['token']
+        with mock.patch('django.core.signing.time.time', return_value=time.time() + 301):
+            self.assertEqual(self._me(token).status_code, 401)
+
+    def test_leaving_a_store_revokes_access_tokens(self):
+        data = self._login()
+        self.store.employees.remove(self.staff)
+        self.assertEqual(self._me(data['token']).status_code, 401)
+
+        # A refreshed token carries the new store ids
+        response = self.client.post(
+            reverse('refresh_access_token'), json.dumps({'refresh_token': data['refresh_token']}),
+            content_type='application/json',
+        )
+        me = self._me(response.json()['token'])
+        self.assertEqual(me.status_code, 200)
+        self.assertEqual(me.json()['user']['assigned_stores'], [])
+
+
+@override_settings(AUTH_TOKEN_MODE='database')
+class DatabaseTokenTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.staff = CustomUser.objects.create_user('staff', 'staff@example.com', 'password', role='staff')
+
+    def setUp(self):
+        token_cache.clear()
+
+    def _later(self, seconds):
+        """Patch both clocks the token store reads, as if the given seconds had passed."""
+        monotonic = time.monotonic() + seconds
+        now = timezone.now() + timedelta(seconds=seconds)
+        return mock.patch.multiple(
+            'users.tokens', time=mock.Mock(monotonic=mock.Mock(return_value=monotonic)),
+            timezone=mock.Mock(now=mock.Mock(return_value=now)),
+        )
+
+    def test_cached_tokens_authenticate_without_queries(self):
+        issue_token(self.staff.id, 'token')
+        with self.assertNumQueries(1):
+            self.assertEqual(authenticate_token('token').id, self.staff.id)
+        with self.assertNumQueries(0):
+            self.assertEqual(authenticate_token('token').id, self.staff.id)
+
+    def test_expired_tokens_are_rejected(self):
+        issue_token(self.staff.id, 'token')
+        authenticate_token('token')
+        AuthToken.objects.update(expires_at=timezone.now() - timedelta(seconds=1))
+        # The cached entry still answers until the cache TTL runs out
+        self.assertIsNotNone(authenticate_token('token'))
+        with self._later(token_cache.ttl + 1):
+            self.assertIsNone(authenticate_token('token'))
+
+    def test_cache_entries_do_not_outlive_their_token(self):
+        issue_token(self.staff.id, 'token')
+        AuthToken.objects.update(expires_at=timezone.now() + timedelta(seconds=5))
+        authenticate_token('token')
+        with self._later(6):
+            self.assertIsNone(authenticate_token('token'))
+
+    def test_revoking_evicts_cached_tokens(self):
+        for token in ('first', 'second'):
+            issue_token(self.staff.id, token)
+            authenticate_token(token)
+        self.assertTrue(revoke_token('first'))
+        self.assertIsNone(authenticate_token('first'))
+        self.assertIsNotNone(authenticate_token('second'))
+
+        revoke_user_tokens(self.staff.id)
+        self.assertIsNone(authenticate_token('second'))
+
+    def test_deactivated_users_lose_their_tokens(self):
+        issue_token(self.staff.id, 'token')
+        authenticate_token('token')
+        self.staff.is_active = False
+        self.staff.save()
+        self.assertIsNone(authenticate_token('token'))
+        self.assertFalse(AuthToken.objects.exists())
+
+    def test_logout_revokes_the_token(self):
+        token = self.client.post(
+            reverse('login'), json.dumps({'username': 'staff', 'password': 'password'}), content_type='application/json'
+        ).json()['token']
+        self.assertIsNotNone(authenticate_token(token))
+        self.client_class().post(reverse('logout'), HTTP_AUTHORIZATION=f'Bearer {token}')
+        self.assertIsNone(authenticate_token(token))
+
+    def test_cache_size_is_bounded_least_recently_used_first(self):
+        cache = TokenCache(max_size=2, ttl=60)
+        expires_at = timezone.now() + timedelta(hours=1)
+        cache.set('a', {'id': 1}, expires_at)
+        cache.set('b', {'id': 2}, expires_at)
+        cache.get('a')
+        cache.set('c', {'id': 3}, expires_at)
+        self.assertEqual(cache.stats()['size'], 2)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('a'), {'id': 1})
+        self.assertEqual(cache.get('c'), {'id': 3})
 
-# Create your tests here.
@@ -0,0 +1,143 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from datetime import timedelta
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.utils import timezone
+from .models import AuthToken
+
+
+def token_digest(token):
+    """Return the digest under which a token is stored."""
+    return hashlib.sha256(token.encode('utf-8')).hexdigest()
+
+
+class TokenCache:
+    """
+    A bounded, thread-safe LRU cache of token digest -> user snapshot.
+
+    Entries expire after ttl seconds (or when the token itself expires, if that
+    is sooner), which bounds how long another worker can keep accepting a
+    token revoked in a different process. Revocations made in this process
+    are evicted immediately.
+    """
+
+    def __init__(self, max_size, ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, digest):
+        """Return the cached snapshot for a digest, or None if absent or stale."""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(digest)
+            if entry is None or entry[0] <= now:
+                if entry is not None:
+                    del self._entries[digest]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(digest)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, digest, snapshot, expires_at):
+        """Cache a snapshot until the TTL runs out or the token expires."""
+        if self.max_size <= 0 or self.ttl <= 0:
+            return
+        remaining = (expires_at - timezone.now()).total_seconds()
+        deadline = time.monotonic() + min(self.ttl, remaining)
+        with self._lock:
+            self._entries[digest] = (deadline, snapshot)
+            self._entries.move_to_end(digest)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def evict(self, digest):
+        with self._lock:
+            self._entries.pop(digest, None)
+
+    def evict_user(self, user_id):
+        """Drop every cached token of a user, e.g. after the user changed."""
+        with self._lock:
+            for digest in [digest for digest, (_, snapshot) in self._entries.items() if snapshot['id'] == user_id]:
+                del self._entries[digest]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {'size': len(self._entries), 'hits': self.hits, 'misses': self.misses}
+
+
+token_cache = TokenCache(
+    max_size=getattr(settings, 'AUTH_TOKEN_CACHE_SIZE', 10000),
+    ttl=getattr(settings, 'AUTH_TOKEN_CACHE_TTL', 60),
+)
+
+
+def _snapshot(user):
+    """Return the concrete field values of a user, enough to rebuild it without a query."""
+    return {field.attname: getattr(user, field.attname) for field in user._meta.concrete_fields}
+
+
+def _user_from_snapshot(snapshot):
+    """Build a fresh user instance from a snapshot, so requests never share one."""
+    User = get_user_model()
+    field_names = list(snapshot)
+    return User.from_db('default', field_names, [snapshot[name] for name in field_names])
+
+
+def issue_token(user_id, token):
+    """Store a newly issued token for a user; it expires after AUTH_TOKEN_LIFETIME_HOURS."""
+    expires_at = timezone.now() + timedelta(hours=getattr(settings, 'AUTH_TOKEN_LIFETIME_HOURS', 168))
+    digest = token_digest(token)
+    AuthToken.objects.create(key=digest, user_id=user_id, expires_at=expires_at)
+    return expires_at
+
+
+def revoke_token(token):
+    """Delete a token from the store and from this process' cache."""
+    digest = token_digest(token)
+    token_cache.evict(digest)
+    return AuthToken.objects.filter(key=digest).delete()[0] > 0
+
+
+def revoke_user_tokens(user_id):
+    """Delete every token of a user, e.g. when the account is deactivated."""
+    token_cache.evict_user(user_id)
+    return AuthToken.objects.filter(user_id=user_id).delete()[0]
+
+
+def authenticate_token(token):
+    """
+    Return the active user a token belongs to, or None.
+
+    Cache hits cost no queries; a miss loads the token and its user with one
+    joined query and caches the user snapshot.
+    """
+    digest = token_digest(token)
+    snapshot = token_cache.get(digest)
+    if snapshot is not None:
+        return _user_from_snapshot(snapshot)
+
+    auth_token = AuthToken.objects.select_related('user').filter(
+        key=digest, expires_at__gt=timezone.now()
+    ).first()
+    if auth_token is None or not auth_token.user.is_active:
+        return None
+
+    token_cache.set(digest, _snapshot(auth_token.user), auth_token.expires_at)
+    return auth_token.user
+
+
+def purge_expired_tokens():
+    """Delete expired tokens. Returns the number of tokens deleted."""
+    return AuthToken.objects.filter(expires_at__lte=timezone.now()).delete()[0]
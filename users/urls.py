@@ -5,6 +5,7 @@ urlpatterns = [
     path('register/', views.register_user, name='register'),
     path('login/', views.login_user, name='login'),
     path('logout/', views.logout_user, name='logout'),
+    path('token/refresh/', views.refresh_access_token, name='refresh_access_token'),
     path('me/', views.get_current_user, name='current_user'),
     path('profile/update/', views.update_profile, name='update_profile'),
     path('users/', views.list_users, name='list_users'),
@@ -10,7 +10,10 @@ from django.conf import settings
 
 from .models import CustomUser
 from .auth import CustomAuthBackend
+from .decorators import change_markers, conditional_get
+from .access_tokens import access_token_lifetime, issue_access_token, signed_tokens_enabled
 from .middleware import store_user_token, remove_user_token
+from .tokens import authenticate_token, revoke_token
 
 # Set up logging
 logger = logging.getLogger(__name__)
@@ -124,10 +127,10 @@ def login_user(request):
         # Generate a simple token using secrets module
         token = secrets.token_hex(32)
 
-        # Store the token in our global dictionary
+        # Store the token so every worker accepts it
         store_user_token(user.id, token)
 
-        return JsonResponse({
+        response_data = {
             'message': 'Login successful',
             'token': token,
             'user': {
@@ -136,7 +139,15 @@ def login_user(request):
                 'email': user.email,
                 'role': user.role
             }
-        })
+        }
+
+        # In signed mode the stored token only serves to refresh short-lived access tokens
+        if signed_tokens_enabled():
+            response_data['token'] = issue_access_token(user)
+            response_data['refresh_token'] = token
+            response_data['expires_in'] = access_token_lifetime()
+
+        return JsonResponse(response_data)
 
     except json.JSONDecodeError:
         return JsonResponse({'error': 'Invalid JSON data'}, status=400)
@@ -155,15 +166,58 @@ def logout_user(request):
     auth_header = request.META.get('HTTP_AUTHORIZATION', '')
     if auth_header.startswith('Bearer '):
         token = auth_header.split(' ')[1]
-        # Remove the token from our global dictionary
+        # Revoke the token so no worker accepts it any more
         remove_user_token(token)
 
+    # In signed mode the refresh token may be revoked along with the access token
+    if request.body:
+        try:
+            refresh_token = json.loads(request.body).get('refresh_token')
+        except (json.JSONDecodeError, AttributeError):
+            refresh_token = None
+        if refresh_token:
+            revoke_token(refresh_token)
+
     # Also perform regular session logout
     logout(request)
 
     return JsonResponse({'message': 'Logged out successfully'})
 
 @csrf_exempt
+def refresh_access_token(request):
+    """
+    Exchange a refresh token for a new signed access token.
+    Only available when AUTH_TOKEN_MODE is 'signed'.
+    """
+    if request.method != 'POST':
+        return JsonResponse({'error': 'Only POST method is allowed'}, status=405)
+
+    if not signed_tokens_enabled():
+        return JsonResponse({'error': 'Token refresh is only available with signed access tokens'}, status=400)
+
+    try:
+        data = json.loads(request.body)
+    except json.JSONDecodeError:
+        return JsonResponse({'error': 'Invalid JSON data'}, status=400)
+
+    refresh_token = data.get('refresh_token') if isinstance(data, dict) else None
+    if not refresh_token:
+        return JsonResponse({'error': 'refresh_token is required'}, status=400)
+
+    user = authenticate_token(refresh_token)
+    if user is None:
+        return JsonResponse({'error': 'Invalid or expired refresh token'}, status=401)
+
+    return JsonResponse({
+        'token': issue_access_token(user),
+        'expires_in': access_token_lifetime()
+    })
+
+def _current_user_markers(request):
+    return change_markers(CustomUser.objects.filter(id=request.user.id), 'assigned_stores')
+
+@csrf_exempt
+@conditional_get(_current_user_markers)
 def get_current_user(request):
     """
     Get information about the currently logged-in user.
@@ -244,7 +298,13 @@ def update_profile(request):
         logger.error(f"Profile update error: {str(e)}")
         return JsonResponse({'error': str(e)}, status=500)
 
+def _user_list_markers(request):
+    if request.user.role != 'admin':
+        return None
+    return change_markers(CustomUser.objects.all())
+
 @csrf_exempt
+@conditional_get(_user_list_markers)
 def list_users(request):
     """
     Get a list of all users.
@@ -274,7 +334,11 @@ def list_users(request):
 
     return JsonResponse({'users': user_data})
 
+def _manager_list_markers(request):
+    return change_markers(CustomUser.objects.filter(role='manager'))
+
 @csrf_exempt
+@conditional_get(_manager_list_markers)
 def list_managers(request):
     """
     Get a list of all users with manager role.
@@ -298,7 +362,11 @@ def list_managers(request):
 
     return JsonResponse({'users': manager_data})
 
+def _staff_list_markers(request):
+    return change_markers(CustomUser.objects.filter(role='staff'))
+
 @csrf_exempt
+@conditional_get(_staff_list_markers)
 def list_staff(request):
     """
     Get a list of all users with staff role.
@@ -322,7 +390,13 @@ def list_staff(request):
 
     return JsonResponse({'users': staff_data})
 
+def _user_detail_markers(request, user_id):
+    if request.user.role != 'admin' and request.user.id != user_id:
+        return None
+    return change_markers(CustomUser.objects.filter(id=user_id), 'assigned_stores')
+
 @csrf_exempt
+@conditional_get(_user_detail_markers)
 def get_user(request, user_id):
     """
     Get details of a specific user.